@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+benchmark.py
+(c) Will Roberts  18 October, 2026
+
+Benchmarks for ``fsed``.
+
+Times each phase of rewriting separately, on the test corpus bundled
+in ``fsed/tests`` and on synthetic workloads of growing size, and
+reports throughput and peak memory use.
+
+Run from the top of the repository::
+
+    python benchmarks/benchmark.py corpus
+    python benchmarks/benchmark.py scaling --patterns 1000,100000 --input-mb 1,100
+    python benchmarks/benchmark.py many
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+import click
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+
+import fsed.ahocorasick
+import fsed.fsed
+from fsed.utils import open_file
+
+TESTS_DIR = os.path.join(TOP_DIR, 'fsed', 'tests')
+CORPUS_INPUT = os.path.join(TESTS_DIR, 'fsed-testinput.utf8.txt.gz')
+CORPUS_PATTERNS = os.path.join(TESTS_DIR, 'fsed-testpats.tsv')
+
+# the number of characters of input given to the chart parser
+# (AhoCorasickTrie.replace), which is much slower than the others
+SLOW_INPUT_CHARS = 1 << 18
+
+# the fsed command line, with options for each engine
+FSED_COMMAND = [sys.executable, '-m', 'fsed.fsed', '--quiet']
+ENGINES = {
+    'greedy': [],
+    'by-line': ['--by-line'],
+    'longest': ['--longest'],
+    'words': ['--words'],
+    'jobs': ['--jobs', '4'],
+}
+
+def run_command(args, stdin=None, stdout=None):
+    '''
+    Runs a command and waits for it to finish.  Returns a tuple
+    ``(seconds, peak_rss, returncode)``, where ``peak_rss`` is the
+    largest resident set size of the process, in bytes, or None
+    where this cannot be measured.
+
+    Arguments:
+    - `args`: the command line
+    - `stdin`: an optional file to read standard input from
+    - `stdout`: an optional file to write standard output to; by
+      default, it is discarded
+    '''
+    devnull = None
+    if stdout is None:
+        stdout = devnull = open(os.devnull, 'wb')
+    try:
+        started = time.time()
+        process = subprocess.Popen(args, stdin=stdin, stdout=stdout, cwd=TOP_DIR)
+        peak_rss = None
+        if hasattr(os, 'wait4'):
+            _pid, status, usage = os.wait4(process.pid, 0)
+            process.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                                  else -os.WTERMSIG(status))
+            # ru_maxrss is in kilobytes on Linux, in bytes on Mac OS X
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        else:
+            process.wait()
+        return time.time() - started, peak_rss, process.returncode
+    finally:
+        if devnull is not None:
+            devnull.close()
+
+def measure(func, setup=None, memory=True):
+    '''
+    Times one call of ``func``.  With ``memory``, ``func`` is called
+    a second time under ``tracemalloc``, so that tracing does not
+    distort the timing.  Returns a tuple ``(seconds, peak_memory)``,
+    where ``peak_memory`` is the largest number of bytes allocated
+    during the call, or None.
+
+    Arguments:
+    - `func`: a function of one argument
+    - `setup`: an optional function which returns the argument for
+      ``func``; it is called again, untimed, before each call
+    - `memory`:
+    '''
+    setup = setup or (lambda: None)
+    arg = setup()
+    started = time.time()
+    func(arg)
+    seconds = time.time() - started
+    peak_memory = None
+    if memory and tracemalloc is not None:
+        arg = setup()
+        tracemalloc.start()
+        try:
+            func(arg)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_memory
+
+class Report(object):
+    '''
+    Collects benchmark results, and prints them as they come in.
+    '''
+
+    def __init__(self):
+        '''Constructor.'''
+        self.records = []
+
+    def add(self, workload, phase, seconds, num_bytes=None, peak_memory=None):
+        '''
+        Records the result of one benchmark.
+
+        Arguments:
+        - `workload`: a description of the patterns and input
+        - `phase`: the name of the phase which was timed
+        - `seconds`:
+        - `num_bytes`: the size of the input processed, if the phase
+          reads input
+        - `peak_memory`: in bytes, or None
+        '''
+        record = {'workload': workload, 'phase': phase, 'seconds': seconds,
+                  'bytes': num_bytes, 'peak_memory': peak_memory,
+                  'mb_per_second': (num_bytes / seconds / 1e6
+                                    if num_bytes and seconds else None)}
+        self.records.append(record)
+        print('{:<28} {:<26} {:>9.3f}s {:>10} {:>12}'.format(
+            workload, phase, seconds,
+            '' if record['mb_per_second'] is None else
+            '{:.2f} MB/s'.format(record['mb_per_second']),
+            '' if peak_memory is None else
+            '{:.1f} MB'.format(peak_memory / float(1 << 20))))
+        sys.stdout.flush()
+
+    def save(self, filename):
+        '''
+        Writes the results to a JSON file.
+
+        Arguments:
+        - `filename`:
+        '''
+        with io.open(filename, 'w', encoding='utf-8') as output_file:
+            output_file.write(json.dumps(self.records, indent=2, sort_keys=True))
+
+def consume(iterable):
+    '''
+    Exhausts an iterable.
+    '''
+    for _item in iterable:
+        pass
+
+def benchmark_cli(report, workload, pattern_filename, input_filename, engines):
+    '''
+    Times end-to-end runs of the ``fsed`` command line utility.
+
+    Arguments:
+    - `report`: a ``Report``
+    - `workload`:
+    - `pattern_filename`:
+    - `input_filename`: an uncompressed input file
+    - `engines`: a list of keys of ``ENGINES``
+    '''
+    num_bytes = os.path.getsize(input_filename)
+    for engine in engines:
+        seconds, peak_rss, returncode = run_command(
+            FSED_COMMAND + ENGINES[engine] + [pattern_filename, input_filename])
+        if returncode:
+            raise click.ClickException('fsed failed with engine {}'.format(engine))
+        report.add(workload, 'cli ' + engine, seconds, num_bytes, peak_rss)
+
+def benchmark_corpus(report, memory, engines):
+    '''
+    Times each phase of rewriting the bundled test corpus with the
+    bundled patterns, on word boundaries.
+
+    Arguments:
+    - `report`: a ``Report``
+    - `memory`: whether to measure peak memory use
+    - `engines`: the engines to run the command line utility with
+    '''
+    workload = 'corpus'
+    with open_file(CORPUS_INPUT) as input_file:
+        data = input_file.read()
+    text = data.decode('utf-8')
+    num_bytes = len(data)
+
+    def build(_arg):
+        return fsed.fsed.build_trie(CORPUS_PATTERNS, 'tsv', 'utf-8', True)
+    trie = build(None)[0]
+    seconds, peak = measure(build, memory=memory)
+    report.add(workload, 'build_trie', seconds, None, peak)
+    seconds, peak = measure(lambda trie: trie._set_suffix_links(),
+                            lambda: build(None)[0], memory)
+    report.add(workload, '_set_suffix_links', seconds, None, peak)
+    seconds, peak = measure(lambda _arg: trie.compile(), memory=memory)
+    report.add(workload, 'compile', seconds, None, peak)
+    compiled = trie.compile()
+
+    transformed = fsed.ahocorasick.boundary_transform(text)
+    seconds, peak = measure(lambda _arg: fsed.ahocorasick.boundary_transform(text),
+                            memory=memory)
+    report.add(workload, 'boundary_transform', seconds, num_bytes, peak)
+    seconds, peak = measure(lambda _arg: ''.join(
+        fsed.ahocorasick.boundary_transform_iter(text)), memory=memory)
+    report.add(workload, 'boundary_transform_iter', seconds, num_bytes, peak)
+    seconds, peak = measure(lambda _arg: fsed.ahocorasick.boundary_untransform(
+        transformed), memory=memory)
+    report.add(workload, 'boundary_untransform', seconds, num_bytes, peak)
+
+    for name, engine in [('trie', trie), ('compiled', compiled)]:
+        seconds, peak = measure(lambda _arg: consume(engine.find_all(transformed)),
+                                memory=memory)
+        report.add(workload, 'find_all ' + name, seconds, num_bytes, peak)
+        seconds, peak = measure(lambda _arg: engine.greedy_replace(transformed),
+                                memory=memory)
+        report.add(workload, 'greedy_replace ' + name, seconds, num_bytes, peak)
+    seconds, peak = measure(lambda _arg: compiled.greedy_replace_words(text),
+                            memory=memory)
+    report.add(workload, 'greedy_replace_words', seconds, num_bytes, peak)
+    seconds, peak = measure(lambda _arg: compiled.longest_replace(transformed),
+                            memory=memory)
+    report.add(workload, 'longest_replace', seconds, num_bytes, peak)
+    seconds, peak = measure(lambda _arg: compiled.greedy_replace_bytes(data),
+                            memory=memory)
+    report.add(workload, 'greedy_replace_bytes', seconds, num_bytes, peak)
+    slow_input = transformed[:SLOW_INPUT_CHARS]
+    seconds, peak = measure(lambda _arg: trie.replace(slow_input), memory=memory)
+    report.add(workload, 'replace', seconds, len(slow_input.encode('utf-8')), peak)
+
+    if engines:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            input_filename = os.path.join(tmpdir, 'input.txt')
+            with open(input_filename, 'wb') as output_file:
+                output_file.write(data)
+            benchmark_cli(report, workload, CORPUS_PATTERNS, input_filename, engines)
+        finally:
+            shutil.rmtree(tmpdir)
+
+def random_word(rnd):
+    '''
+    Returns a random lowercase word.
+    '''
+    return ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz')
+                   for _ in range(rnd.randint(3, 12)))
+
+def write_synthetic_patterns(filename, rnd, num_patterns):
+    '''
+    Writes a TSV pattern file of ``num_patterns`` distinct patterns of
+    one to three random words.  Returns the list of patterns.
+
+    Arguments:
+    - `filename`:
+    - `rnd`: a ``random.Random`` object
+    - `num_patterns`:
+    '''
+    vocabulary = [random_word(rnd) for _ in range(max(100, num_patterns // 2))]
+    patterns = set()
+    while len(patterns) < num_patterns:
+        patterns.add(' '.join(rnd.choice(vocabulary)
+                              for _ in range(rnd.randint(1, 3))))
+    patterns = sorted(patterns)
+    with io.open(filename, 'w', encoding='utf-8') as output_file:
+        for pattern in patterns:
+            output_file.write('{}\t{}\n'.format(pattern, pattern.upper()))
+    return patterns
+
+def write_synthetic_input(filename, rnd, patterns, num_bytes):
+    '''
+    Writes about ``num_bytes`` of random text, in lines of random
+    words, where about one word in five starts a pattern.
+
+    Arguments:
+    - `filename`:
+    - `rnd`: a ``random.Random`` object
+    - `patterns`: the list of patterns
+    - `num_bytes`:
+    '''
+    # build a pool of lines and repeat it, so that generating a
+    # large input does not take longer than rewriting it
+    lines = []
+    for _ in range(4096):
+        words = [rnd.choice(patterns) if rnd.random() < 0.2 else random_word(rnd)
+                 for _ in range(rnd.randint(5, 20))]
+        lines.append(' '.join(words) + '\n')
+    pool = ''.join(lines).encode('utf-8')
+    with open(filename, 'wb') as output_file:
+        written = 0
+        while written < num_bytes:
+            chunk = pool[:num_bytes - written]
+            output_file.write(chunk)
+            written += len(chunk)
+
+def benchmark_scaling(report, memory, engines, pattern_counts, input_sizes, seed):
+    '''
+    Times building the automaton and rewriting for synthetic pattern
+    sets and inputs of growing size.
+
+    Arguments:
+    - `report`: a ``Report``
+    - `memory`: whether to measure peak memory use
+    - `engines`: the engines to run the command line utility with
+    - `pattern_counts`: a list of numbers of patterns
+    - `input_sizes`: a list of input sizes in bytes
+    - `seed`: the random seed for generating patterns and input
+    '''
+    rnd = random.Random(seed)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for num_patterns in pattern_counts:
+            pattern_filename = os.path.join(tmpdir, 'patterns.tsv')
+            patterns = write_synthetic_patterns(pattern_filename, rnd, num_patterns)
+            workload = '{} patterns'.format(num_patterns)
+
+            def build(_arg):
+                return fsed.fsed.build_trie(pattern_filename, 'tsv', 'utf-8', False)[0]
+            seconds, peak = measure(build, memory=memory)
+            report.add(workload, 'build_trie', seconds, None, peak)
+            trie = build(None)
+            seconds, peak = measure(lambda trie: trie._set_suffix_links(),
+                                    lambda: build(None), memory)
+            report.add(workload, '_set_suffix_links', seconds, None, peak)
+            seconds, peak = measure(lambda _arg: trie.compile(), memory=memory)
+            report.add(workload, 'compile', seconds, None, peak)
+            compiled = trie.compile()
+            del trie
+            for num_bytes in input_sizes:
+                input_filename = os.path.join(tmpdir, 'input.txt')
+                write_synthetic_input(input_filename, rnd, patterns, num_bytes)
+                workload = '{} patterns, {} MB'.format(num_patterns, num_bytes >> 20)
+
+                def rewrite(_arg):
+                    with open(input_filename, 'rb') as input_file, \
+                         open(os.devnull, 'wb') as output_file:
+                        fsed.fsed.rewrite_file(input_file, output_file, compiled,
+                                               False, False, False, 'utf-8')
+                # the input is streamed, so memory use is that of the
+                # automaton, and is not measured again
+                seconds, _peak = measure(rewrite, memory=False)
+                report.add(workload, 'rewrite_file', seconds, num_bytes)
+                benchmark_cli(report, workload, pattern_filename, input_filename,
+                              engines)
+                os.remove(input_filename)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def benchmark_many(report, memory, lengths):
+    '''
+    Times rewriting the bundled test corpus as many short strings,
+    one call of ``rewrite_str_with_trie`` per string against one call
+    of ``rewrite_many`` for all of them, and reports the time per
+    string.  Also times counting and finding the matches in the same
+    strings with ``count_all``, ``count_all_many`` and
+    ``find_all_many``.
+
+    Arguments:
+    - `report`: a ``Report``
+    - `memory`: whether to measure peak memory use
+    - `lengths`: a list of string lengths (in characters) to cut the
+      corpus into
+    '''
+    with open_file(CORPUS_INPUT) as input_file:
+        text = input_file.read().decode('utf-8')
+    for words in [False, True]:
+        trie, boundaries = fsed.fsed.build_trie(CORPUS_PATTERNS, 'tsv', 'utf-8', words)
+        compiled = trie.compile()
+        for length in lengths:
+            strings = [text[idx:idx + length] for idx in range(0, len(text), length)]
+            num_bytes = sum(len(sval.encode('utf-8')) for sval in strings)
+            workload = '{} strings of {}{}'.format(len(strings), length,
+                                                   ' -w' if words else '')
+            results = {}
+            for name, func in [
+                    ('rewrite_str_with_trie', lambda _arg: [
+                        fsed.fsed.rewrite_str_with_trie(sval, compiled, boundaries)
+                        for sval in strings]),
+                    ('rewrite_many', lambda _arg: fsed.fsed.rewrite_many(
+                        strings, compiled, boundaries))]:
+                seconds, peak = measure(func, memory=memory)
+                report.add(workload, name, seconds, num_bytes, peak)
+                results[name] = seconds
+            print('{:<28} {:.2f} us per string one at a time, {:.2f} us in '
+                  'batches'.format(workload,
+                                   1e6 * results['rewrite_str_with_trie'] / len(strings),
+                                   1e6 * results['rewrite_many'] / len(strings)))
+            if words:
+                continue
+            for name, func in [
+                    ('count_all', lambda _arg: [compiled.count_all(sval) for sval in strings]),
+                    ('count_all_many', lambda _arg: compiled.count_all_many(strings)),
+                    ('find_all_many', lambda _arg: compiled.find_all_many(strings))]:
+                seconds, peak = measure(func, memory=memory)
+                report.add(workload, name, seconds, num_bytes, peak)
+
+def parse_sizes(value):
+    '''
+    Parses a comma-separated list of integers.
+    '''
+    return [int(size) for size in value.split(',') if size]
+
+@click.group()
+@click.option('--json', 'json_filename', type=click.Path(dir_okay=False),
+              help='Also write the results to this file as JSON.')
+@click.option('--memory/--no-memory', default=True, show_default=True,
+              help='Measure peak memory use of each phase (this runs '
+              'each phase a second time under tracemalloc).')
+@click.option('--engines', default='greedy,by-line,longest,words', show_default=True,
+              help='Run the fsed command line utility with these engines '
+              '(any of {}); empty to skip.'.format(', '.join(sorted(ENGINES))))
+@click.pass_context
+def main(ctx, json_filename, memory, engines):
+    '''
+    Benchmarks fsed.
+    '''
+    logging.getLogger('fsed').setLevel(logging.WARNING)
+    engines = [engine for engine in engines.split(',') if engine]
+    for engine in engines:
+        if engine not in ENGINES:
+            raise click.BadParameter('unknown engine {}'.format(engine))
+    ctx.obj = {'report': Report(), 'memory': memory, 'engines': engines}
+    if json_filename:
+        ctx.call_on_close(lambda: ctx.obj['report'].save(json_filename))
+    print('{:<28} {:<26} {:>10} {:>10} {:>12}'.format(
+        'workload', 'phase', 'time', 'throughput', 'peak memory'))
+
+@main.command()
+@click.pass_context
+def corpus(ctx):
+    '''
+    Benchmarks each phase on the bundled test corpus.
+    '''
+    benchmark_corpus(ctx.obj['report'], ctx.obj['memory'], ctx.obj['engines'])
+
+@main.command()
+@click.option('--patterns', 'pattern_counts', default='1000,10000,100000',
+              show_default=True,
+              help='Comma-separated numbers of synthetic patterns (up to 1000000).')
+@click.option('--input-mb', 'input_mb', default='1,10', show_default=True,
+              help='Comma-separated sizes of synthetic input in MB (up to 1024).')
+@click.option('--seed', default=17, show_default=True, help='Random seed.')
+@click.pass_context
+def scaling(ctx, pattern_counts, input_mb, seed):
+    '''
+    Benchmarks synthetic workloads of growing size.
+    '''
+    benchmark_scaling(ctx.obj['report'], ctx.obj['memory'], ctx.obj['engines'],
+                      parse_sizes(pattern_counts),
+                      [size << 20 for size in parse_sizes(input_mb)], seed)
+
+@main.command()
+@click.option('--lengths', default='10,30,100,1000', show_default=True,
+              help='Comma-separated string lengths to cut the corpus into.')
+@click.pass_context
+def many(ctx, lengths):
+    '''
+    Benchmarks rewriting many short strings.
+    '''
+    benchmark_many(ctx.obj['report'], ctx.obj['memory'], parse_sizes(lengths))
+
+if __name__ == '__main__':
+    main()
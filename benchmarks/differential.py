@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+differential.py
+(c) Will Roberts  18 October, 2026
+
+Differential test of ``fsed`` against ``sed`` and ``perl``.
+
+Runs ``fsed``, ``sed -f`` and ``perl`` on the same patterns and
+input, checks that their outputs are identical (and identical to the
+stored reference outputs, for the bundled test corpus), and reports
+their wall time and peak memory use relative to ``fsed``.
+
+Run from the top of the repository::
+
+    python benchmarks/differential.py
+    python benchmarks/differential.py --repeat 20 --max-slowdown 2
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+import difflib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import click
+
+from benchmark import FSED_COMMAND, TESTS_DIR, run_command
+from fsed.utils import open_file
+
+CORPUS_INPUT = os.path.join(TESTS_DIR, 'fsed-testinput.utf8.txt.gz')
+REFERENCE_OUTPUTS = [os.path.join(TESTS_DIR, 'sed-output.utf8.txt.gz'),
+                     os.path.join(TESTS_DIR, 'perl-output.utf8.txt.gz')]
+
+def is_gnu_sed(sed):
+    '''
+    Returns True if the given sed executable is GNU sed, whose word
+    boundary syntax (``\\b``) differs from BSD sed's.
+
+    Arguments:
+    - `sed`:
+    '''
+    try:
+        output = subprocess.check_output([sed, '--version'], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return b'GNU' in output
+
+def default_commands(sed, perl):
+    '''
+    Returns the commands which rewrite the bundled test corpus, as a
+    list of ``(name, command)`` tuples.
+
+    Arguments:
+    - `sed`: the sed executable, or None to skip sed
+    - `perl`: the perl executable, or None to skip perl
+    '''
+    commands = [
+        ('fsed tsv', FSED_COMMAND + ['-w', os.path.join(TESTS_DIR, 'fsed-testpats.tsv')]),
+        ('fsed sed', FSED_COMMAND + [os.path.join(TESTS_DIR, 'fsed-testpats.wb.sed')]),
+        ('fsed sed --by-line', FSED_COMMAND + [
+            '--by-line', os.path.join(TESTS_DIR, 'fsed-testpats.wb.sed')]),
+    ]
+    if sed:
+        if is_gnu_sed(sed):
+            commands.append(('sed', [sed, '-f',
+                                     os.path.join(TESTS_DIR, 'fsed-testpats.wb.sed')]))
+        else:
+            commands.append(('sed', [sed, '-E', '-f', os.path.join(
+                TESTS_DIR, 'fsed-testpats.wb.bsd.utf8.sed')]))
+    if perl:
+        commands.append(('perl', [perl, os.path.join(TESTS_DIR,
+                                                     'fsed-testpats.utf8.pl')]))
+    return commands
+
+def first_difference(filename1, filename2, context=3):
+    '''
+    Compares two files line by line.  Returns None if they are
+    identical, and otherwise a unified diff of the first lines which
+    differ.
+
+    Arguments:
+    - `filename1`:
+    - `filename2`:
+    - `context`: the number of lines of context to show
+    '''
+    with open_file(filename1) as file1, open_file(filename2) as file2:
+        lineno = 0
+        previous = []
+        while True:
+            line1 = file1.readline()
+            line2 = file2.readline()
+            if line1 != line2:
+                lines1 = previous + [line1] + [file1.readline() for _ in range(context)]
+                lines2 = previous + [line2] + [file2.readline() for _ in range(context)]
+                diff = difflib.unified_diff(
+                    [line.decode('utf-8', 'replace') for line in lines1 if line],
+                    [line.decode('utf-8', 'replace') for line in lines2 if line],
+                    filename1, filename2, lineterm='')
+                return 'first difference at line {}:\n{}'.format(
+                    lineno + 1, '\n'.join(line.rstrip('\n') for line in diff))
+            if not line1:
+                return None
+            lineno += 1
+            previous = (previous + [line1])[-context:]
+
+@click.command()
+@click.option('--input', 'input_filename', type=click.Path(exists=True, dir_okay=False),
+              default=CORPUS_INPUT, show_default=True,
+              help='The input file (may be gzipped).')
+@click.option('--command', 'extra_commands', multiple=True, metavar='NAME=COMMAND',
+              help='Run this shell command, which reads the input on '
+              'standard input, instead of the commands for the bundled '
+              'patterns; may be given more than once.')
+@click.option('--repeat', default=1, show_default=True, type=click.IntRange(1),
+              help='Concatenate the input this many times, for longer runs.')
+@click.option('--sed', default='sed', show_default=True,
+              help='The sed executable; empty to skip sed.')
+@click.option('--perl', default='perl', show_default=True,
+              help='The perl executable; empty to skip perl.')
+@click.option('--max-slowdown', type=float,
+              help='Fail if fsed is more than this many times slower than '
+              'the fastest other command.')
+@click.option('--json', 'json_filename', type=click.Path(dir_okay=False),
+              help='Also write the results to this file as JSON.')
+def main(input_filename, extra_commands, repeat, sed, perl, max_slowdown,
+         json_filename):
+    '''
+    Runs fsed, sed and perl on the same input and compares their
+    outputs, speed and memory use.
+    '''
+    if extra_commands:
+        commands = []
+        for extra_command in extra_commands:
+            if '=' not in extra_command:
+                raise click.BadParameter('expected NAME=COMMAND: {}'.format(extra_command))
+            name, command = extra_command.split('=', 1)
+            commands.append((name, ['/bin/sh', '-c', command]))
+    else:
+        commands = default_commands(sed or None, perl or None)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # all commands read the same uncompressed input
+        plain_input = os.path.join(tmpdir, 'input.txt')
+        with open_file(input_filename) as input_file:
+            data = input_file.read()
+        with open(plain_input, 'wb') as output_file:
+            for _ in range(repeat):
+                output_file.write(data)
+        num_bytes = len(data) * repeat
+        references = []
+        if input_filename == CORPUS_INPUT and repeat == 1 and not extra_commands:
+            references = REFERENCE_OUTPUTS
+        results = []
+        for index, (name, command) in enumerate(commands):
+            output_filename = os.path.join(tmpdir, 'output{}.txt'.format(index))
+            with open(plain_input, 'rb') as stdin, open(output_filename, 'wb') as stdout:
+                seconds, peak_rss, returncode = run_command(command, stdin, stdout)
+            results.append({'name': name, 'command': command, 'seconds': seconds,
+                            'peak_memory': peak_rss, 'returncode': returncode,
+                            'output': output_filename})
+        # compare every output to the first one, and to the references
+        failures = []
+        baseline = results[0]
+        for result in results:
+            if result['returncode']:
+                failures.append('{} exited with status {}'.format(result['name'],
+                                                                  result['returncode']))
+                continue
+            others = [(baseline['name'], baseline['output'])] if result is not baseline else []
+            others += [(os.path.basename(reference), reference) for reference in references]
+            for other_name, other_output in others:
+                difference = first_difference(other_output, result['output'])
+                if difference is not None:
+                    failures.append('{} differs from {}: {}'.format(result['name'],
+                                                                    other_name, difference))
+        fsed_times = [result['seconds'] for result in results
+                      if result['name'].startswith('fsed')]
+        fsed_seconds = min(fsed_times) if fsed_times else None
+        print('{:<24} {:>9} {:>10} {:>12} {:>10}'.format(
+            'command', 'time', 'throughput', 'peak memory', 'vs fsed'))
+        for result in results:
+            print('{:<24} {:>8.3f}s {:>10} {:>12} {:>10}'.format(
+                result['name'], result['seconds'],
+                '{:.2f} MB/s'.format(num_bytes / result['seconds'] / 1e6),
+                '' if result['peak_memory'] is None else
+                '{:.1f} MB'.format(result['peak_memory'] / float(1 << 20)),
+                '' if fsed_seconds is None else
+                '{:.2f}x'.format(result['seconds'] / fsed_seconds)))
+        others = [result['seconds'] for result in results
+                  if not result['name'].startswith('fsed')]
+        if max_slowdown and fsed_seconds and others:
+            if fsed_seconds > max_slowdown * min(others):
+                failures.append('fsed is {:.2f} times slower than the fastest other '
+                                'command'.format(fsed_seconds / min(others)))
+        if json_filename:
+            with io.open(json_filename, 'w', encoding='utf-8') as output_file:
+                output_file.write(json.dumps(
+                    {'bytes': num_bytes, 'failures': failures,
+                     'results': [dict((key, value) for key, value in result.items()
+                                      if key != 'output') for result in results]},
+                    indent=2, sort_keys=True))
+    finally:
+        shutil.rmtree(tmpdir)
+    for failure in failures:
+        click.echo(failure, err=True)
+    if failures:
+        sys.exit(1)
+    click.echo('all outputs are identical', err=True)
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ Second attempt writing Aho-Corasick string matching in Python.
 
 from __future__ import absolute_import, print_function, unicode_literals
 from collections import deque
+from fsed.compat import string_type
+import re
 
 
 # ============================================================
@@ -35,6 +37,9 @@ class TrieNode(dict):
         # the longest prefix of this node that is an accepting state
         # in the trie FSM
         self.longest_prefix = None
+        # suffix_of is a dict (or None) mapping id(node) to node for
+        # every node whose suffix link points to this one
+        self.suffix_of = None
 
     def __unicode__(self):
         if self.depth == 0:
@@ -62,6 +67,12 @@ class TrieNode(dict):
         self._value = newval
         self.has_value = True
 
+    @value.deleter
+    def value(self):
+        '''Removes this node's value.'''
+        self._value = None
+        self.has_value = False
+
     @property
     def has_suffix(self):
         '''
@@ -107,6 +118,57 @@ class Trie(object):
         return current.value
 
     def __setitem__(self, seq, value):
+        self._add_path(seq).value = value
+
+    def __delitem__(self, seq):
+        path = self._value_path(seq)
+        del path[-1].value
+        self._prune(path)
+
+    def _value_path(self, seq):
+        '''
+        Returns the list of nodes on the path from the root to the node
+        for ``seq``.  Raises KeyError if no value is stored for ``seq``.
+
+        Arguments:
+        - `seq`:
+        '''
+        path = [self.root]
+        for char in seq:
+            if char not in path[-1]:
+                raise KeyError(path[-1].prefix + char)
+            path.append(path[-1][char])
+        if not path[-1].has_value:
+            raise KeyError(path[-1].prefix)
+        return path
+
+    def _prune(self, path):
+        '''
+        Removes the nodes at the end of ``path`` which lead to no value.
+        Returns the list of removed nodes, deepest first.
+
+        Arguments:
+        - `path`: a list of nodes from the root, as returned by
+          ``_value_path``
+        '''
+        removed = []
+        while len(path) > 1 and not path[-1].has_value and not len(path[-1]):
+            current = path.pop()
+            del path[-1][current.uplink]
+            removed.append(current)
+        return removed
+
+    def _add_path(self, seq, new_nodes = None):
+        '''
+        Returns the node for ``seq``, creating it and any missing nodes
+        on the path to it from the root.
+
+        Arguments:
+        - `seq`:
+        - `new_nodes`: an optional list, which is extended with a tuple
+          `(node, parent)` for every node created, in order from the
+          root
+        '''
         current = self.root
         for char in seq:
             if char not in current:
@@ -115,8 +177,22 @@ class Trie(object):
                 new_node.depth = current.depth + 1
                 new_node.prefix = current.prefix + char
                 current[char] = new_node
+                if new_nodes is not None:
+                    new_nodes.append((new_node, current))
             current = current[char]
-        current.value = value
+        return current
+
+    def update(self, items):
+        '''
+        Stores all the given `(seq, value)` pairs in this trie.
+
+        Arguments:
+        - `items`: a dict, or an iterable of `(seq, value)` pairs
+        '''
+        if hasattr(items, 'items'):
+            items = items.items()
+        for seq, value in items:
+            self[seq] = value
 
     def dfs(self):
         '''
@@ -178,9 +254,56 @@ class AhoCorasickTrie(Trie):
         self._suffix_links_set = False
 
     def __setitem__(self, seq, value):
-        super(AhoCorasickTrie, self).__setitem__(seq, value)
+        if not self._suffix_links_set:
+            super(AhoCorasickTrie, self).__setitem__(seq, value)
+            return
+        # keep the suffix links valid
+        new_nodes = []
+        current = self._add_path(seq, new_nodes)
+        had_value = current.has_value
+        current.value = value
+        if new_nodes or not had_value:
+            self._add_suffix_links(new_nodes, None if had_value else current)
+
+    def __delitem__(self, seq):
+        if not self._suffix_links_set:
+            super(AhoCorasickTrie, self).__delitem__(seq)
+            return
+        # keep the suffix links valid
+        path = self._value_path(seq)
+        current = path[-1]
+        del current.value
+        # the dictionary links which led to current
+        todo = deque((current.suffix_of or {}).values())
+        # the longest_prefix links below current
+        stack = list(current.values())
+        while stack:
+            child = stack.pop()
+            child.longest_prefix = current.longest_prefix
+            if not child.has_value:
+                stack.extend(child.values())
+        for removed in self._prune(path):
+            # the nodes whose longest proper suffix was the removed node
+            # now have the removed node's suffix
+            for other in list((removed.suffix_of or {}).values()):
+                self._set_suffix(other, removed.suffix)
+                todo.append(other)
+            del removed.suffix.suffix_of[id(removed)]
+        self._update_dict_suffixes(todo)
+
+    def update(self, items):
+        '''
+        Stores all the given `(seq, value)` pairs in this trie.  Suffix
+        links are not kept valid during the insertion, as they are by
+        ``__setitem__``; instead, they are recomputed once, when the
+        trie is next searched.
+
+        Arguments:
+        - `items`: a dict, or an iterable of `(seq, value)` pairs
+        '''
         if self._suffix_links_set:
             self._reset_suffix_links()
+        super(AhoCorasickTrie, self).update(items)
 
     def _reset_suffix_links(self):
         '''
@@ -191,6 +314,106 @@ class AhoCorasickTrie(Trie):
             current.suffix = None
             current.dict_suffix = None
             current.longest_prefix = None
+            current.suffix_of = None
+
+    def _find_suffix(self, current, parent):
+        '''
+        Returns the node for the longest proper suffix of ``current``
+        in this trie, following the suffix links from ``parent``.
+
+        Arguments:
+        - `current`: a node other than the root
+        - `parent`: the parent of ``current``
+        '''
+        suffix = parent
+        while suffix.has_suffix:
+            suffix = suffix.suffix
+            if current.uplink in suffix:
+                return suffix[current.uplink]
+        return self.root
+
+    @staticmethod
+    def _set_suffix(current, suffix):
+        '''
+        Points the suffix link of ``current`` at ``suffix``, and keeps
+        the ``suffix_of`` dicts up to date.
+
+        Arguments:
+        - `current`:
+        - `suffix`:
+        '''
+        if current.suffix is not None:
+            del current.suffix.suffix_of[id(current)]
+        current.suffix = suffix
+        if suffix.suffix_of is None:
+            suffix.suffix_of = {}
+        suffix.suffix_of[id(current)] = current
+
+    def _add_suffix_links(self, new_nodes, new_value):
+        '''
+        Updates the links in this trie after a single insertion, while
+        the suffix links are set.  Only the nodes whose links change
+        are visited: the new nodes, the existing nodes whose longest
+        proper suffix is now a new node, and the nodes whose suffix
+        links lead to these.
+
+        Arguments:
+        - `new_nodes`: the list of `(node, parent)` tuples for the
+          nodes created by the insertion, in order from the root
+        - `new_value`: the node which has gained a value, or None
+        '''
+        # nodes whose dictionary links may have changed
+        todo = deque()
+        for current, parent in new_nodes:
+            current.longest_prefix = parent if parent.has_value else parent.longest_prefix
+            self._set_suffix(current, self._find_suffix(current, parent))
+            todo.append(current)
+            # an existing node whose prefix ends with current's prefix
+            # is a child of a node whose suffix links lead to parent;
+            # below the first such node with a child on current.uplink,
+            # the suffix links lead to that child instead
+            char = current.uplink
+            stack = list((parent.suffix_of or {}).values())
+            while stack:
+                other = stack.pop()
+                if char not in other:
+                    stack.extend((other.suffix_of or {}).values())
+                    continue
+                child = other[char]
+                if (child is not current and child.suffix is not None and
+                        child.suffix.depth < current.depth):
+                    self._set_suffix(child, current)
+                    todo.append(child)
+        if new_value is not None:
+            todo.extend((new_value.suffix_of or {}).values())
+            # the longest_prefix links below new_value
+            stack = list(new_value.values())
+            while stack:
+                child = stack.pop()
+                child.longest_prefix = new_value
+                if not child.has_value:
+                    stack.extend(child.values())
+        self._update_dict_suffixes(todo)
+
+    @staticmethod
+    def _update_dict_suffixes(todo):
+        '''
+        Recomputes the dictionary links of the nodes in ``todo``, and,
+        wherever one changes, of the nodes whose suffix links lead to
+        it.
+
+        Arguments:
+        - `todo`: a deque of nodes whose suffix link, or whose suffix's
+          links or value, have changed
+        '''
+        while todo:
+            current = todo.popleft()
+            suffix = current.suffix
+            dict_suffix = suffix if suffix.has_value else suffix.dict_suffix
+            if dict_suffix is not current.dict_suffix:
+                current.dict_suffix = dict_suffix
+                if not current.has_value:
+                    todo.extend((current.suffix_of or {}).values())
 
     def _set_suffix_links(self):
         '''
@@ -210,16 +433,7 @@ class AhoCorasickTrie(Trie):
                 continue
             # current is not the root and has no suffix
             # set current's suffix to parent's suffix
-            suffix = parent
-            while True:
-                if not suffix.has_suffix:
-                    current.suffix = self.root
-                    break
-                else:
-                    suffix = suffix.suffix
-                if current.uplink in suffix:
-                    current.suffix = suffix[current.uplink]
-                    break
+            self._set_suffix(current, self._find_suffix(current, parent))
             # now find the dict_suffix value
             suffix = current.suffix
             while not suffix.has_value and suffix.has_suffix:
@@ -227,6 +441,24 @@ class AhoCorasickTrie(Trie):
             if suffix.has_value:
                 current.dict_suffix = suffix
 
+    def compile(self, dfa=None, stats=None, engine=None):
+        '''
+        Freezes this trie into a ``CompiledAhoCorasickTrie``, which
+        stores the automaton in flat integer arrays and performs
+        matching much faster.  Later changes to this trie are not
+        reflected in the compiled automaton.
+
+        Arguments:
+        - `dfa`: whether to precompute the complete DFA transition
+          function; see ``CompiledAhoCorasickTrie``
+        - `stats`: an optional ``fsed.stats.Stats`` object to record
+          the time spent compiling in
+        - `engine`: ``'aho-corasick'`` or ``'wu-manber'``, or None to
+          choose one from the patterns; see ``CompiledAhoCorasickTrie``
+        '''
+        from fsed.compiled import CompiledAhoCorasickTrie
+        return CompiledAhoCorasickTrie(self, dfa, stats, engine)
+
     def find_all(self, seq):
         '''
         Generator expression.  Yields tuples of `(begin, length, value)`,
@@ -264,135 +496,165 @@ class AhoCorasickTrie(Trie):
     def replace(self, seq):
         '''
         Performs search and replace on the given input string `seq` using
-        the values stored in this trie.  This method uses a O(n**2)
-        chart-parsing algorithm to find the optimal way of replacing
-        matches in the input.
+        the values stored in this trie.  This method finds the optimal
+        way of replacing matches in the input, i.e., the one which
+        replaces the largest number of input characters.
+
+        This is a dynamic program over the positions in `seq`, which
+        keeps back pointers rather than partial output strings, and
+        runs in time linear in the length of `seq` plus the number of
+        matches found by `find_all`.  Ties are broken as in the
+        O(n**2) chart parser this replaces: a match spanning the
+        whole rest of the input is always taken; otherwise, the
+        shortest first step (an unchanged character or a match) which
+        leads to an optimal solution is taken.
 
         Arguments:
         - `seq`:
         '''
-        # #1: seq must be stored in a container with a len() function
-        seq = list(seq)
-        # chart is a (n-1) X (n) table
-        # chart[0] represents all matches of length (0+1) = 1
-        # chart[n-1] represents all matches/rewrites of length (n-1+1) = n
-        # chart[0][0] represents a match of length 1 starting at character 0
-        # chart[0][n-1] represents a match of length 1 starting at character n-1
-        # cells in the chart are tuples:
-        #    (score, list)
-        # we initialise chart by filling in row 0:
-        #    each cell gets assigned (0, char), where char is the character at
-        #    the corresponding position in the input string
-        chart = [ [None for _i in range(len(seq)) ] for _i in range(len(seq)) ]
-        chart[0] = [(0, char) for char in seq]
-        # now we fill in the chart using the results from the aho-corasick
-        # string matches
-        for (begin, length, value) in self.find_all(seq):
-            chart[length-1][begin] = (length, value)
-        # now we need to fill in the chart row by row, starting with row 1
-        for row in range(1, len(chart)):
-            # each row is 1 cell shorter than the last
-            for col in range(len(seq) - row):
-                # the entry in [row][col] is the choice with the highest score; to
-                # find this, we must search the possible partitions of the cell
-                #
-                # things on row 2 have only one possible partition: 1 + 1
-                # things on row 3 have two: 1 + 2, 2 + 1
-                # things on row 4 have three: 1+3, 3+1, 2+2
-                #
-                # we assume that any pre-existing entry found by aho-corasick
-                # in a cell is already optimal
-                #print('scanning [{}][{}]'.format(row, col))
-                if chart[row][col] is not None:
-                    continue
-                # chart[1][2] is the cell of matches of length 2 starting at
-                # character position 2;
-                # it can only be composed of chart[0][2] + chart[0][3]
-                #
-                # partition_point is the length of the first of the two parts
-                # of the cell
-                #print('cell[{}][{}] => '.format(row, col))
-                best_score = -1
-                best_value = None
-                for partition_point in range(row):
-                    # the two cells will be [partition_point][col] and
-                    # [row - partition_point - 2][col+partition_point+1]
-                    x1 = partition_point
-                    y1 = col
-                    x2 = row - partition_point - 1
-                    y2 = col + partition_point + 1
-                    #print('   [{}][{}] + [{}][{}]'.format(x1, y1, x2, y2))
-                    s1, v1 = chart[x1][y1]
-                    s2, v2 = chart[x2][y2]
-                    # compute the score
-                    score = s1 + s2
-                    #print('   = {}  +  {}'.format((s1, v1), (s2, v2)))
-                    #print('   = score {}'.format(score))
-                    if best_score < score:
-                        best_score = score
-                        best_value = v1 + v2
-                        chart[row][col] = (best_score, best_value)
-                        #print('   sets new best score with value {}'.format(
-                        #    best_value))
-        # now the optimal solution is stored at the top of the chart
-        return chart[len(seq)-1][0][1]
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
+        length = len(seq)
+        # matches[begin] lists the matches starting at position begin
+        # as (length, value) tuples
+        matches = [[] for _i in range(length)]
+        for (begin, match_len, value) in self.find_all(seq):
+            matches[begin].append((match_len, value))
+        # score[pos] is the largest number of characters which can be
+        # replaced in seq[pos:]; choice[pos] is the first match of the
+        # best solution for seq[pos:] as a tuple (length, value), or
+        # None if it leaves seq[pos] unchanged
+        score = [0] * (length + 1)
+        choice = [None] * length
+        for pos in range(length - 1, -1, -1):
+            best_score = score[pos + 1]
+            best_choice = None
+            for match_len, value in sorted(matches[pos], key=lambda match: match[0]):
+                if pos + match_len == length:
+                    best_score = match_len
+                    best_choice = (match_len, value)
+                    break
+                match_score = match_len + score[pos + match_len]
+                # a match of length 1 always replaces the character
+                if best_score < match_score or match_len == 1:
+                    best_score = match_score
+                    best_choice = (match_len, value)
+            score[pos] = best_score
+            choice[pos] = best_choice
+        # follow the back pointers, copying unchanged spans of seq
+        output = []
+        mark = pos = 0
+        while pos < length:
+            if choice[pos] is None:
+                pos += 1
+                continue
+            match_len, value = choice[pos]
+            output.append(seq[mark:pos])
+            output.append(value)
+            pos += match_len
+            mark = pos
+        output.append(seq[mark:])
+        return ''.join(output)
+
+    def longest_replace(self, seq):
+        '''
+        Matches strings in ``seq`` leftmost-longest, and replaces them
+        with their node values: at each position, the longest pattern
+        starting there is replaced, and matching continues after it.
+        Unlike ``greedy_replace``, a pattern is matched even if it
+        contains a shorter pattern as a prefix.
+
+        Arguments:
+        - `seq`: an iterable of characters to perform search-and-replace on
+        '''
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
+        output = []
+        mark = pos = 0
+        while pos < len(seq):
+            current = self.root
+            best = None
+            end = pos
+            while end < len(seq) and seq[end] in current:
+                current = current[seq[end]]
+                end += 1
+                if current.has_value:
+                    best = (end, current.value)
+            if best is None:
+                pos += 1
+                continue
+            output.append(seq[mark:pos])
+            output.append(best[1])
+            mark = pos = best[0]
+        output.append(seq[mark:])
+        return ''.join(output)
 
     def greedy_replace(self, seq):
         '''
         Greedily matches strings in ``seq``, and replaces them with their
         node values.
 
+        The output is built from slices of ``seq`` between matches,
+        tracked by their offsets, so unchanged text is never copied
+        character by character.
+
         Arguments:
         - `seq`: an iterable of characters to perform search-and-replace on
         '''
         if not self._suffix_links_set:
             self._set_suffix_links()
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
         # start at the root
         current = self.root
-        buffered = ''
-        outstr = ''
-        for char in seq:
+        # output has been produced for seq[:mark]; the characters
+        # after mark are the prefix of current
+        mark = 0
+        output = []
+        for pos, char in enumerate(seq):
             while char not in current:
                 if current.has_dict_suffix:
                     current = current.dict_suffix
-                    outstr += buffered[:-current.depth]
-                    outstr += current.value
-                    buffered = ''
+                    output.append(seq[mark:pos - current.depth])
+                    output.append(current.value)
+                    mark = pos
                     current = self.root
                     break
                 elif current.has_suffix:
                     current = current.suffix
-                    if current.depth:
-                        outstr += buffered[:-current.depth]
-                        buffered = buffered[-current.depth:]
-                    else:
-                        outstr += buffered
-                        buffered = ''
+                    if not current.depth:
                         break
                 else:
                     current = self.root
-                    outstr += buffered
-                    buffered = ''
                     break
             if char in current:
-                buffered += char
                 current = current[char]
                 if current.has_value:
-                    outstr += buffered[:-current.depth]
-                    outstr += current.value
-                    buffered = ''
+                    output.append(seq[mark:pos + 1 - current.depth])
+                    output.append(current.value)
+                    mark = pos + 1
                     current = self.root
             else:
                 assert current is self.root
-                outstr += buffered + char
-                buffered = ''
         if current.has_dict_suffix:
             current = current.dict_suffix
-            outstr += buffered[:-current.depth]
-            outstr += current.value
-        else:
-            outstr += buffered
-        return outstr
+            output.append(seq[mark:len(seq) - current.depth])
+            output.append(current.value)
+            mark = len(seq)
+        output.append(seq[mark:])
+        return ''.join(output)
+
+    def greedy_replace_words(self, seq):
+        '''
+        Performs ``greedy_replace`` on word boundaries, for a trie
+        built from boundary-transformed patterns: the input is
+        boundary transformed before rewriting, and the boundary tokens
+        are removed from the output.
+
+        Arguments:
+        - `seq`: an iterable of characters to perform search-and-replace on
+        '''
+        return boundary_untransform(self.greedy_replace(boundary_transform(seq)))
 
 
 # ============================================================
@@ -401,12 +663,60 @@ class AhoCorasickTrie(Trie):
 
 WHITESPACE_CHARS = ' \t\v\r\n'
 
+# a run of whitespace characters, kept by ``split``
+WHITESPACE_RE = re.compile('([' + WHITESPACE_CHARS + ']+)')
+# a run of two or more boundary token characters
+BOUNDARY_RUN_RE = re.compile('\x00\x00+')
+
 def boundary_transform(seq, force_edges = True):
     '''
     Wraps all word transitions with a boundary token character (\x00).
     If desired (with ``force_edges`` set to ``True``), this inserts
     the boundary character at the beginning and end of the string.
 
+    If ``seq`` is a string, the result is a string, computed by
+    ``boundary_transform_str``; otherwise, the result is an iterator
+    of characters, computed by ``boundary_transform_iter``.
+
+    Arguments:
+    - `seq`:
+    - `force_edges = True`:
+    '''
+    if isinstance(seq, string_type):
+        return boundary_transform_str(seq, force_edges)
+    return boundary_transform_iter(seq, force_edges)
+
+def boundary_transform_str(seq, force_edges = True):
+    '''
+    Performs ``boundary_transform`` on a whole string at once, using
+    regular expressions rather than a generator per character.
+
+    Every run of whitespace is wrapped in boundary tokens.  A \x00
+    in the input toggles the word state in ``boundary_words``, but
+    the boundary token it is replaced with is always merged with the
+    one inserted after it, so boundaries inside the runs between
+    \x00 characters do not depend on the toggling.
+
+    Arguments:
+    - `seq`: a string
+    - `force_edges = True`:
+    '''
+    output = '\x00'.join(WHITESPACE_RE.split(seq))
+    if force_edges:
+        output = '\x00' + output + '\x00'
+    elif seq:
+        # there is no word transition at the start or end of the string
+        if seq[0] in WHITESPACE_CHARS:
+            output = output[1:]
+        if seq[-1] in WHITESPACE_CHARS:
+            output = output[:-1]
+    return BOUNDARY_RUN_RE.sub('\x00', output)
+
+def boundary_transform_iter(seq, force_edges = True):
+    '''
+    Generator.  Performs ``boundary_transform`` on an iterable of
+    characters.
+
     Arguments:
     - `seq`:
     - `force_edges = True`:
@@ -418,6 +728,69 @@ def boundary_transform(seq, force_edges = True):
     for char in gen:
         yield char
 
+def boundary_transform_blocks(blocks, force_edges = True):
+    '''
+    Generator.  Performs the same transformation as
+    ``boundary_transform`` on the concatenation of the strings in
+    ``blocks``, and yields the output as one string per block (plus
+    a final string holding the closing boundary, if any).
+
+    Arguments:
+    - `blocks`: an iterable of strings
+    - `force_edges = True`:
+    '''
+    in_word = None
+    # True if the last character produced was a boundary token
+    last_boundary = False
+    if force_edges:
+        yield '\x00'
+        last_boundary = True
+    for block in blocks:
+        output, in_word, last_boundary = boundary_transform_block(block, in_word,
+                                                                  last_boundary)
+        yield output
+    if force_edges and not last_boundary:
+        yield '\x00'
+
+def boundary_transform_block(block, in_word, last_boundary):
+    '''
+    Performs the transformation of ``boundary_transform_blocks`` on
+    one block.  Returns a tuple ``(output, in_word, last_boundary)``.
+
+    Arguments:
+    - `block`: a string
+    - `in_word`: True if the last character before the block was part
+      of a word, False if it was whitespace, None if there was none
+    - `last_boundary`: True if the last character produced before
+      the block was a boundary token
+    '''
+    if block and '\x00' not in block:
+        output = boundary_transform_str(block, False)
+        # the word transition between the last block and this one
+        if (in_word is not None and not last_boundary and
+                in_word == (block[0] in WHITESPACE_CHARS)):
+            output = '\x00' + output
+        return output, block[-1] not in WHITESPACE_CHARS, False
+    output = []
+    for char in block:
+        if char == '\x00' and in_word is not None:
+            in_word = not in_word
+        elif char in WHITESPACE_CHARS:
+            if in_word is not None and in_word and not last_boundary:
+                output.append('\x00')
+            in_word = False
+        else:
+            if in_word is not None and not in_word and not last_boundary:
+                output.append('\x00')
+            in_word = True
+        if char != '\x00':
+            output.append(char)
+            last_boundary = False
+        elif not last_boundary:
+            output.append(char)
+            last_boundary = True
+    return ''.join(output), in_word, last_boundary
+
 def boundary_words(seq):
     '''
     Wraps all word transitions with a boundary token character (\x00).
@@ -473,7 +846,20 @@ def remove_duplicates(seq):
 def boundary_untransform(seq):
     '''
     Removes boundary token characters from the given character
-    iterable.
+    iterable.  If ``seq`` is a string, the result is a string;
+    otherwise, it is an iterator of characters.
+
+    Arguments:
+    - `seq`:
+    '''
+    if isinstance(seq, string_type):
+        return seq.replace('\x00', '')
+    return boundary_untransform_iter(seq)
+
+def boundary_untransform_iter(seq):
+    '''
+    Generator.  Removes boundary token characters from the given
+    character iterable.
 
     Arguments:
     - `seq`:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+cache.py
+(c) Will Roberts  18 October, 2026
+
+On-disk cache of compiled automata.
+
+Building the automaton for a large pattern file dominates the run
+time of short ``fsed`` jobs.  This module stores compiled automata in
+a cache directory, keyed by a hash of the pattern file's contents and
+of the options which affect how it is parsed.  Cache files use the
+binary format of ``fsed.compiled``, and are memory-mapped when they
+are loaded, so that concurrent ``fsed`` processes share one copy of
+the automaton.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from fsed.utils import open_file
+import fsed.compiled
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+LOGGER = logging.getLogger(__name__)
+
+# bump this whenever the layout of cached automata changes
+CACHE_VERSION = 2
+
+def cache_key(pattern_filename, pattern_format, encoding, on_word_boundaries):
+    '''
+    Computes the cache key for the automaton built from the given
+    pattern file and options.  Returns a hexadecimal string.
+
+    Arguments:
+    - `pattern_filename`:
+    - `pattern_format`:
+    - `encoding`:
+    - `on_word_boundaries`:
+    '''
+    digest = hashlib.sha1()
+    digest.update('{}\t{}\t{}\t{}\t{}\n'.format(
+        CACHE_VERSION, sys.version_info[0], pattern_format, encoding,
+        bool(on_word_boundaries)).encode('utf-8'))
+    with open_file(pattern_filename) as pattern_file:
+        while True:
+            block = pattern_file.read(1 << 20)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(cache_dir, key):
+    '''
+    Returns the path of the cache file for the given key.
+
+    Arguments:
+    - `cache_dir`:
+    - `key`:
+    '''
+    return os.path.join(cache_dir, key + '.fsa')
+
+def load(cache_dir, key):
+    '''
+    Loads a cached automaton.  Returns a tuple ``(trie, boundaries)``,
+    or None if there is no valid cache entry for ``key``.
+
+    Arguments:
+    - `cache_dir`:
+    - `key`:
+    '''
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        trie = fsed.compiled.load(path)
+    except Exception as exc:
+        LOGGER.warning('ignoring unreadable cache file {}: {}'.format(path, exc))
+        return None
+    if trie.metadata.get('cache_version') != CACHE_VERSION:
+        return None
+    LOGGER.info('loaded automaton from cache file {}'.format(path))
+    return trie, trie.metadata['boundaries']
+
+def save(cache_dir, key, trie, boundaries):
+    '''
+    Stores an automaton in the cache.  The cache file is written
+    atomically, so that concurrent ``fsed`` processes never see a
+    partially written file.
+
+    Arguments:
+    - `cache_dir`:
+    - `key`:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    - `boundaries`: the word boundary flag returned by ``build_trie``
+    '''
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = cache_path(cache_dir, key)
+    fhandle, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(fhandle)
+    try:
+        trie.save(tmp_path, {'cache_version': CACHE_VERSION,
+                             'boundaries': bool(boundaries)})
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    LOGGER.info('saved automaton to cache file {}'.format(path))
@@ -20,6 +20,8 @@ PY3 = sys.version_info[0] == 3
 if PY3:
     string_type = str
     binary_type = bytes
+    unichr = chr
 else:
     string_type = basestring
     binary_type = str
+    unichr = unichr
@@ -0,0 +1,2635 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+compiled.py
+(c) Will Roberts  18 October, 2026
+
+Frozen, array-backed Aho-Corasick automata.
+
+An ``AhoCorasickTrie`` is convenient to build and modify, but every
+input character costs several dict lookups and attribute accesses
+when matching against it.  ``CompiledAhoCorasickTrie`` freezes a trie
+into flat integer arrays and runs the same matching algorithms over
+that representation.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from array import array
+from collections import deque
+from fsed.ahocorasick import WHITESPACE_CHARS, boundary_transform_block
+from fsed.compat import PY3, string_type, unichr
+from fsed.stats import phase
+from itertools import chain
+import json
+import mmap
+import re
+import struct
+import sys
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional; without it, count_all_many and find_all_many
+    # match one character at a time
+    numpy = None
+
+# the largest DFA transition table (in entries, i.e., states times
+# symbol classes) which is built when compiling with ``dfa=None``
+DFA_MAX_ENTRIES = 1 << 24
+
+# the number of characters of input joined into one string by
+# ``greedy_replace_many`` and the other ``*_many`` methods
+MANY_BATCH_CHARS = 1 << 16
+
+# characters which may separate the strings joined by the ``*_many``
+# methods (Unicode noncharacters, which should not occur in text); the
+# first one which occurs in no pattern and no value is used
+SEPARATOR_CANDIDATES = '\uffff\ufffe' + ''.join(unichr(code)
+                                                for code in range(0xfdd0, 0xfdf0))
+
+# stretches of input which the automaton does not have to read are
+# skipped in one step if at least this many characters long (see
+# ``CompiledAhoCorasickTrie._scan_pieces``)
+ROOT_SKIP_MIN_CHARS = 16
+
+# the number of characters of input matched together by the NumPy
+# engine of ``count_all_many`` and ``find_all_many``
+LOCKSTEP_BATCH_CHARS = 1 << 20
+
+# ============================================================
+#  FLATTENING
+# ============================================================
+
+def flatten_trie(trie):
+    '''
+    Numbers the nodes of ``trie`` in breadth-first order (the root is
+    state 0).  Returns a tuple ``(children, depth, value, values)``:
+
+    - `children`: a list holding, for each state, a dict mapping
+      symbols to child states
+    - `depth`: a list holding the depth of each state
+    - `value`: a list holding, for each state, an index into
+      ``values``, or -1 if the state has no value
+    - `values`: the list of values stored in the trie
+
+    Arguments:
+    - `trie`: an ``AhoCorasickTrie`` (or ``Trie``) object
+    '''
+    children = []
+    depth = []
+    value = []
+    values = []
+    todo = deque([trie.root])
+    while todo:
+        node = todo.popleft()
+        edges = {}
+        for symbol in sorted(node):
+            edges[symbol] = len(children) + len(todo) + 1
+            todo.append(node[symbol])
+        children.append(edges)
+        depth.append(node.depth)
+        if node.has_value:
+            value.append(len(values))
+            values.append(node.value)
+        else:
+            value.append(-1)
+    return children, depth, value, values
+
+def compute_failure_links(children, value):
+    '''
+    Computes Aho-Corasick failure links over a flattened trie.
+    Returns a tuple ``(fail, dict_fail)`` of lists, where ``fail[s]``
+    is the state for the longest proper suffix of state ``s`` in the
+    trie (0 for the root and its children), and ``dict_fail[s]`` is
+    the state for the longest proper suffix of ``s`` which has a
+    value (-1 if there is none).
+
+    Arguments:
+    - `children`: per-state dicts of symbol to child state, as
+      returned by ``flatten_trie``
+    - `value`: per-state value indices, as returned by
+      ``flatten_trie``
+    '''
+    num_states = len(children)
+    fail = [0] * num_states
+    dict_fail = [-1] * num_states
+    # states are numbered breadth-first, so every failure target is
+    # finished before any state that links to it
+    for state in range(num_states):
+        for symbol, child in children[state].items():
+            if state:
+                suffix = fail[state]
+                while symbol not in children[suffix] and suffix:
+                    suffix = fail[suffix]
+                suffix = children[suffix].get(symbol, 0)
+            else:
+                suffix = 0
+            fail[child] = suffix
+            dict_fail[child] = suffix if value[suffix] >= 0 else dict_fail[suffix]
+    return fail, dict_fail
+
+def build_alphabet(children):
+    '''
+    Maps every symbol used in the trie to a small positive integer
+    (its symbol class); symbols which never occur in the trie all
+    share class 0.  Returns a dict.
+
+    Arguments:
+    - `children`: per-state dicts of symbol to child state
+    '''
+    symbols = set()
+    for edges in children:
+        symbols.update(edges)
+    return dict((symbol, cls) for cls, symbol in enumerate(sorted(symbols), 1))
+
+def build_double_array(children, alphabet):
+    '''
+    Packs the transitions of a flattened trie into a double array.
+    Returns a tuple of arrays ``(base, check, target)`` such that
+    state ``s`` has a transition on symbol class ``c`` if and only
+    if ``check[base[s] + c] == s``, in which case the transition goes
+    to state ``target[base[s] + c]``.  ``base[s] + c`` is a valid
+    index for every state ``s`` and every class ``c``.
+
+    Arguments:
+    - `children`: per-state dicts of symbol to child state
+    - `alphabet`: dict mapping symbols to symbol classes
+    '''
+    num_classes = len(alphabet) + 1
+    base = array('i', [0]) * len(children)
+    check = array('i')
+    target = array('i')
+    used = bytearray()
+    first_free = 0
+    for state, edges in enumerate(children):
+        if not edges:
+            continue
+        edges = sorted((alphabet[symbol], child) for symbol, child in edges.items())
+        lowest = edges[0][0]
+        free = max(first_free, lowest)
+        while True:
+            free = used.find(b'\x00', free)
+            if free < 0:
+                free = len(used)
+            offset = free - lowest
+            if all(offset + cls >= len(used) or not used[offset + cls]
+                   for cls, _child in edges):
+                break
+            free += 1
+        top = offset + edges[-1][0] + 1
+        if len(used) < top:
+            grow = top - len(used)
+            used.extend(b'\x00' * grow)
+            check.extend([-1] * grow)
+            target.extend([0] * grow)
+        base[state] = offset
+        for cls, child in edges:
+            used[offset + cls] = 1
+            check[offset + cls] = state
+            target[offset + cls] = child
+        first_free = used.find(b'\x00', first_free)
+        if first_free < 0:
+            first_free = len(used)
+    size = max(base) + num_classes if base else num_classes
+    if len(check) < size:
+        grow = size - len(check)
+        check.extend([-1] * grow)
+        target.extend([0] * grow)
+    return base, check, target
+
+
+def build_greedy_table(children, alphabet, fail, dict_fail, depth, value):
+    '''
+    Precomputes the complete transition function of the greedy
+    rewriting automaton used by ``greedy_replace``, over the symbol
+    classes in ``alphabet``.  Returns a tuple ``(table, actions)``.
+
+    ``table`` holds one row of ``len(alphabet) + 1`` entries per
+    state.  An entry which is zero or positive is the offset of the
+    next state's row, and means that no output is produced.  A
+    negative entry ``e`` refers to ``actions[~e]``, a tuple
+    ``(next_row, emits)``, where ``emits`` is a tuple of ``(end,
+    width, value)`` triples: each of these replaces the ``width``
+    input characters which end ``end`` characters after the current
+    input position with the value with index ``value``.
+
+    Arguments:
+    - `children`: per-state dicts of symbol to child state
+    - `alphabet`: dict mapping symbols to symbol classes
+    - `fail`: per-state failure links
+    - `dict_fail`: per-state dictionary links
+    - `depth`: per-state depths
+    - `value`: per-state value indices
+    '''
+    num_classes = len(alphabet) + 1
+    table = array('i', [0]) * (len(children) * num_classes)
+    actions = []
+    action_ids = {}
+    def encode(next_row, emits):
+        '''Returns the table entry for the given transition.'''
+        if not emits:
+            return next_row
+        key = (next_row, emits)
+        if key not in action_ids:
+            action_ids[key] = len(actions)
+            actions.append(key)
+        return ~action_ids[key]
+    def decode(entry):
+        '''Inverse of encode.'''
+        if entry >= 0:
+            return entry, ()
+        return actions[~entry]
+    # rows of states which have a dictionary link, indexed by the
+    # target of the link
+    dict_rows = {}
+    for state, edges in enumerate(children):
+        row = state * num_classes
+        if not state:
+            pass
+        elif dict_fail[state] >= 0:
+            # on a mismatch, the dictionary suffix is rewritten and
+            # the symbol is processed from the root
+            suffix = dict_fail[state]
+            if suffix not in dict_rows:
+                emit = ((0, depth[suffix], value[suffix]),)
+                dict_rows[suffix] = array('i', [
+                    encode(next_row, emit + emits)
+                    for next_row, emits in (decode(entry)
+                                            for entry in table[:num_classes])])
+            table[row:row + num_classes] = dict_rows[suffix]
+        else:
+            # on a mismatch, the state behaves like its suffix
+            suffix = fail[state] * num_classes
+            table[row:row + num_classes] = table[suffix:suffix + num_classes]
+        for symbol, child in edges.items():
+            if value[child] >= 0:
+                entry = encode(0, ((1, depth[child], value[child]),))
+            else:
+                entry = child * num_classes
+            table[row + alphabet[symbol]] = entry
+    return table, actions
+
+def build_delta_table(children, alphabet, fail):
+    '''
+    Precomputes the complete Aho-Corasick transition function over
+    the symbol classes in ``alphabet``.  Returns an array ``delta``
+    such that state ``s`` goes to state ``delta[s * (len(alphabet) +
+    1) + c]`` on a symbol of class ``c``.
+
+    Arguments:
+    - `children`: per-state dicts of symbol to child state
+    - `alphabet`: dict mapping symbols to symbol classes
+    - `fail`: per-state failure links
+    '''
+    num_classes = len(alphabet) + 1
+    delta = array('i', [0]) * (len(children) * num_classes)
+    for state, edges in enumerate(children):
+        row = state * num_classes
+        if state:
+            suffix = fail[state] * num_classes
+            delta[row:row + num_classes] = delta[suffix:suffix + num_classes]
+        for symbol, child in edges.items():
+            delta[row + alphabet[symbol]] = child
+    return delta
+
+
+# ============================================================
+#  COMPILED AHO-CORASICK TRIE
+# ============================================================
+
+class CompiledAhoCorasickTrie(object):
+    '''
+    An immutable Aho-Corasick automaton stored in flat integer arrays.
+
+    States are numbered breadth-first, with the root as state 0.
+    Symbols are first mapped to symbol classes via ``alphabet``;
+    transitions are stored in a double array (``base``, ``check``,
+    ``target``), and the per-state arrays ``fail``, ``dict_fail``,
+    ``depth`` and ``value`` replace the suffix links, dictionary
+    links, depths and values of ``TrieNode`` objects.  ``value``
+    holds indices into the list ``values``.
+
+    Matching results are identical to those of the
+    ``AhoCorasickTrie`` the automaton was compiled from.
+
+    In DFA mode, the automaton additionally stores its complete
+    transition function as dense tables with one row per state and
+    one column per symbol class, so that every input character costs
+    exactly one table lookup and failure links are never followed at
+    match time.  Symbol classes keep these tables small: all
+    characters which do not occur in any pattern share class 0, so
+    the width of a row is the number of distinct characters in the
+    patterns, not the size of Unicode.  The table used by
+    ``greedy_replace`` (``greedy_table``) is built with the
+    automaton; the one used by ``find_all`` (``delta``) is built the
+    first time it is needed.
+
+    In either mode, the automaton does not read the parts of its
+    input where no match can begin or end, which are found by one of
+    two engines (the ``engine`` attribute, which may be changed at
+    any time): ``'aho-corasick'`` skips long stretches of characters
+    which begin no pattern, and ``'wu-manber'`` finds the places
+    where a pattern might begin with the shift table of the
+    Wu-Manber algorithm, moving over the input several characters
+    at a time.  Rewriting on word boundaries and rewriting UTF-8
+    bytes always read all of their input.
+    '''
+
+    def __init__(self, trie, dfa=None, stats=None, engine=None):
+        '''
+        Constructor.
+
+        Arguments:
+        - `trie`: the ``AhoCorasickTrie`` to compile
+        - `dfa`: True to build the DFA transition tables, False not
+          to; if None, the tables are built when they would have no
+          more than ``DFA_MAX_ENTRIES`` entries
+        - `stats`: an optional ``fsed.stats.Stats`` object, which
+          records the time spent computing failure links
+          (``suffix_links``) and building the tables (``compile``)
+        - `engine`: one of ``ENGINES`` (see the ``engine``
+          attribute); if None, it is chosen with ``choose_engine``
+        '''
+        if engine is not None and engine not in ENGINES:
+            raise ValueError('unknown engine: {}'.format(engine))
+        with phase(stats, 'compile'):
+            children, depth, value, values = flatten_trie(trie)
+        with phase(stats, 'suffix_links'):
+            fail, dict_fail = compute_failure_links(children, value)
+        with phase(stats, 'compile'):
+            self._build_tables(children, depth, value, values, fail, dict_fail, dfa)
+        self.engine = engine or choose_engine(self)
+
+    def _build_tables(self, children, depth, value, values, fail, dict_fail, dfa):
+        '''
+        Builds the arrays and tables of the automaton from the
+        flattened trie and its failure links.
+        '''
+        self.alphabet = build_alphabet(children)
+        self.base, self.check, self.target = build_double_array(children,
+                                                                self.alphabet)
+        self.fail = array('i', fail)
+        self.dict_fail = array('i', dict_fail)
+        self.depth = array('i', depth)
+        self.value = array('i', value)
+        self.values = values
+        # the length of the longest pattern
+        self.max_depth = max(depth)
+        if dfa is None:
+            dfa = len(children) * self.num_classes <= DFA_MAX_ENTRIES
+        self.greedy_table = self.greedy_actions = self.delta = None
+        # tables for rewriting UTF-8 bytes, for matching on word
+        # boundaries, and for count_all and find_spans, built on
+        # first use
+        self.utf8_tables = self.word_tables = self.outputs = None
+        # the separator of the *_many methods, chosen on first use
+        self.separator = None
+        # the tables of the NumPy engine, and of the searches for
+        # stretches of input to skip, built on first use
+        self.lockstep_tables = self.root_skip = self.wu_manber_tables = None
+        # name of the file this automaton is mapped from, if any
+        self.filename = None
+        self.metadata = {}
+        # replacements made with each pattern, see enable_hit_counts
+        self.hit_counts = None
+        if dfa:
+            self.greedy_table, self.greedy_actions = build_greedy_table(
+                children, self.alphabet, fail, dict_fail, depth, value)
+
+    def __reduce_ex__(self, protocol):
+        # memory-mapped automata are pickled by name, so that other
+        # processes map the same file instead of copying its contents
+        if self.filename is not None:
+            return (load, (self.filename,), {'engine': self.engine})
+        return super(CompiledAhoCorasickTrie, self).__reduce_ex__(protocol)
+
+    @property
+    def dfa(self):
+        '''Boolean: does this automaton use DFA transition tables?'''
+        return self.greedy_table is not None
+
+    def _build_delta(self):
+        '''
+        Builds the DFA transition table used by ``find_all``.
+        '''
+        children = [{} for _state in range(self.num_states)]
+        for slot, state in enumerate(self.check):
+            if state >= 0:
+                children[state][slot - self.base[state]] = self.target[slot]
+        identity = dict((cls, cls) for cls in range(1, self.num_classes))
+        self.delta = build_delta_table(children, identity, self.fail)
+
+    @property
+    def num_states(self):
+        '''The number of states in this automaton.'''
+        return len(self.depth)
+
+    @property
+    def num_classes(self):
+        '''The number of symbol classes (including class 0).'''
+        return len(self.alphabet) + 1
+
+    def _root_skip(self):
+        '''
+        Returns a tuple ``(finditer, lookahead, min_chars)`` used by
+        ``_scan_pieces``, or None if the automaton has no patterns;
+        built on first use.
+
+        ``finditer`` finds the stretches of at least ``min_chars``
+        characters none of which begins a pattern.  The automaton
+        reads such characters without leaving its root; and after
+        reading ``lookahead`` of them in a row, it is at its root,
+        whatever state it was in before: ``lookahead`` is one more than
+        the longest run of such characters at the end of a prefix of
+        a pattern.
+        '''
+        if self.root_skip is None:
+            self.root_skip = False
+            base, check, target = self.base, self.check, self.target
+            first = set(cls for cls in range(1, self.num_classes)
+                        if check[base[0] + cls] == 0)
+            if first:
+                # the number of characters at the end of the prefix of
+                # each state which do not begin a pattern; a parent
+                # always comes before its children
+                parents = array('i', [0]) * self.num_states
+                classes = array('i', [0]) * self.num_states
+                for slot, state in enumerate(check):
+                    if state >= 0:
+                        parents[target[slot]] = state
+                        classes[target[slot]] = slot - base[state]
+                tail = array('i', [0]) * self.num_states
+                for state in range(1, self.num_states):
+                    if classes[state] not in first:
+                        tail[state] = tail[parents[state]] + 1
+                lookahead = max(tail) + 1
+                min_chars = lookahead + ROOT_SKIP_MIN_CHARS
+                chars = ''.join(re.escape(char) for char, cls in sorted(self.alphabet.items())
+                                if cls in first)
+                self.root_skip = (re.compile('[^{}]{{{},}}'.format(chars, min_chars)).finditer,
+                                  lookahead, min_chars)
+        return self.root_skip or None
+
+    def _scan_pieces(self, seq, start=0):
+        '''
+        Splits ``seq[start:]`` into the pieces which the automaton has
+        to read, leaving out long stretches of characters where no
+        match can begin or end.  Returns an iterator over tuples
+        ``(offset, piece)``, where ``piece`` is ``seq[offset:end]``.
+        The automaton is restarted at its root at the start of every
+        piece but the first: this finds the same matches as reading
+        all of ``seq``.
+
+        Characters which are not read are never copied one at a time:
+        the greedy rewriting methods output them as part of a slice.
+
+        Arguments:
+        - `seq`: a string, or an iterable of characters, which is
+          yielded whole
+        - `start`:
+        '''
+        if self.engine == WU_MANBER and isinstance(seq, string_type):
+            tables = self._wu_manber()
+            if tables is not None:
+                return self._wu_manber_pieces(seq, start, tables)
+        return self._root_skip_pieces(seq, start)
+
+    def _root_skip_pieces(self, seq, start):
+        '''
+        Generator.  ``_scan_pieces`` with the ``'aho-corasick'``
+        engine, which leaves out long stretches of characters that
+        the automaton would read without leaving its root (see
+        ``_root_skip``).  Whatever state the automaton enters a piece
+        in, it is at its root at the end of every piece but the last,
+        and stays there until the next piece.
+        '''
+        skip = None
+        if isinstance(seq, string_type):
+            skip = self._root_skip()
+        if skip is None or len(seq) - start < skip[2]:
+            yield start, (seq[start:] if start else seq)
+            return
+        finditer, lookahead, _min_chars = skip
+        pos = start
+        for match in finditer(seq, start):
+            yield pos, seq[pos:match.start() + lookahead]
+            pos = match.end()
+        yield pos, seq[pos:]
+
+    def _wu_manber(self):
+        '''
+        Returns the tables built by ``build_wu_manber_tables``, or None
+        if the automaton has no patterns; built on first use.
+        '''
+        if self.wu_manber_tables is None:
+            self.wu_manber_tables = build_wu_manber_tables(self) or False
+        return self.wu_manber_tables or None
+
+    def _wu_manber_pieces(self, seq, start, tables):
+        '''
+        Generator.  ``_scan_pieces`` with the ``'wu-manber'`` engine.
+
+        A window as long as the shortest pattern is moved over the
+        input.  If the block of characters at its end does not occur
+        in the start of any pattern, the window moves on by the shift
+        of that block; otherwise, if the window holds the start of a
+        pattern, a match may begin there.  The automaton reads from
+        ``max_depth`` characters before each such place, by when it
+        is in the same state as if it had read all of the input, to
+        ``max_depth`` characters after it, by when every match which
+        it may take part in has been found or replaced.
+
+        Arguments:
+        - `seq`: a string
+        - `start`:
+        - `tables`: the tables returned by ``_wu_manber``
+        '''
+        shifts, prefixes, window, block = tables
+        reach = self.max_depth
+        end = len(seq)
+        get_shift = shifts.get
+        default_shift = window - block + 1
+        # the piece being extended is seq[first:last]; the first one
+        # finishes any match which began before start
+        first, last = start, start + reach + 1
+        pos = start + window - 1
+        while pos < end:
+            shift = get_shift(seq[pos + 1 - block:pos + 1], default_shift)
+            if shift:
+                pos += shift
+                continue
+            begin = pos + 1 - window
+            if seq[begin:pos + 1] in prefixes:
+                if begin - reach >= last + ROOT_SKIP_MIN_CHARS:
+                    yield first, seq[first:last]
+                    first = begin - reach
+                last = begin + reach + 1
+            pos += 1
+        # the automaton ends in the same state as if it had read all
+        # of the input
+        if end - reach >= last + ROOT_SKIP_MIN_CHARS:
+            yield first, seq[first:last]
+            first = end - reach
+        yield first, seq[first:]
+
+    def find_all(self, seq):
+        '''
+        Generator expression.  Yields tuples of `(begin, length, value)`,
+        exactly like ``AhoCorasickTrie.find_all``.
+
+        Arguments:
+        - `seq`: an iterable of characters to search
+        '''
+        if self.dfa:
+            return self._find_all_dfa(seq)
+        return self._find_all_sparse(seq)
+
+    def _find_all_dfa(self, seq):
+        '''
+        find_all using the DFA transition table.
+
+        Arguments:
+        - `seq`: an iterable of characters to search
+        '''
+        if self.delta is None:
+            self._build_delta()
+        get_class = self.alphabet.get
+        delta, num_classes = self.delta, self.num_classes
+        dict_fail, depth, value, values = (self.dict_fail, self.depth,
+                                           self.value, self.values)
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for pos, char in enumerate(piece, offset):
+                state = delta[state * num_classes + get_class(char, 0)]
+                if value[state] >= 0:
+                    yield (1 + pos - depth[state], depth[state], values[value[state]])
+                suffix = dict_fail[state]
+                while suffix >= 0:
+                    yield (1 + pos - depth[suffix], depth[suffix], values[value[suffix]])
+                    suffix = dict_fail[suffix]
+
+    def _find_all_sparse(self, seq):
+        '''
+        find_all using the double array and failure links.
+
+        Arguments:
+        - `seq`: an iterable of characters to search
+        '''
+        get_class = self.alphabet.get
+        base, check, target = self.base, self.check, self.target
+        fail, dict_fail = self.fail, self.dict_fail
+        depth, value, values = self.depth, self.value, self.values
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for pos, char in enumerate(piece, offset):
+                cls = get_class(char, 0)
+                # find a state where we can transition on char
+                while True:
+                    slot = base[state] + cls
+                    if check[slot] == state:
+                        state = target[slot]
+                        break
+                    if not state:
+                        break
+                    state = fail[state]
+                # now perform any matching on the current state
+                if value[state] >= 0:
+                    yield (1 + pos - depth[state], depth[state], values[value[state]])
+                suffix = dict_fail[state]
+                while suffix >= 0:
+                    yield (1 + pos - depth[suffix], depth[suffix], values[value[suffix]])
+                    suffix = dict_fail[suffix]
+
+    # ------------------------------------------------------------
+    #  COUNTS AND SPANS
+    # ------------------------------------------------------------
+
+    def count_all(self, seq, overlapping=True, counts=None):
+        '''
+        Counts the matches of every pattern in ``seq``.  Returns an
+        ``array('l')`` which holds the number of matches of the
+        pattern ``patterns()[idx]`` at index ``idx``.  No tuple or
+        generator is created per match.
+
+        With ``overlapping``, every match yielded by ``find_all`` is
+        counted; otherwise, only the matches which ``greedy_replace``
+        would replace.
+
+        Arguments:
+        - `seq`: a string (or an iterable of characters) to search
+        - `overlapping`:
+        - `counts`: an array returned by an earlier call, to add the
+          counts to
+        '''
+        if counts is None:
+            counts = array('l', [0]) * len(self.values)
+        if not overlapping:
+            spans = self.find_spans(seq, False)
+            for idx in range(2, len(spans), 3):
+                counts[spans[idx]] += 1
+            return counts
+        if self.dfa:
+            self._count_dfa(seq, counts)
+        else:
+            self._count_sparse(seq, counts)
+        return counts
+
+    def find_spans(self, seq, overlapping=True, spans=None):
+        '''
+        Finds the matches in ``seq``.  Returns an ``array('l')`` holding
+        three integers for each match: the position where it begins,
+        its length, and the index of its pattern in ``patterns()``
+        (and of its value in ``values``).  No tuple or generator is
+        created per match.
+
+        With ``overlapping``, the matches are those yielded by
+        ``find_all``, in the same order; otherwise, they are the
+        matches which ``greedy_replace`` would replace.
+
+        Arguments:
+        - `seq`: a string (or an iterable of characters) to search
+        - `overlapping`:
+        - `spans`: an array to append the matches to
+        '''
+        if spans is None:
+            spans = array('l')
+        append = spans.append
+        if not overlapping:
+            if not isinstance(seq, string_type):
+                seq = ''.join(seq)
+            if self.dfa:
+                state = self._greedy_spans_dfa(seq, append)
+            else:
+                state = self._greedy_spans_sparse(seq, append)
+            suffix = self.dict_fail[state]
+            if suffix >= 0:
+                append(len(seq) - self.depth[suffix])
+                append(self.depth[suffix])
+                append(self.value[suffix])
+            return spans
+        if self.dfa:
+            self._spans_dfa(seq, append)
+        else:
+            self._spans_sparse(seq, append)
+        return spans
+
+    def _outputs(self):
+        '''
+        Returns a list holding, for each state, a tuple of the
+        ``(depth, value)`` pairs of the matches which end in that
+        state, in the order ``find_all`` yields them; built on first
+        use.
+        '''
+        if self.outputs is None:
+            outputs = []
+            for state in range(self.num_states):
+                matches = []
+                if self.value[state] >= 0:
+                    matches.append((self.depth[state], self.value[state]))
+                suffix = self.dict_fail[state]
+                while suffix >= 0:
+                    matches.append((self.depth[suffix], self.value[suffix]))
+                    suffix = self.dict_fail[suffix]
+                outputs.append(tuple(matches))
+            self.outputs = outputs
+        return self.outputs
+
+    def _count_dfa(self, seq, counts):
+        '''
+        count_all with overlapping matches, using the DFA transition
+        table.
+
+        Arguments:
+        - `seq`: an iterable of characters to search
+        - `counts`: the array of counts, which is updated in place
+        '''
+        if self.delta is None:
+            self._build_delta()
+        get_class = self.alphabet.get
+        delta, num_classes = self.delta, self.num_classes
+        outputs = self._outputs()
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for char in piece:
+                state = delta[state * num_classes + get_class(char, 0)]
+                for _depth, val in outputs[state]:
+                    counts[val] += 1
+
+    def _count_sparse(self, seq, counts):
+        '''
+        _count_dfa using the double array and failure links.
+        '''
+        get_class = self.alphabet.get
+        base, check, target, fail = self.base, self.check, self.target, self.fail
+        outputs = self._outputs()
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for char in piece:
+                cls = get_class(char, 0)
+                while True:
+                    slot = base[state] + cls
+                    if check[slot] == state:
+                        state = target[slot]
+                        break
+                    if not state:
+                        break
+                    state = fail[state]
+                for _depth, val in outputs[state]:
+                    counts[val] += 1
+
+    def _spans_dfa(self, seq, append):
+        '''
+        find_spans with overlapping matches, using the DFA transition
+        table.
+
+        Arguments:
+        - `seq`: an iterable of characters to search
+        - `append`: the ``append`` method of the spans array
+        '''
+        if self.delta is None:
+            self._build_delta()
+        get_class = self.alphabet.get
+        delta, num_classes = self.delta, self.num_classes
+        outputs = self._outputs()
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for pos, char in enumerate(piece, offset + 1):
+                state = delta[state * num_classes + get_class(char, 0)]
+                for depth, val in outputs[state]:
+                    append(pos - depth)
+                    append(depth)
+                    append(val)
+
+    def _spans_sparse(self, seq, append):
+        '''
+        _spans_dfa using the double array and failure links.
+        '''
+        get_class = self.alphabet.get
+        base, check, target, fail = self.base, self.check, self.target, self.fail
+        outputs = self._outputs()
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for pos, char in enumerate(piece, offset + 1):
+                cls = get_class(char, 0)
+                while True:
+                    slot = base[state] + cls
+                    if check[slot] == state:
+                        state = target[slot]
+                        break
+                    if not state:
+                        break
+                    state = fail[state]
+                for depth, val in outputs[state]:
+                    append(pos - depth)
+                    append(depth)
+                    append(val)
+
+    def _greedy_spans_dfa(self, seq, append):
+        '''
+        Appends the spans of the matches which ``greedy_replace`` would
+        replace in ``seq``, except for one at the very end, using the
+        greedy DFA transition table.  Returns the final state.
+
+        Arguments:
+        - `seq`: a string
+        - `append`: the ``append`` method of the spans array
+        '''
+        get_class = self.alphabet.get
+        table, actions = self.greedy_table, self.greedy_actions
+        num_classes = self.num_classes
+        row = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                row = 0
+            for pos, char in enumerate(piece, offset):
+                entry = table[row + get_class(char, 0)]
+                if entry >= 0:
+                    row = entry
+                    continue
+                row, emits = actions[~entry]
+                for end, width, val in emits:
+                    append(pos + end - width)
+                    append(width)
+                    append(val)
+        return row // num_classes
+
+    def _greedy_spans_sparse(self, seq, append):
+        '''
+        _greedy_spans_dfa using the double array and failure links.
+        '''
+        get_class = self.alphabet.get
+        base, check, target = self.base, self.check, self.target
+        fail, dict_fail, depth, value = self.fail, self.dict_fail, self.depth, self.value
+        state = 0
+        for offset, piece in self._scan_pieces(seq):
+            if offset:
+                state = 0
+            for pos, char in enumerate(piece, offset):
+                cls = get_class(char, 0)
+                while True:
+                    slot = base[state] + cls
+                    if check[slot] == state:
+                        state = target[slot]
+                        if value[state] >= 0:
+                            append(pos + 1 - depth[state])
+                            append(depth[state])
+                            append(value[state])
+                            state = 0
+                        break
+                    if not state:
+                        break
+                    suffix = dict_fail[state]
+                    if suffix >= 0:
+                        append(pos - depth[suffix])
+                        append(depth[suffix])
+                        append(value[suffix])
+                        state = 0
+                    else:
+                        state = fail[state]
+        return state
+
+    # ------------------------------------------------------------
+    #  MANY SHORT STRINGS
+    # ------------------------------------------------------------
+
+    def greedy_replace_many(self, strings):
+        '''
+        Returns the list of ``greedy_replace(seq)`` for every string
+        ``seq`` in ``strings``.
+
+        The strings are joined into batches of about
+        ``MANY_BATCH_CHARS`` characters, separated by a character
+        which occurs in no pattern, which every batch is rewritten in
+        one call and split again; this pays the overhead of a call
+        once per batch rather than once per string.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        '''
+        return self._replace_many(strings, self.greedy_replace)
+
+    def longest_replace_many(self, strings):
+        '''
+        Returns the list of ``longest_replace(seq)`` for every string
+        ``seq`` in ``strings``; see ``greedy_replace_many``.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        '''
+        return self._replace_many(strings, self.longest_replace)
+
+    def greedy_replace_words_many(self, strings):
+        '''
+        Returns the list of ``greedy_replace_words(seq)`` for every
+        string ``seq`` in ``strings``; see ``greedy_replace_many``.
+
+        Here, the separator is matched as a whitespace character, so
+        that there is a word boundary on each side of it.  This gives
+        the same result as rewriting the strings one at a time only
+        for strings which begin and end with a character other than
+        whitespace (the boundary at the start or end of a string
+        would otherwise fall in a different place) and which do not
+        contain \x00; other strings are rewritten on their own.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        '''
+        separator = self._separator()
+        word_classes = None
+        if separator is not None:
+            word_classes = dict(self._words()[0])
+            word_classes[separator] = ~0
+        whitespace = WHITESPACE_CHARS
+        outputs = []
+        def rewrite(batch, slots):
+            '''Rewrites a batch of strings into the given slots of outputs.'''
+            joined = self._join_batch(batch, separator)
+            if joined is None:
+                rewritten = [self.greedy_replace_words(seq) for seq in batch]
+            else:
+                rewritten = self._words_replace(joined, word_classes).split(separator)
+            for slot, output in zip(slots, rewritten):
+                outputs[slot] = output
+        batch = []
+        slots = []
+        num_chars = 0
+        for seq in strings:
+            if (not seq or seq[0] in whitespace or seq[-1] in whitespace or
+                    '\x00' in seq):
+                outputs.append(self.greedy_replace_words(seq))
+                continue
+            slots.append(len(outputs))
+            outputs.append(None)
+            batch.append(seq)
+            num_chars += len(seq) + 1
+            if num_chars >= MANY_BATCH_CHARS:
+                rewrite(batch, slots)
+                batch = []
+                slots = []
+                num_chars = 0
+        if batch:
+            rewrite(batch, slots)
+        return outputs
+
+    def find_all_many(self, strings):
+        '''
+        Returns, for every string ``seq`` in ``strings``, the list of
+        tuples ``list(find_all(seq))``.  The strings are searched in
+        batches, like in ``greedy_replace_many``, with ``find_spans``,
+        or in lockstep if NumPy is available (see ``_lockstep_run``).
+
+        Arguments:
+        - `strings`: an iterable of strings
+        '''
+        values = self.values
+        tables = self._lockstep()
+        if tables is not None:
+            matches = []
+            def search_lockstep(batch):
+                '''Searches a batch of strings in lockstep.'''
+                first = len(matches)
+                matches.extend([] for _seq in batch)
+                has_output = tables['has_output']
+                outputs = self._outputs()
+                def visit(step, order, states):
+                    '''Collects the matches ending at ``step``.'''
+                    lanes = numpy.flatnonzero(has_output[states])
+                    for lane, state in zip(order[lanes].tolist(),
+                                           states[lanes].tolist()):
+                        append = matches[first + lane].append
+                        for depth, val in outputs[state]:
+                            append((1 + step - depth, depth, values[val]))
+                self._lockstep_run(batch, tables, visit)
+            self._batches(strings, search_lockstep, LOCKSTEP_BATCH_CHARS)
+            return matches
+        separator = self._separator()
+        matches = []
+        def search(batch):
+            '''Searches a batch of strings.'''
+            joined = self._join_batch(batch, separator)
+            if joined is None:
+                matches.extend(list(self.find_all(seq)) for seq in batch)
+                return
+            spans = self.find_spans(joined)
+            first = len(matches)
+            matches.extend([] for _seq in batch)
+            # the string being searched, and where it starts and ends
+            # in joined
+            idx, offset, stop = 0, 0, len(batch[0])
+            for span in range(0, len(spans), 3):
+                begin = spans[span]
+                # matches cannot contain the separator, so begin is in
+                # the same string as the end of the match
+                while begin >= stop:
+                    idx += 1
+                    offset = stop + 1
+                    stop = offset + len(batch[idx])
+                matches[first + idx].append((begin - offset, spans[span + 1],
+                                             values[spans[span + 2]]))
+        self._batches(strings, search)
+        return matches
+
+    def count_all_many(self, strings, counts=None):
+        '''
+        Counts the matches of every pattern in all of ``strings``, like
+        calling ``count_all(seq, counts=counts)`` on each of them (with
+        overlapping matches).  Returns the array of counts.
+
+        If NumPy is available, the strings are matched in lockstep
+        (see ``_lockstep_run``), and the number of times each state
+        is reached is turned into the counts at the end, so that no
+        Python code runs per character or per match.  Otherwise, the
+        strings are counted in batches, like in ``greedy_replace_many``.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        - `counts`: an array returned by an earlier call, to add the
+          counts to
+        '''
+        if counts is None:
+            counts = array('l', [0]) * len(self.values)
+        tables = self._lockstep()
+        if tables is None:
+            separator = self._separator()
+            def count(batch):
+                '''Counts the matches in a batch of strings.'''
+                joined = self._join_batch(batch, separator)
+                if joined is None:
+                    for seq in batch:
+                        self.count_all(seq, counts=counts)
+                else:
+                    self.count_all(joined, counts=counts)
+            self._batches(strings, count)
+            return counts
+        visits = numpy.zeros(self.num_states, dtype=numpy.int64)
+        def count_lockstep(batch):
+            '''Counts the states reached in a batch of strings.'''
+            reached = []
+            self._lockstep_run(batch, tables,
+                               lambda _step, _order, states: reached.append(states.copy()))
+            if reached:
+                visits[:] += numpy.bincount(numpy.concatenate(reached),
+                                            minlength=self.num_states)
+        self._batches(strings, count_lockstep, LOCKSTEP_BATCH_CHARS)
+        # a pattern ends wherever one of the states on the failure
+        # path of the pattern's state is reached: add the visits of
+        # each state to its failure state, deepest states first
+        fail = tables['fail']
+        for level in tables['levels']:
+            numpy.add.at(visits, fail[level], visits[level])
+        states = tables['pattern_states']
+        for val, count in zip(tables['pattern_values'].tolist(),
+                              visits[states].tolist()):
+            counts[val] += count
+        return counts
+
+    def _lockstep(self):
+        '''
+        Returns a dict of the NumPy arrays used by ``_lockstep_run``
+        and ``count_all_many``, or None if NumPy is not installed or
+        the automaton has no DFA tables; built on first use.
+        '''
+        if self.lockstep_tables is None:
+            self.lockstep_tables = False
+            if numpy is not None and self.dfa:
+                if self.delta is None:
+                    self._build_delta()
+                # code points in the alphabet, in order, followed by
+                # one larger than any code point, and their classes
+                alphabet = sorted((ord(char), cls) for char, cls in self.alphabet.items())
+                alphabet.append((0x110000, 0))
+                depth = numpy.asarray(self.depth, dtype=numpy.intp)
+                value = numpy.asarray(self.value, dtype=numpy.intp)
+                dict_fail = numpy.asarray(self.dict_fail, dtype=numpy.intp)
+                pattern_states = numpy.flatnonzero(value >= 0)
+                self.lockstep_tables = {
+                    'delta': numpy.asarray(self.delta, dtype=numpy.intp),
+                    'code_points': numpy.array([code for code, _cls in alphabet],
+                                               dtype=numpy.int64),
+                    'classes': numpy.array([cls for _code, cls in alphabet],
+                                           dtype=numpy.intp),
+                    'has_output': (value >= 0) | (dict_fail >= 0),
+                    'fail': numpy.asarray(self.fail, dtype=numpy.intp),
+                    # the states at each depth, deepest first
+                    'levels': [numpy.flatnonzero(depth == level)
+                               for level in range(self.max_depth, 0, -1)],
+                    'pattern_states': pattern_states,
+                    'pattern_values': value[pattern_states],
+                }
+        return self.lockstep_tables or None
+
+    def _lockstep_run(self, batch, tables, visit):
+        '''
+        Runs the DFA over all the strings in ``batch`` at once: the
+        states of all strings are held in one NumPy array, and each
+        step reads one character of every string which is still long
+        enough, and moves all their states with one table lookup.  The
+        strings are sorted by decreasing length, so that the strings
+        still being matched at each step are a prefix of the array.
+
+        After each step, ``visit(step, order, states)`` is called,
+        where ``states`` holds the new state of each string still
+        being matched and ``order`` the index in ``batch`` of each of
+        those strings.  ``states`` is only valid during the call.
+
+        Arguments:
+        - `batch`: a list of strings
+        - `tables`: the tables returned by ``_lockstep``
+        - `visit`:
+        '''
+        if not batch:
+            return
+        joined = ''.join(batch)
+        code_points = numpy.frombuffer(
+            joined.encode('utf-32-le', 'surrogatepass' if PY3 else 'strict'),
+            dtype='<u4').astype(numpy.int64)
+        # the symbol class of every character of the batch
+        idx = numpy.searchsorted(tables['code_points'], code_points)
+        classes = numpy.where(tables['code_points'][idx] == code_points,
+                              tables['classes'][idx], 0)
+        lengths = numpy.array([len(seq) for seq in batch], dtype=numpy.intp)
+        offsets = numpy.zeros(len(batch), dtype=numpy.intp)
+        numpy.cumsum(lengths[:-1], out=offsets[1:])
+        order = numpy.argsort(-lengths, kind='mergesort')
+        offsets = offsets[order]
+        # the number of strings longer than each step
+        active = numpy.searchsorted(-lengths[order], -numpy.arange(lengths.max()),
+                                    side='left')
+        delta, num_classes = tables['delta'], self.num_classes
+        states = numpy.zeros(len(batch), dtype=numpy.intp)
+        for step, num_active in enumerate(active.tolist()):
+            current = states[:num_active]
+            current *= num_classes
+            current += classes[offsets[:num_active] + step]
+            states[:num_active] = delta[current]
+            visit(step, order[:num_active], states[:num_active])
+
+    def _replace_many(self, strings, replace):
+        '''
+        Implements ``greedy_replace_many`` and ``longest_replace_many``.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        - `replace`: the method which rewrites one string
+        '''
+        separator = self._separator()
+        outputs = []
+        def rewrite(batch):
+            '''Rewrites a batch of strings.'''
+            joined = self._join_batch(batch, separator)
+            if joined is None:
+                outputs.extend(replace(seq) for seq in batch)
+                return
+            outputs.extend(replace(joined).split(separator))
+        self._batches(strings, rewrite)
+        return outputs
+
+    @staticmethod
+    def _join_batch(batch, separator):
+        '''
+        Joins a batch of strings with ``separator``.  Returns None if
+        there is no separator, or if it occurs in one of the strings.
+
+        Arguments:
+        - `batch`: a list of strings
+        - `separator`:
+        '''
+        if separator is None:
+            return None
+        joined = separator.join(batch)
+        if joined.count(separator) != len(batch) - 1:
+            return None
+        return joined
+
+    @staticmethod
+    def _batches(strings, function, batch_chars=None):
+        '''
+        Calls ``function`` on lists of consecutive strings from
+        ``strings``, of about ``batch_chars`` characters in total.
+
+        Arguments:
+        - `strings`: an iterable of strings
+        - `function`:
+        - `batch_chars`: the default is ``MANY_BATCH_CHARS``
+        '''
+        batch_chars = batch_chars or MANY_BATCH_CHARS
+        batch = []
+        num_chars = 0
+        for seq in strings:
+            batch.append(seq)
+            num_chars += len(seq) + 1
+            if num_chars >= batch_chars:
+                function(batch)
+                batch = []
+                num_chars = 0
+        if batch:
+            function(batch)
+
+    def _separator(self):
+        '''
+        Returns the character which separates the strings joined by
+        the ``*_many`` methods: the first of the
+        ``SEPARATOR_CANDIDATES`` which is not in the alphabet (so
+        that no match can contain it) and not in any value (so that
+        the output can be split on it), or None if there is no such
+        character.  It is chosen on first use.
+        '''
+        if self.separator is None:
+            self.separator = ''
+            for candidate in SEPARATOR_CANDIDATES:
+                if (candidate not in self.alphabet and
+                        not any(candidate in value for value in self.values)):
+                    self.separator = candidate
+                    break
+        return self.separator or None
+
+    def greedy_replace(self, seq):
+        '''
+        Greedily matches strings in ``seq``, and replaces them with their
+        values, exactly like ``AhoCorasickTrie.greedy_replace``.
+
+        The output is built from slices of ``seq``: characters which
+        are not part of a match are never copied one at a time.
+
+        Arguments:
+        - `seq`: a string (or an iterable of characters) to perform
+          search-and-replace on
+        '''
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
+        output = []
+        state, mark = self._greedy_run(seq, 0, 0, 0, output)
+        return self._finish_greedy(seq, state, mark, output)
+
+    def greedy_replace_stream(self, blocks):
+        '''
+        Generator.  Performs the same rewriting as ``greedy_replace``
+        on the concatenation of the strings in ``blocks``, and yields
+        the output as a sequence of strings.
+
+        The automaton's state and the input which might still be
+        part of a match are carried from one block to the next; at
+        most as many characters as the longest pattern are held back
+        at a time, so memory use does not depend on the length of
+        the input or of its lines.
+
+        Arguments:
+        - `blocks`: an iterable of strings
+        '''
+        state = 0
+        pending = ''
+        for block in blocks:
+            output, state, pending = self.greedy_replace_block(block, state, pending)
+            yield output
+        yield self.greedy_replace_finish(state, pending)
+
+    def greedy_replace_block(self, block, state=0, pending=''):
+        '''
+        Rewrites one block of a stream of text.  Returns a tuple
+        ``(output, state, pending)``: the output for the block, and
+        the automaton state and held-back input to pass in with the
+        next block.  The stream is finished by calling
+        ``greedy_replace_finish``.
+
+        Arguments:
+        - `block`: a string
+        - `state`: the automaton state after the previous block
+        - `pending`: the held-back input after the previous block
+        '''
+        seq = pending + block
+        output = []
+        state, mark = self._greedy_run(seq, len(pending), state, 0, output)
+        # only the last depth[state] characters can still be
+        # rewritten
+        cut = max(mark, len(seq) - self.depth[state])
+        output.append(seq[mark:cut])
+        return ''.join(output), state, seq[cut:]
+
+    def greedy_replace_finish(self, state, pending):
+        '''
+        Returns the output for the end of a stream of text rewritten
+        with ``greedy_replace_block``.
+
+        Arguments:
+        - `state`: the automaton state after the last block
+        - `pending`: the held-back input after the last block
+        '''
+        return self._finish_greedy(pending, state, 0, [])
+
+    def longest_replace(self, seq):
+        '''
+        Matches strings in ``seq`` leftmost-longest, and replaces them
+        with their values, exactly like
+        ``AhoCorasickTrie.longest_replace``.
+
+        Arguments:
+        - `seq`: a string (or an iterable of characters) to perform
+          search-and-replace on
+        '''
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
+        output = []
+        self._longest_run(seq, 0, len(seq), output)
+        return ''.join(output)
+
+    def longest_replace_block(self, block, state=0, pending=''):
+        '''
+        Rewrites one block of a stream of text leftmost-longest.  The
+        interface is that of ``greedy_replace_block``; the stream is
+        finished by calling ``longest_replace_finish``.  Only input
+        from which a match could extend past the end of the block is
+        held back, so at most ``max_depth - 1`` characters are
+        carried to the next block.  ``state`` is the number of
+        held-back characters.
+
+        Arguments:
+        - `block`: a string
+        - `state`: the state after the previous block
+        - `pending`: the held-back input after the previous block
+        '''
+        seq = pending + block
+        output = []
+        # a match starting before stop cannot extend past the block
+        stop = min(len(seq), len(seq) - self.max_depth + 1)
+        pos = self._longest_run(seq, 0, stop, output)
+        pending = seq[pos:]
+        return ''.join(output), len(pending), pending
+
+    def longest_replace_finish(self, state, pending):
+        '''
+        Returns the output for the end of a stream of text rewritten
+        with ``longest_replace_block``.
+
+        Arguments:
+        - `state`: the state after the last block
+        - `pending`: the held-back input after the last block
+        '''
+        return self.longest_replace(pending)
+
+    def longest_replace_stream(self, blocks):
+        '''
+        Generator.  Performs the same rewriting as ``longest_replace``
+        on the concatenation of the strings in ``blocks``, and yields
+        the output as a sequence of strings.
+
+        Arguments:
+        - `blocks`: an iterable of strings
+        '''
+        state = 0
+        pending = ''
+        for block in blocks:
+            output, state, pending = self.longest_replace_block(block, state, pending)
+            yield output
+        yield self.longest_replace_finish(state, pending)
+
+    def _longest_run(self, seq, start, stop, output):
+        '''
+        Rewrites ``seq`` leftmost-longest, starting at position
+        ``start``, until the next match would start at or after
+        ``stop``.  Appends the output to ``output``, and returns the
+        position in ``seq`` up to which output has been produced.
+
+        From each position, the trie is walked along the input
+        without following failure links; the deepest state with a
+        value found on the way is the longest match starting there.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `start`:
+        - `stop`:
+        - `output`: list of output strings, which is extended in place
+        '''
+        get_class = self.alphabet.get
+        base, check, target = self.base, self.check, self.target
+        value, values = self.value, self._emitted(self.values)
+        length = len(seq)
+        mark = pos = start
+        while pos < stop:
+            state = 0
+            best_end = best_value = -1
+            end = pos
+            while end < length:
+                slot = base[state] + get_class(seq[end], 0)
+                if check[slot] != state:
+                    break
+                state = target[slot]
+                end += 1
+                if value[state] >= 0:
+                    best_end = end
+                    best_value = value[state]
+            if best_value < 0:
+                pos += 1
+                continue
+            output.append(seq[mark:pos])
+            output.append(values[best_value])
+            mark = pos = best_end
+        output.append(seq[mark:pos])
+        return pos
+
+    def _greedy_run(self, seq, start, state, mark, output):
+        '''
+        Runs the greedy rewriting automaton over ``seq[start:]``.
+        Returns a tuple ``(state, mark)`` giving the state of the
+        automaton after the last character of ``seq``, and the
+        position in ``seq`` up to which output has been produced.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `start`: the position in ``seq`` to start at
+        - `state`: the state of the automaton at ``start``
+        - `mark`: the position in ``seq`` up to which output has been
+          produced
+        - `output`: list of output strings, which is extended in place
+        '''
+        if self.dfa:
+            return self._greedy_run_dfa(seq, start, state, mark, output)
+        return self._greedy_run_sparse(seq, start, state, mark, output)
+
+    def _greedy_run_dfa(self, seq, start, state, mark, output):
+        '''
+        _greedy_run using the greedy DFA transition table.
+        '''
+        get_class = self.alphabet.get
+        table, actions = self.greedy_table, self.greedy_actions
+        values = self._emitted(self.values)
+        row = state * self.num_classes
+        for offset, piece in self._scan_pieces(seq, start):
+            if offset > start:
+                row = 0
+            for pos, char in enumerate(piece, offset):
+                entry = table[row + get_class(char, 0)]
+                if entry >= 0:
+                    row = entry
+                    continue
+                row, emits = actions[~entry]
+                for end, width, val in emits:
+                    end += pos
+                    output.append(seq[mark:end - width])
+                    output.append(values[val])
+                    mark = end
+        return row // self.num_classes, mark
+
+    def _greedy_run_sparse(self, seq, start, state, mark, output):
+        '''
+        _greedy_run using the double array and failure links.
+        '''
+        get_class = self.alphabet.get
+        base, check, target = self.base, self.check, self.target
+        fail, dict_fail = self.fail, self.dict_fail
+        depth, value, values = self.depth, self.value, self._emitted(self.values)
+        for offset, piece in self._scan_pieces(seq, start):
+            if offset > start:
+                state = 0
+            for pos, char in enumerate(piece, offset):
+                cls = get_class(char, 0)
+                while True:
+                    slot = base[state] + cls
+                    if check[slot] == state:
+                        # transition
+                        state = target[slot]
+                        if value[state] >= 0:
+                            output.append(seq[mark:pos + 1 - depth[state]])
+                            output.append(values[value[state]])
+                            mark = pos + 1
+                            state = 0
+                        break
+                    if not state:
+                        # at the root: char passes through unchanged
+                        break
+                    suffix = dict_fail[state]
+                    if suffix >= 0:
+                        # commit to the match which ends just before char
+                        output.append(seq[mark:pos - depth[suffix]])
+                        output.append(values[value[suffix]])
+                        mark = pos
+                        state = 0
+                    else:
+                        state = fail[state]
+        return state, mark
+
+    def _finish_greedy(self, seq, state, mark, output):
+        '''
+        Flushes the output of a greedy rewrite of ``seq`` which ended
+        in ``state``; returns the rewritten string.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `state`: the final state of the automaton
+        - `mark`: the position in ``seq`` up to which output has been
+          produced
+        - `output`: list of output strings
+        '''
+        suffix = self.dict_fail[state]
+        if suffix >= 0:
+            output.append(seq[mark:len(seq) - self.depth[suffix]])
+            output.append(self._emitted(self.values)[self.value[suffix]])
+            mark = len(seq)
+        output.append(seq[mark:])
+        return ''.join(output)
+
+    # ------------------------------------------------------------
+    #  UTF-8 BYTES
+    # ------------------------------------------------------------
+
+    def greedy_replace_bytes(self, data):
+        '''
+        Performs the same rewriting as ``greedy_replace`` on UTF-8
+        encoded input, without decoding it: returns the UTF-8 encoding
+        of ``greedy_replace(data.decode('utf-8'))``.  Text outside of
+        matches is copied to the output as slices of ``data``.
+
+        Each input byte costs one step of the automaton, except that
+        a multi-byte character is looked up as a whole when its
+        leading byte is read.  Invalid UTF-8 outside of matches is
+        copied through unchanged.
+
+        Arguments:
+        - `data`: a bytes object holding UTF-8 text
+        '''
+        output = []
+        state, mark = self._greedy_run_bytes(data, 0, 0, 0, output)
+        return self._finish_greedy_bytes(data, state, mark, output)
+
+    def greedy_replace_bytes_block(self, block, state=0, pending=b''):
+        '''
+        Rewrites one block of a stream of UTF-8 bytes; the interface
+        is that of ``greedy_replace_block``.  The block may end in the
+        middle of a multi-byte character; the incomplete character is
+        carried over to the next block.  The stream is finished by
+        calling ``greedy_replace_bytes_finish``.
+
+        Arguments:
+        - `block`: a bytes object
+        - `state`: the automaton state after the previous block
+        - `pending`: the held-back input after the previous block
+        '''
+        # an incomplete character at the end of pending has not been
+        # run through the automaton yet
+        start = utf8_complete_prefix(pending)
+        seq = pending + block
+        limit = utf8_complete_prefix(seq)
+        if limit < len(seq):
+            seq, rest = seq[:limit], seq[limit:]
+        else:
+            rest = b''
+        output = []
+        state, mark = self._greedy_run_bytes(seq, start, state, 0, output)
+        # only the bytes of the state's prefix can still be rewritten
+        cut = max(mark, len(seq) - self._utf8()[2][state])
+        output.append(seq[mark:cut])
+        return b''.join(output), state, seq[cut:] + rest
+
+    def greedy_replace_bytes_finish(self, state, pending):
+        '''
+        Returns the output for the end of a stream of bytes rewritten
+        with ``greedy_replace_bytes_block``.
+
+        Arguments:
+        - `state`: the automaton state after the last block
+        - `pending`: the held-back input after the last block
+        '''
+        output = []
+        state, mark = self._greedy_run_bytes(pending, utf8_complete_prefix(pending),
+                                             state, 0, output)
+        return self._finish_greedy_bytes(pending, state, mark, output)
+
+    def greedy_replace_bytes_stream(self, blocks):
+        '''
+        Generator.  Performs the same rewriting as
+        ``greedy_replace_bytes`` on the concatenation of the bytes
+        objects in ``blocks``, and yields the output as a sequence of
+        bytes objects.
+
+        Arguments:
+        - `blocks`: an iterable of bytes objects
+        '''
+        state = 0
+        pending = b''
+        for block in blocks:
+            output, state, pending = self.greedy_replace_bytes_block(block, state, pending)
+            yield output
+        yield self.greedy_replace_bytes_finish(state, pending)
+
+    def _utf8(self):
+        '''
+        Returns the tables used to rewrite UTF-8 bytes (see
+        ``build_utf8_tables``), building them on first use.
+        '''
+        if self.utf8_tables is None:
+            self.utf8_tables = build_utf8_tables(self)
+        return self.utf8_tables
+
+    def _greedy_run_bytes(self, seq, start, state, mark, output):
+        '''
+        ``_greedy_run`` for UTF-8 bytes; positions are byte offsets.
+        '''
+        if self.dfa:
+            return self._greedy_run_bytes_dfa(seq, start, state, mark, output)
+        return self._greedy_run_bytes_sparse(seq, start, state, mark, output)
+
+    def _greedy_run_bytes_dfa(self, seq, start, state, mark, output):
+        '''
+        _greedy_run_bytes using the greedy DFA transition table.
+        '''
+        byte_classes, char_classes, _byte_depth, value_width, byte_values = self._utf8()
+        byte_values = self._emitted(byte_values)
+        get_class = char_classes.get
+        table, actions = self.greedy_table, self.greedy_actions
+        classes = seq[start:].translate(byte_classes)
+        if not PY3:
+            classes = bytearray(classes)
+        row = state * self.num_classes
+        for idx, cls in enumerate(classes):
+            if cls > UTF8_LEAD:
+                if cls == UTF8_CONTINUATION:
+                    continue
+                # the leading byte of a multi-byte character
+                pos = start + idx
+                cls = get_class(seq[pos:pos + cls - UTF8_LEAD], 0)
+            entry = table[row + cls]
+            if entry >= 0:
+                row = entry
+                continue
+            row, emits = actions[~entry]
+            for end, _width, val in emits:
+                end = start + (utf8_char_end(classes, idx) if end else idx)
+                output.append(seq[mark:end - value_width[val]])
+                output.append(byte_values[val])
+                mark = end
+        return row // self.num_classes, mark
+
+    def _greedy_run_bytes_sparse(self, seq, start, state, mark, output):
+        '''
+        _greedy_run_bytes using the double array and failure links.
+        '''
+        byte_classes, char_classes, byte_depth, _value_width, byte_values = self._utf8()
+        byte_values = self._emitted(byte_values)
+        get_class = char_classes.get
+        base, check, target = self.base, self.check, self.target
+        fail, dict_fail, value = self.fail, self.dict_fail, self.value
+        classes = seq[start:].translate(byte_classes)
+        if not PY3:
+            classes = bytearray(classes)
+        for idx, cls in enumerate(classes):
+            if cls > UTF8_LEAD:
+                if cls == UTF8_CONTINUATION:
+                    continue
+                pos = start + idx
+                cls = get_class(seq[pos:pos + cls - UTF8_LEAD], 0)
+            while True:
+                slot = base[state] + cls
+                if check[slot] == state:
+                    state = target[slot]
+                    if value[state] >= 0:
+                        end = start + utf8_char_end(classes, idx)
+                        output.append(seq[mark:end - byte_depth[state]])
+                        output.append(byte_values[value[state]])
+                        mark = end
+                        state = 0
+                    break
+                if not state:
+                    break
+                suffix = dict_fail[state]
+                if suffix >= 0:
+                    mark, end = start + idx, mark
+                    output.append(seq[end:mark - byte_depth[suffix]])
+                    output.append(byte_values[value[suffix]])
+                    state = 0
+                else:
+                    state = fail[state]
+        return state, mark
+
+    def _finish_greedy_bytes(self, seq, state, mark, output):
+        '''
+        ``_finish_greedy`` for UTF-8 bytes.
+        '''
+        _byte_classes, _char_classes, byte_depth, _value_width, byte_values = self._utf8()
+        suffix = self.dict_fail[state]
+        if suffix >= 0:
+            output.append(seq[mark:len(seq) - byte_depth[suffix]])
+            output.append(self._emitted(byte_values)[self.value[suffix]])
+            mark = len(seq)
+        output.append(seq[mark:])
+        return b''.join(output)
+
+    # ------------------------------------------------------------
+    #  WORD BOUNDARIES
+    # ------------------------------------------------------------
+
+    def greedy_replace_words(self, seq):
+        '''
+        Performs the same rewriting as::
+
+            ''.join(boundary_untransform(
+                self.greedy_replace(boundary_transform(seq))))
+
+        for an automaton built from boundary-transformed patterns
+        (see ``fsed.ahocorasick.boundary_transform``), without
+        building the transformed string.  Instead, the automaton
+        takes a zero-width step on the boundary token (\\x00)
+        whenever the input changes between whitespace and
+        non-whitespace characters, and at the start and end of the
+        input.
+
+        Arguments:
+        - `seq`: a string (or an iterable of characters) to perform
+          search-and-replace on
+        '''
+        if not isinstance(seq, string_type):
+            seq = ''.join(seq)
+        if not seq or '\x00' in seq:
+            return ''.join(self.greedy_replace_words_stream([seq]))
+        return self._words_replace(seq)
+
+    def greedy_replace_words_stream(self, blocks):
+        '''
+        Generator.  Performs the same rewriting as
+        ``greedy_replace_words`` on the concatenation of the strings
+        in ``blocks``, and yields the output as a sequence of strings.
+
+        Input containing \\x00 characters, which toggle the word state
+        in ``boundary_transform``, is handled by switching to the
+        transformed text for the rest of the stream.
+
+        Arguments:
+        - `blocks`: an iterable of strings
+        '''
+        state = 0
+        pending = ''
+        blocks = iter(blocks)
+        for block in blocks:
+            if '\x00' in block:
+                for output in self._words_stream_transformed(chain([block], blocks),
+                                                             state, pending):
+                    yield output
+                return
+            output, state, pending = self.greedy_replace_words_block(block, state,
+                                                                     pending)
+            yield output
+        yield self.greedy_replace_words_finish(state, pending)
+
+    def greedy_replace_words_block(self, block, state=0, pending=''):
+        '''
+        Rewrites one block of a stream of text on word boundaries; the
+        interface is that of ``greedy_replace_block``, and the stream
+        is finished by calling ``greedy_replace_words_finish``.
+        ``state`` combines the automaton state with one of
+        ``WORD_START``, ``WORD_OUT`` and ``WORD_IN`` (see
+        ``word_state``).  The block must not contain \\x00
+        characters.
+
+        Arguments:
+        - `block`: a string
+        - `state`: the state after the previous block
+        - `pending`: the held-back input after the previous block
+        '''
+        seq = pending + block
+        if not seq:
+            return '', state, pending
+        state, word = divmod(state, 3)
+        output = []
+        mark = 0
+        if word == WORD_START:
+            # the boundary at the start of the input
+            state, mark = self._words_step(seq, 0, state, mark, output)
+        in_word = (word == WORD_IN if word != WORD_START else
+                   seq[0] not in WHITESPACE_CHARS)
+        state, in_word, mark = self._words_run(seq, len(pending), state, in_word,
+                                               mark, output)
+        # only the characters of the state's prefix can still be
+        # rewritten
+        cut = max(mark, len(seq) - self._words()[2][state])
+        output.append(seq[mark:cut])
+        return ''.join(output), word_state(state, in_word), seq[cut:]
+
+    def greedy_replace_words_finish(self, state, pending):
+        '''
+        Returns the output for the end of a stream of text rewritten
+        with ``greedy_replace_words_block``.
+
+        Arguments:
+        - `state`: the state after the last block
+        - `pending`: the held-back input after the last block
+        '''
+        return self._finish_words(pending, state // 3, 0, [])
+
+    def _finish_words(self, seq, state, mark, output):
+        '''
+        ``_finish_greedy`` on word boundaries: takes the boundary step
+        at the end of ``seq`` (which is also the one at its start if
+        ``seq`` is empty) and flushes the output.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `state`: the automaton state (without the word state)
+        - `mark`: the position in ``seq`` up to which output has been
+          produced
+        - `output`: list of output strings
+        '''
+        state, mark = self._words_step(seq, len(seq), state, mark, output)
+        _word_classes, _nul, width, _value_width, values = self._words()
+        suffix = self.dict_fail[state]
+        if suffix >= 0:
+            output.append(seq[mark:len(seq) - width[suffix]])
+            output.append(self._emitted(values)[self.value[suffix]])
+            mark = len(seq)
+        output.append(seq[mark:])
+        return ''.join(output)
+
+    def _words_replace(self, seq, word_classes=None):
+        '''
+        Performs ``greedy_replace_words`` on a whole non-empty string
+        which does not contain \x00.
+
+        Arguments:
+        - `seq`:
+        - `word_classes`: replaces the ``word_classes`` table of
+          ``build_word_tables``
+        '''
+        output = []
+        # the boundary at the start of the input
+        state, mark = self._words_step(seq, 0, 0, 0, output)
+        state, _in_word, mark = self._words_run(seq, 0, state,
+                                                seq[0] not in WHITESPACE_CHARS,
+                                                mark, output, word_classes)
+        return self._finish_words(seq, state, mark, output)
+
+    def _words(self):
+        '''
+        Returns the tables used to match on word boundaries (see
+        ``build_word_tables``), building them on first use.
+        '''
+        if self.word_tables is None:
+            self.word_tables = build_word_tables(self)
+        return self.word_tables
+
+    def _words_stream_transformed(self, blocks, state, pending):
+        '''
+        Generator.  Continues a stream started with
+        ``greedy_replace_words_block`` on boundary-transformed text.
+
+        Arguments:
+        - `blocks`: the rest of the input
+        - `state`:
+        - `pending`:
+        '''
+        state, word = divmod(state, 3)
+        if word == WORD_START:
+            # the boundary at the start of the input
+            in_word, last_boundary = None, True
+            output, state, pending = self.greedy_replace_block('\x00')
+            yield output.replace('\x00', '')
+        else:
+            in_word, last_boundary = word == WORD_IN, False
+            # the held-back text, including boundary tokens
+            pending = self.state_prefix(state)
+        for block in blocks:
+            block, in_word, last_boundary = boundary_transform_block(block, in_word,
+                                                                     last_boundary)
+            output, state, pending = self.greedy_replace_block(block, state, pending)
+            yield output.replace('\x00', '')
+        if not last_boundary:
+            output, state, pending = self.greedy_replace_block('\x00', state, pending)
+            yield output.replace('\x00', '')
+        yield self.greedy_replace_finish(state, pending).replace('\x00', '')
+
+    def _words_step(self, seq, pos, state, mark, output):
+        '''
+        Runs the automaton over a (zero-width) boundary token at
+        position ``pos`` in ``seq``.  Returns a tuple ``(state, mark)``.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `pos`:
+        - `state`:
+        - `mark`: the position in ``seq`` up to which output has been
+          produced
+        - `output`: list of output strings, which is extended in place
+        '''
+        _word_classes, nul, width, _value_width, values = self._words()
+        values = self._emitted(values)
+        base, check, target = self.base, self.check, self.target
+        value = self.value
+        while True:
+            slot = base[state] + nul
+            if check[slot] == state:
+                state = target[slot]
+                if value[state] >= 0:
+                    output.append(seq[mark:pos - width[state]])
+                    output.append(values[value[state]])
+                    mark = pos
+                    state = 0
+                break
+            if not state:
+                break
+            suffix = self.dict_fail[state]
+            if suffix >= 0:
+                output.append(seq[mark:pos - width[suffix]])
+                output.append(values[value[suffix]])
+                mark = pos
+                state = 0
+            else:
+                state = self.fail[state]
+        return state, mark
+
+    def _words_run(self, seq, start, state, in_word, mark, output, word_classes=None):
+        '''
+        ``_greedy_run`` on word boundaries.  Returns a tuple ``(state,
+        in_word, mark)``.
+
+        Arguments:
+        - `seq`: the string being rewritten
+        - `start`: the position in ``seq`` to start at
+        - `state`: the state of the automaton at ``start``
+        - `in_word`: True if the character before ``start`` is not
+          whitespace
+        - `mark`: the position in ``seq`` up to which output has been
+          produced
+        - `output`: list of output strings, which is extended in place
+        - `word_classes`: replaces the ``word_classes`` table of
+          ``build_word_tables``
+        '''
+        if self.dfa:
+            return self._words_run_dfa(seq, start, state, in_word, mark, output,
+                                       word_classes)
+        return self._words_run_sparse(seq, start, state, in_word, mark, output,
+                                      word_classes)
+
+    def _words_run_dfa(self, seq, start, state, in_word, mark, output,
+                       word_classes=None):
+        '''
+        _words_run using the greedy DFA transition table.
+        '''
+        classes, nul, _width, value_width, values = self._words()
+        values = self._emitted(values)
+        get_code = (word_classes or classes).get
+        table, actions = self.greedy_table, self.greedy_actions
+        row = state * self.num_classes
+        for pos, char in enumerate(seq[start:], start):
+            code = get_code(char, 0)
+            if code < 0:
+                # whitespace
+                code = ~code
+                boundary = in_word
+                in_word = False
+            else:
+                boundary = not in_word
+                in_word = True
+            if boundary:
+                entry = table[row + nul]
+                if entry >= 0:
+                    row = entry
+                else:
+                    row, emits = actions[~entry]
+                    for _end, _width, val in emits:
+                        output.append(seq[mark:pos - value_width[val]])
+                        output.append(values[val])
+                        mark = pos
+            entry = table[row + code]
+            if entry >= 0:
+                row = entry
+                continue
+            row, emits = actions[~entry]
+            for end, _width, val in emits:
+                end += pos
+                output.append(seq[mark:end - value_width[val]])
+                output.append(values[val])
+                mark = end
+        return row // self.num_classes, in_word, mark
+
+    def _words_run_sparse(self, seq, start, state, in_word, mark, output,
+                          word_classes=None):
+        '''
+        _words_run using the double array and failure links.
+        '''
+        classes, _nul, width, _value_width, values = self._words()
+        values = self._emitted(values)
+        get_code = (word_classes or classes).get
+        base, check, target = self.base, self.check, self.target
+        fail, dict_fail, value = self.fail, self.dict_fail, self.value
+        for pos, char in enumerate(seq[start:], start):
+            code = get_code(char, 0)
+            if code < 0:
+                code = ~code
+                boundary = in_word
+                in_word = False
+            else:
+                boundary = not in_word
+                in_word = True
+            if boundary:
+                state, mark = self._words_step(seq, pos, state, mark, output)
+            while True:
+                slot = base[state] + code
+                if check[slot] == state:
+                    state = target[slot]
+                    if value[state] >= 0:
+                        output.append(seq[mark:pos + 1 - width[state]])
+                        output.append(values[value[state]])
+                        mark = pos + 1
+                        state = 0
+                    break
+                if not state:
+                    break
+                suffix = dict_fail[state]
+                if suffix >= 0:
+                    output.append(seq[mark:pos - width[suffix]])
+                    output.append(values[value[suffix]])
+                    mark = pos
+                    state = 0
+                else:
+                    state = fail[state]
+        return state, in_word, mark
+
+    def state_prefix(self, state):
+        '''
+        Returns the string of symbols which leads from the root to
+        ``state``.  This takes time linear in the size of the
+        automaton.
+
+        Arguments:
+        - `state`:
+        '''
+        symbols = dict((cls, symbol) for symbol, cls in self.alphabet.items())
+        parents = {}
+        for slot, owner in enumerate(self.check):
+            if owner >= 0:
+                parents[self.target[slot]] = (owner, symbols[slot - self.base[owner]])
+        prefix = []
+        while state:
+            state, symbol = parents[state]
+            prefix.append(symbol)
+        return ''.join(reversed(prefix))
+
+    def patterns(self):
+        '''
+        Returns the list of patterns in this automaton, in the same
+        order as ``values``: the pattern with index ``idx`` is
+        replaced by ``values[idx]``.
+        '''
+        symbols = dict((cls, symbol) for symbol, cls in self.alphabet.items())
+        parents = {}
+        for slot, owner in enumerate(self.check):
+            if owner >= 0:
+                parents[self.target[slot]] = (owner, symbols[slot - self.base[owner]])
+        patterns = [None] * len(self.values)
+        for state, val in enumerate(self.value):
+            if val >= 0:
+                prefix = []
+                while state:
+                    state, symbol = parents[state]
+                    prefix.append(symbol)
+                patterns[val] = ''.join(reversed(prefix))
+        return patterns
+
+    # ------------------------------------------------------------
+    #  HIT COUNTS
+    # ------------------------------------------------------------
+
+    def enable_hit_counts(self):
+        '''
+        Starts counting the replacements made with each pattern by the
+        ``*_replace*`` methods (but not ``find_all``), from zero.
+        Returns ``hit_counts``, an array which holds the number of
+        replacements made with the pattern ``patterns()[idx]`` at
+        index ``idx``.
+
+        ``hit_counts`` may be replaced by any other object which
+        supports ``hit_counts[idx] += 1``, such as a
+        ``collections.Counter``; set it to None to stop counting.
+        '''
+        self.hit_counts = array('l', [0]) * len(self.values)
+        return self.hit_counts
+
+    def _emitted(self, values):
+        '''
+        Returns the table of values to emit replacements from: either
+        ``values`` itself, or, when counting hits, a wrapper around it
+        which counts every lookup into ``hit_counts``.  Only the
+        lookups of replacements cost anything extra, so the matching
+        loops stay as fast as without counting.
+
+        Arguments:
+        - `values`: a table of values indexed by pattern
+        '''
+        if self.hit_counts is None:
+            return values
+        return _CountedValues(values, self.hit_counts)
+
+    def save(self, filename, metadata=None):
+        '''
+        Writes this automaton to a binary file which can be read back
+        with ``load``.  See ``load`` for a description of the format.
+
+        Arguments:
+        - `filename`: the path of the file to write
+        - `metadata`: an optional dict of JSON-serializable values to
+          store along with the automaton; this is available as the
+          ``metadata`` attribute of the loaded automaton
+        '''
+        symbols = sorted(self.alphabet, key=self.alphabet.get)
+        sections = [
+            ('base', self.base),
+            ('check', self.check),
+            ('target', self.target),
+            ('fail', self.fail),
+            ('dict_fail', self.dict_fail),
+            ('depth', self.depth),
+            ('value', self.value),
+            ('alphabet', array('i', [ord(symbol) for symbol in symbols])),
+        ]
+        sections.extend(_encode_strings('values', self.values))
+        if self.dfa:
+            sections.append(('greedy_table', self.greedy_table))
+            sections.extend(_encode_actions('greedy_actions', self.greedy_actions))
+        if self.delta is not None:
+            sections.append(('delta', self.delta))
+        header = {
+            'version': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'itemsize': array('i').itemsize,
+            'sections': {},
+            'metadata': metadata or {},
+            'engine': self.engine,
+        }
+        offset = 0
+        blobs = []
+        for name, data in sections:
+            typecode = 'B' if isinstance(data, (bytes, bytearray)) else 'i'
+            if typecode == 'i':
+                data = _to_bytes(data if isinstance(data, array) else array('i', data))
+            header['sections'][name] = [offset, len(data), typecode]
+            padding = -len(data) % 8
+            blobs.append(data + b'\x00' * padding)
+            offset += len(data) + padding
+        header = json.dumps(header, sort_keys=True).encode('utf-8')
+        preamble = MAGIC + struct.pack('<I', len(header)) + header
+        preamble += b'\x00' * (-len(preamble) % 8)
+        with open(filename, 'wb') as output_file:
+            output_file.write(preamble)
+            for blob in blobs:
+                output_file.write(blob)
+
+
+# ============================================================
+#  WU-MANBER TABLES
+# ============================================================
+
+# the engines which find the parts of the input that a
+# ``CompiledAhoCorasickTrie`` has to read
+AHO_CORASICK = 'aho-corasick'
+WU_MANBER = 'wu-manber'
+ENGINES = (AHO_CORASICK, WU_MANBER)
+
+# the Wu-Manber engine is chosen for sets of no more than this many
+# patterns, which all have at least this many characters; with
+# shorter or more patterns, its window rarely moves by more than a
+# character or two at a time
+WU_MANBER_MIN_LENGTH = 10
+WU_MANBER_MAX_PATTERNS = 5000
+
+# the longest block of characters looked up in the shift table
+WU_MANBER_MAX_BLOCK = 5
+
+def choose_engine(trie):
+    '''
+    Chooses the engine of a ``CompiledAhoCorasickTrie`` from the
+    number of its patterns and the length of the shortest one.
+
+    Arguments:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    '''
+    lengths = [trie.depth[state] for state, val in enumerate(trie.value) if val >= 0]
+    if (lengths and min(lengths) >= WU_MANBER_MIN_LENGTH and
+            len(lengths) <= WU_MANBER_MAX_PATTERNS):
+        return WU_MANBER
+    return AHO_CORASICK
+
+def build_wu_manber_tables(trie):
+    '''
+    Builds the tables used by a ``CompiledAhoCorasickTrie`` to find
+    where matches may begin with the Wu-Manber algorithm.  Returns
+    None if the automaton has no patterns, and otherwise a tuple
+    ``(shifts, prefixes, window, block)``:
+
+    - `shifts`: a dict mapping every block of ``block`` characters in
+      the first ``window`` characters of a pattern to the smallest
+      distance from the end of the block to the end of those
+      characters; other blocks have a shift of ``window - block + 1``
+    - `prefixes`: the set of the first ``window`` characters of every
+      pattern
+    - `window`: the length of the shortest pattern
+    - `block`: the number of characters looked up in ``shifts``
+
+    Arguments:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    '''
+    patterns = trie.patterns()
+    if not patterns:
+        return None
+    window = min(len(pattern) for pattern in patterns)
+    block = max(1, min(WU_MANBER_MAX_BLOCK, window // 2))
+    prefixes = set(pattern[:window] for pattern in patterns)
+    shifts = {}
+    for prefix in prefixes:
+        for pos in range(window - block + 1):
+            key = prefix[pos:pos + block]
+            shift = window - block - pos
+            if shifts.get(key, shift + 1) > shift:
+                shifts[key] = shift
+    return shifts, prefixes, window, block
+
+# ============================================================
+#  UTF-8 TABLES
+# ============================================================
+
+# codes used in the byte class table of ``build_utf8_tables``: the
+# leading byte of an n-byte character has code UTF8_LEAD + n, and
+# continuation bytes have code UTF8_CONTINUATION; all other codes
+# are symbol classes
+UTF8_LEAD = 250
+UTF8_CONTINUATION = 255
+
+def utf8_char_end(classes, pos):
+    '''
+    Returns the offset just after the UTF-8 character which starts at
+    ``pos``, i.e., the offset of the next byte which is not a
+    continuation byte.
+
+    Arguments:
+    - `classes`: a sequence of byte class codes (see
+      ``build_utf8_tables``)
+    - `pos`:
+    '''
+    end = pos + 1
+    while end < len(classes) and classes[end] == UTF8_CONTINUATION:
+        end += 1
+    return end
+
+def utf8_complete_prefix(data):
+    '''
+    Returns the length of the longest prefix of the bytes object
+    ``data`` which does not end in an incomplete UTF-8 character.
+    '''
+    codes = bytearray(data[-4:])
+    for back in range(1, len(codes) + 1):
+        code = codes[-back]
+        if code < 0x80:
+            break
+        if 0xc0 <= code:
+            if back < (2 if code < 0xe0 else 3 if code < 0xf0 else 4):
+                return len(data) - back
+            break
+    return len(data)
+
+def build_utf8_tables(trie):
+    '''
+    Builds the tables used by a ``CompiledAhoCorasickTrie`` to rewrite
+    UTF-8 bytes.  Returns a tuple ``(byte_classes, char_classes,
+    byte_depth, value_width, byte_values)``:
+
+    - `byte_classes`: a translation table (for ``bytes.translate``)
+      mapping each byte to the symbol class of the ASCII character it
+      encodes; to ``UTF8_CONTINUATION`` if it is a continuation byte;
+      and to ``UTF8_LEAD`` plus the length of the character if it is
+      the leading byte of a multi-byte character
+    - `char_classes`: a dict mapping the UTF-8 encoding of each
+      multi-byte character in the alphabet to its symbol class
+    - `byte_depth`: the length in bytes of the prefix of each state
+    - `value_width`: the length in bytes of the pattern of each value
+    - `byte_values`: the UTF-8 encoded values
+
+    Arguments:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    '''
+    byte_classes = bytearray(256)
+    for code in range(0x80, 0xc0):
+        byte_classes[code] = UTF8_CONTINUATION
+    for code, length in [(0xc0, 2), (0xe0, 3), (0xf0, 4)]:
+        for lead in range(code, code + (0x20 >> (length - 2))):
+            byte_classes[lead] = UTF8_LEAD + length
+    char_classes = {}
+    symbols = {}
+    for char, cls in trie.alphabet.items():
+        encoded = char.encode('utf-8')
+        symbols[cls] = encoded
+        if len(encoded) == 1:
+            # symbols are numbered in sorted order, so ASCII
+            # characters have the smallest classes
+            assert cls < UTF8_LEAD
+            byte_classes[ord(encoded)] = cls
+        else:
+            char_classes[encoded] = cls
+    # states are numbered breadth first, so parents come before
+    # their children
+    edges = sorted((child, state, slot - trie.base[state])
+                   for slot, (state, child) in enumerate(zip(trie.check, trie.target))
+                   if state >= 0)
+    byte_depth = array('i', [0]) * trie.num_states
+    for child, state, cls in edges:
+        byte_depth[child] = byte_depth[state] + len(symbols[cls])
+    value_width = array('i', [0]) * len(trie.values)
+    for state, val in enumerate(trie.value):
+        if val >= 0:
+            value_width[val] = byte_depth[state]
+    byte_values = [val.encode('utf-8') for val in trie.values]
+    return bytes(byte_classes), char_classes, byte_depth, value_width, byte_values
+
+# ============================================================
+#  WORD BOUNDARY TABLES
+# ============================================================
+
+# the word state of a stream rewritten by ``greedy_replace_words_block``
+# before any input has been read, after whitespace, and after other
+# characters
+WORD_START = 0
+WORD_OUT = 1
+WORD_IN = 2
+
+def word_state(state, in_word):
+    '''
+    Combines an automaton state and a word state into the state
+    passed between calls of ``greedy_replace_words_block``.
+
+    Arguments:
+    - `state`: the automaton state
+    - `in_word`: True if the last character read was not whitespace
+    '''
+    return state * 3 + (WORD_IN if in_word else WORD_OUT)
+
+def build_word_tables(trie):
+    '''
+    Builds the tables used by a ``CompiledAhoCorasickTrie`` to match
+    on word boundaries without inserting boundary tokens into its
+    input.  Returns a tuple ``(word_classes, nul, width, value_width,
+    values)``:
+
+    - `word_classes`: a dict mapping characters to their symbol
+      class, or to the complement (``~``) of their symbol class for
+      whitespace characters; other characters are in class 0
+    - `nul`: the symbol class of the boundary token \\x00
+    - `width`: the number of characters other than \\x00 in the
+      prefix of each state
+    - `value_width`: the number of characters other than \\x00 in the
+      pattern of each value
+    - `values`: the values, with any \\x00 characters removed
+
+    Arguments:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    '''
+    word_classes = dict(trie.alphabet)
+    for char in WHITESPACE_CHARS:
+        word_classes[char] = ~trie.alphabet.get(char, 0)
+    nul = trie.alphabet.get('\x00', 0)
+    # states are numbered breadth first, so parents come before
+    # their children
+    edges = sorted((child, state, slot - trie.base[state])
+                   for slot, (state, child) in enumerate(zip(trie.check, trie.target))
+                   if state >= 0)
+    width = array('i', [0]) * trie.num_states
+    for child, state, cls in edges:
+        width[child] = width[state] + (cls != nul)
+    value_width = array('i', [0]) * len(trie.values)
+    for state, val in enumerate(trie.value):
+        if val >= 0:
+            value_width[val] = width[state]
+    values = [val.replace('\x00', '') for val in trie.values]
+    return word_classes, nul, width, value_width, values
+
+# ============================================================
+#  BINARY FILE FORMAT
+# ============================================================
+
+MAGIC = b'FSEDAUTO'
+FORMAT_VERSION = 1
+
+def _to_bytes(data):
+    '''
+    Returns the contents of an array or memoryview as a byte string.
+
+    Arguments:
+    - `data`:
+    '''
+    if PY3 or isinstance(data, memoryview):
+        return data.tobytes()
+    return data.tostring()
+
+def _encode_strings(name, strings):
+    '''
+    Encodes a list of strings as two sections: ``name`` (UTF-8 text)
+    and ``name + '_offsets'`` (where string ``i`` begins and ends at
+    offsets ``i`` and ``i + 1``).
+
+    Arguments:
+    - `name`:
+    - `strings`:
+    '''
+    offsets = array('i', [0])
+    data = bytearray()
+    for sval in strings:
+        data.extend(sval.encode('utf-8'))
+        offsets.append(len(data))
+    return [(name, bytes(data)), (name + '_offsets', offsets)]
+
+def _encode_actions(name, actions):
+    '''
+    Encodes the actions of a greedy transition table as two sections:
+    ``name`` (for every action, the next row, the number of emits,
+    and the ``(end, width, value)`` triple of every emit) and ``name
+    + '_offsets'``.
+
+    Arguments:
+    - `name`:
+    - `actions`:
+    '''
+    offsets = array('i', [0])
+    data = array('i')
+    for next_row, emits in actions:
+        data.append(next_row)
+        data.append(len(emits))
+        for emit in emits:
+            data.extend(emit)
+        offsets.append(len(data))
+    return [(name, data), (name + '_offsets', offsets)]
+
+class _StringTable(object):
+    '''
+    A read-only sequence of strings stored as UTF-8 in a buffer.
+    Strings are decoded the first time they are accessed.
+    '''
+
+    def __init__(self, data, offsets):
+        '''
+        Constructor.
+
+        Arguments:
+        - `data`: buffer of UTF-8 encoded text
+        - `offsets`: string ``i`` is stored at
+          ``data[offsets[i]:offsets[i+1]]``
+        '''
+        self.data = data
+        self.offsets = offsets
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        try:
+            return self._cache[idx]
+        except KeyError:
+            pass
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        sval = self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+        self._cache[idx] = sval
+        return sval
+
+class _CountedValues(object):
+    '''
+    A table of values which counts the number of times each entry is
+    looked up; see ``CompiledAhoCorasickTrie.enable_hit_counts``.
+    '''
+
+    __slots__ = ('values', 'counts')
+
+    def __init__(self, values, counts):
+        self.values = values
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        self.counts[idx] += 1
+        return self.values[idx]
+
+class _ActionTable(object):
+    '''
+    A read-only sequence of greedy table actions stored in a buffer
+    (see ``_encode_actions``).  Actions are decoded the first time
+    they are accessed.
+    '''
+
+    def __init__(self, data, offsets):
+        '''
+        Constructor.
+
+        Arguments:
+        - `data`: integer buffer of encoded actions
+        - `offsets`: action ``i`` is stored at
+          ``data[offsets[i]:offsets[i+1]]``
+        '''
+        self.data = data
+        self.offsets = offsets
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        try:
+            return self._cache[idx]
+        except KeyError:
+            pass
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start = self.offsets[idx]
+        data = self.data
+        emits = tuple(tuple(data[pos:pos + 3])
+                      for pos in range(start + 2, start + 2 + 3 * data[start + 1], 3))
+        action = (data[start], emits)
+        self._cache[idx] = action
+        return action
+
+def load(filename, use_mmap=True):
+    '''
+    Loads an automaton written by ``CompiledAhoCorasickTrie.save``.
+
+    The file begins with the magic string ``FSEDAUTO``, the length
+    of a JSON header as a little-endian 32-bit integer, and the
+    header itself; the header lists the sections of the file, which
+    follow it, aligned to 8 bytes.  Integer sections hold native
+    32-bit integers.
+
+    By default, the file is memory-mapped read-only and the automaton
+    matches directly against the mapped arrays; only the symbol
+    alphabet is copied into a dict, and values are decoded when they
+    are first used.  Processes which load the same file therefore
+    share a single copy of the automaton through the page cache.
+
+    Arguments:
+    - `filename`: the path of the file to read
+    - `use_mmap`: if False, the file is read into memory instead of
+      being memory-mapped
+    '''
+    with open(filename, 'rb') as input_file:
+        if input_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not an fsed automaton file'.format(filename))
+        header_length, = struct.unpack('<I', input_file.read(4))
+        header = json.loads(input_file.read(header_length).decode('utf-8'))
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError('{} has unsupported format version {}'.format(
+                filename, header['version']))
+        if header['itemsize'] != array('i').itemsize:
+            raise ValueError('{} was written on a platform with a different '
+                             'integer size'.format(filename))
+        if use_mmap:
+            buf = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            input_file.seek(0)
+            buf = input_file.read()
+    view = memoryview(buf)
+    start = len(MAGIC) + 4 + header_length
+    start += -start % 8
+    # without mmap, sections are copied into arrays
+    zero_copy = use_mmap and PY3 and header['byteorder'] == sys.byteorder
+    def section(name):
+        '''Returns the contents of the named section.'''
+        offset, length, typecode = header['sections'][name]
+        data = view[start + offset:start + offset + length]
+        if typecode == 'B':
+            return data
+        if zero_copy:
+            return data.cast(typecode)
+        data = array(typecode, data.tobytes())
+        if header['byteorder'] != sys.byteorder:
+            data.byteswap()
+        return data
+    trie = CompiledAhoCorasickTrie.__new__(CompiledAhoCorasickTrie)
+    for name in ['base', 'check', 'target', 'fail', 'dict_fail', 'depth', 'value']:
+        setattr(trie, name, section(name))
+    trie.alphabet = dict((unichr(code), cls)
+                         for cls, code in enumerate(section('alphabet'), 1))
+    trie.values = _StringTable(section('values'), section('values_offsets'))
+    trie.max_depth = max(trie.depth)
+    trie.greedy_table = trie.greedy_actions = trie.delta = None
+    trie.utf8_tables = trie.word_tables = trie.outputs = None
+    trie.separator = None
+    trie.lockstep_tables = trie.root_skip = trie.wu_manber_tables = None
+    trie.engine = header.get('engine', AHO_CORASICK)
+    if 'greedy_table' in header['sections']:
+        trie.greedy_table = section('greedy_table')
+        trie.greedy_actions = _ActionTable(section('greedy_actions'),
+                                           section('greedy_actions_offsets'))
+    if not use_mmap:
+        trie.values = list(trie.values)
+        if trie.greedy_actions is not None:
+            trie.greedy_actions = list(trie.greedy_actions)
+    if 'delta' in header['sections']:
+        trie.delta = section('delta')
+    trie.filename = filename if use_mmap else None
+    trie.metadata = header['metadata']
+    trie.hit_counts = None
+    return trie
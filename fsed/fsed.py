@@ -9,10 +9,18 @@ Main module for the ``fsed`` command line utility.
 '''
 
 from __future__ import absolute_import, print_function, unicode_literals
-from fsed.utils import open_file
+from collections import Counter, deque
+from fsed.stats import CountingReader, CountingWriter, Stats, automaton_stats, phase
+from fsed.utils import BLOCK_SIZE, open_file, read_blocks
 import click
+import codecs
 import fsed.ahocorasick
+import fsed.cache
+import fsed.compiled
+import io
 import logging
+import multiprocessing
+import os
 import re
 import sys
 
@@ -20,6 +28,24 @@ logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
                     stream=sys.stderr, level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+# number of input lines sent to a worker process at a time by --jobs
+LINE_BATCH_SIZE = 1024
+
+# with --jobs and --across-lines, input files are split into byte
+# ranges of this size, which are rewritten by the worker processes
+BYTE_RANGE_SIZE = 1 << 22
+
+# encodings in which any byte range starting and ending on a
+# character boundary can be decoded on its own
+SPLITTABLE_ENCODINGS = ('utf-8', 'ascii', 'iso8859-1')
+
+# the largest number of bytes per character in SPLITTABLE_ENCODINGS
+MAX_CHAR_BYTES = 4
+
+# whitespace with the word boundary tokens around it
+BOUNDARY_WHITESPACE_RE = re.compile('\x00?([' + fsed.ahocorasick.WHITESPACE_CHARS +
+                                    ']+)\x00?')
+
 def set_log_level(verbose, quiet):
     '''
     Ses the logging level of the script based on command line options.
@@ -39,6 +65,8 @@ def set_log_level(verbose, quiet):
     elif 1 < verbose:
         verbose = logging.DEBUG
     LOGGER.setLevel(verbose)
+    # loggers of the other modules in the fsed package
+    logging.getLogger('fsed').setLevel(verbose)
 
 def detect_pattern_format(pattern_filename, encoding, on_word_boundaries):
     '''
@@ -51,17 +79,29 @@ def detect_pattern_format(pattern_filename, encoding, on_word_boundaries):
     - `encoding`:
     - `on_word_boundaries`:
     '''
+    with open_file(pattern_filename) as input_file:
+        return detect_pattern_lines_format((line.decode(encoding)
+                                            for line in input_file),
+                                           on_word_boundaries)
+
+def detect_pattern_lines_format(lines, on_word_boundaries):
+    '''
+    Like ``detect_pattern_format``, but operates on an iterable of
+    decoded pattern file lines.
+
+    Arguments:
+    - `lines`:
+    - `on_word_boundaries`:
+    '''
     tsv = True
     boundaries = on_word_boundaries
-    with open_file(pattern_filename) as input_file:
-        for line in input_file:
-            line = line.decode(encoding)
-            if line.count('\t') != 1:
-                tsv = False
-            if '\\b' in line:
-                boundaries = True
-            if boundaries and not tsv:
-                break
+    for line in lines:
+        if line.count('\t') != 1:
+            tsv = False
+        if '\\b' in line:
+            boundaries = True
+        if boundaries and not tsv:
+            break
     return tsv, boundaries
 
 def sub_escapes(sval):
@@ -81,7 +121,27 @@ def sub_escapes(sval):
     sval = sval.replace('\\\\', '\\')
     return sval
 
-def build_trie(pattern_filename, pattern_format, encoding, on_word_boundaries):
+def escape_pattern(sval):
+    '''
+    Escapes the characters in ``sval`` which ``sub_escapes`` turns
+    into control characters, so that it can be written as a field of
+    a tab-separated file.
+
+    Arguments:
+    - `sval`:
+    '''
+    sval = sval.replace('\\', '\\\\')
+    sval = sval.replace('\a', '\\a')
+    sval = sval.replace('\x00', '\\b')
+    sval = sval.replace('\f', '\\f')
+    sval = sval.replace('\n', '\\n')
+    sval = sval.replace('\r', '\\r')
+    sval = sval.replace('\t', '\\t')
+    sval = sval.replace('\v', '\\v')
+    return sval
+
+def build_trie(pattern_filename, pattern_format, encoding, on_word_boundaries,
+               stats=None):
     '''
     Constructs a finite state machine for performing string rewriting.
 
@@ -90,11 +150,37 @@ def build_trie(pattern_filename, pattern_format, encoding, on_word_boundaries):
     - `pattern_format`:
     - `encoding`:
     - `on_word_boundaries`:
+    - `stats`: an optional ``fsed.stats.Stats`` object, which records
+      the time spent reading (``load_patterns``) and inserting
+      (``build_trie``) the patterns
+    '''
+    # read the pattern file only once
+    with phase(stats, 'load_patterns'):
+        with open_file(pattern_filename) as pattern_file:
+            lines = [line.decode(encoding) for line in pattern_file]
+    with phase(stats, 'build_trie'):
+        trie, boundaries, num_candidates = parse_patterns(lines, pattern_format,
+                                                          on_word_boundaries)
+    LOGGER.info('{} patterns loaded from {}'.format(num_candidates,
+                                                    pattern_filename))
+    if stats is not None:
+        stats.counts['patterns'] = num_candidates
+    return trie, boundaries
+
+def parse_patterns(lines, pattern_format, on_word_boundaries):
+    '''
+    Parses the decoded lines of a pattern file, and inserts the
+    patterns into a new trie.  Returns a tuple ``(trie, boundaries,
+    num_candidates)``.
+
+    Arguments:
+    - `lines`:
+    - `pattern_format`:
+    - `on_word_boundaries`:
     '''
     boundaries = on_word_boundaries
     if pattern_format == 'auto' or not on_word_boundaries:
-        tsv, boundaries = detect_pattern_format(pattern_filename, encoding,
-                                                on_word_boundaries)
+        tsv, boundaries = detect_pattern_lines_format(lines, on_word_boundaries)
     if pattern_format == 'auto':
         if tsv:
             pattern_format = 'tsv'
@@ -102,50 +188,47 @@ def build_trie(pattern_filename, pattern_format, encoding, on_word_boundaries):
             pattern_format = 'sed'
     trie = fsed.ahocorasick.AhoCorasickTrie()
     num_candidates = 0
-    with open_file(pattern_filename) as pattern_file:
-        for lineno, line in enumerate(pattern_file):
-            line = line.decode(encoding).rstrip('\n')
-            if not line.strip():
+    for lineno, line in enumerate(lines):
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        # decode the line
+        if pattern_format == 'tsv':
+            fields = line.split('\t')
+            if len(fields) != 2:
+                LOGGER.warning(('skipping line {} of pattern file (not '
+                                'in tab-separated format): {}').format(lineno, line))
                 continue
-            # decode the line
-            if pattern_format == 'tsv':
-                fields = line.split('\t')
-                if len(fields) != 2:
-                    LOGGER.warning(('skipping line {} of pattern file (not '
-                                    'in tab-separated format): {}').format(lineno, line))
-                    continue
-                before, after = fields
-            elif pattern_format == 'sed':
-                before = after = None
-                line = line.lstrip()
-                if line[0] == 's':
-                    delim = line[1]
-                    # delim might be a regex special character;
-                    # escape it if necessary
-                    if delim in '.^$*+?[](){}|\\':
-                        delim = '\\' + delim
-                    fields = re.split(r'(?<!\\){}'.format(delim), line)
-                    if len(fields) == 4:
-                        before, after = fields[1], fields[2]
-                        before = re.sub(r'(?<!\\)\\{}'.format(delim), delim, before)
-                        after = re.sub(r'(?<!\\)\\{}'.format(delim), delim, after)
-                if before is None or after is None:
-                    LOGGER.warning(('skipping line {} of pattern file (not '
-                                    'in sed format): {}').format(lineno, line))
-                    continue
-            num_candidates += 1
-            if on_word_boundaries and before != before.strip():
-                LOGGER.warning(('before pattern on line {} padded whitespace; '
-                                'this may interact strangely with the --words '
-                                'option: {}').format(lineno, line))
-            before = sub_escapes(before)
-            after = sub_escapes(after)
-            if boundaries:
-                before = fsed.ahocorasick.boundary_transform(before, on_word_boundaries)
-            trie[before] = after
-    LOGGER.info('{} patterns loaded from {}'.format(num_candidates,
-                                                    pattern_filename))
-    return trie, boundaries
+            before, after = fields
+        elif pattern_format == 'sed':
+            before = after = None
+            line = line.lstrip()
+            if line[0] == 's':
+                delim = line[1]
+                # delim might be a regex special character;
+                # escape it if necessary
+                if delim in '.^$*+?[](){}|\\':
+                    delim = '\\' + delim
+                fields = re.split(r'(?<!\\){}'.format(delim), line)
+                if len(fields) == 4:
+                    before, after = fields[1], fields[2]
+                    before = re.sub(r'(?<!\\)\\{}'.format(delim), delim, before)
+                    after = re.sub(r'(?<!\\)\\{}'.format(delim), delim, after)
+            if before is None or after is None:
+                LOGGER.warning(('skipping line {} of pattern file (not '
+                                'in sed format): {}').format(lineno, line))
+                continue
+        num_candidates += 1
+        if on_word_boundaries and before != before.strip():
+            LOGGER.warning(('before pattern on line {} padded whitespace; '
+                            'this may interact strangely with the --words '
+                            'option: {}').format(lineno, line))
+        before = sub_escapes(before)
+        after = sub_escapes(after)
+        if boundaries:
+            before = fsed.ahocorasick.boundary_transform(before, on_word_boundaries)
+        trie[before] = after
+    return trie, boundaries, num_candidates
 
 def warn_prefix_values(trie):
     '''
@@ -159,7 +242,57 @@ def warn_prefix_values(trie):
                              current.prefix, current.value,
                              current.longest_prefix.prefix, current.longest_prefix.value))
 
-def rewrite_str_with_trie(sval, trie, boundaries = False, slow = False):
+def load_compiled_trie(pattern_filename, pattern_format, encoding,
+                       on_word_boundaries, cache_dir=None, longest=False,
+                       stats=None, engine=None):
+    '''
+    Constructs a compiled finite state machine for performing string
+    rewriting.  If ``cache_dir`` is given, the machine is loaded from
+    the cache there when the pattern file and options have not
+    changed since it was stored; otherwise, it is built with
+    ``build_trie`` and stored in the cache.
+
+    Arguments:
+    - `pattern_filename`:
+    - `pattern_format`:
+    - `encoding`:
+    - `on_word_boundaries`:
+    - `cache_dir`:
+    - `longest`: if True, the machine is used for leftmost-longest
+      matching, so patterns with shorter patterns as prefixes are
+      not warned about
+    - `stats`: an optional ``fsed.stats.Stats`` object, which records
+      the time spent in each phase (see ``build_trie`` and
+      ``CompiledAhoCorasickTrie``), including ``load_cache`` and
+      ``save_cache``
+    - `engine`: the engine which finds where the machine has to read
+      its input (see ``CompiledAhoCorasickTrie``); if None, it is
+      chosen from the number and length of the patterns
+    '''
+    cached = None
+    if cache_dir:
+        with phase(stats, 'load_cache'):
+            key = fsed.cache.cache_key(pattern_filename, pattern_format, encoding,
+                                       on_word_boundaries)
+            cached = fsed.cache.load(cache_dir, key)
+    if cached is not None:
+        trie, boundaries = cached
+    else:
+        trie, boundaries = build_trie(pattern_filename, pattern_format, encoding,
+                                      on_word_boundaries, stats)
+        if not longest:
+            warn_prefix_values(trie)
+        trie = trie.compile(stats=stats)
+        if cache_dir:
+            with phase(stats, 'save_cache'):
+                fsed.cache.save(cache_dir, key, trie, boundaries)
+    if engine is not None:
+        trie.engine = engine
+    LOGGER.info('using the {} engine'.format(trie.engine))
+    return trie, boundaries
+
+def rewrite_str_with_trie(sval, trie, boundaries = False, slow = False,
+                          longest = False):
     '''
     Rewrites a string using the given trie object.
 
@@ -168,17 +301,567 @@ def rewrite_str_with_trie(sval, trie, boundaries = False, slow = False):
     - `trie`:
     - `boundaries`:
     - `slow`:
+    - `longest`: match leftmost-longest instead of greedily
     '''
+    if not (slow or longest):
+        if boundaries:
+            return trie.greedy_replace_words(sval)
+        return trie.greedy_replace(sval)
     if boundaries:
         sval = fsed.ahocorasick.boundary_transform(sval)
     if slow:
         sval = trie.replace(sval)
     else:
-        sval = trie.greedy_replace(sval)
+        sval = trie.longest_replace(sval)
     if boundaries:
-        sval = ''.join(fsed.ahocorasick.boundary_untransform(sval))
+        sval = fsed.ahocorasick.boundary_untransform(sval)
     return sval
 
+def rewrite_many(strings, trie, boundaries = False, slow = False,
+                 longest = False):
+    '''
+    Rewrites every string in ``strings`` like ``rewrite_str_with_trie``,
+    and returns the list of rewritten strings in the same order.  With
+    a compiled trie, the strings are rewritten in batches (see
+    ``CompiledAhoCorasickTrie.greedy_replace_many``), which is much
+    faster than calling ``rewrite_str_with_trie`` on many short
+    strings.
+
+    Arguments:
+    - `strings`: an iterable of strings
+    - `trie`:
+    - `boundaries`:
+    - `slow`:
+    - `longest`: match leftmost-longest instead of greedily
+    '''
+    if not slow and hasattr(trie, 'greedy_replace_many'):
+        if not boundaries:
+            if longest:
+                return trie.longest_replace_many(strings)
+            return trie.greedy_replace_many(strings)
+        if not longest:
+            return trie.greedy_replace_words_many(strings)
+    return [rewrite_str_with_trie(sval, trie, boundaries, slow, longest)
+            for sval in strings]
+
+def use_byte_engine(encoding, boundaries, slow, longest, trie=None):
+    '''
+    Returns True if input in the given encoding can be rewritten as
+    raw UTF-8 bytes with ``CompiledAhoCorasickTrie.greedy_replace_bytes``,
+    without decoding and re-encoding it.  This is not done with the
+    Wu-Manber engine, which only skips over decoded text.
+
+    Arguments:
+    - `encoding`:
+    - `boundaries`:
+    - `slow`:
+    - `longest`:
+    - `trie`:
+    '''
+    return (not (boundaries or slow or longest) and
+            getattr(trie, 'engine', None) != fsed.compiled.WU_MANBER and
+            codecs.lookup(encoding).name == 'utf-8')
+
+def rewrite_encoded_line(line, trie, boundaries, slow, encoding, longest=False):
+    '''
+    Rewrites one line of encoded input for --by-line processing;
+    returns the encoded output line (terminated by a newline).
+
+    Arguments:
+    - `line`: a byte string
+    - `trie`:
+    - `boundaries`:
+    - `slow`:
+    - `encoding`:
+    - `longest`:
+    '''
+    if use_byte_engine(encoding, boundaries, slow, longest, trie):
+        return trie.greedy_replace_bytes(line.rstrip(b'\n')) + b'\n'
+    line = line.decode(encoding).rstrip('\n')
+    line = rewrite_str_with_trie(line, trie, boundaries, slow, longest)
+    return (line + '\n').encode(encoding)
+
+# state of a --jobs worker process, set up by _init_worker
+_WORKER_STATE = {}
+
+def _init_worker(trie, boundaries, slow, encoding, longest, count_hits=False):
+    '''
+    Initializes a --jobs worker process.  The worker holds on to the
+    automaton for its whole lifetime: with the ``fork`` start method
+    it is inherited from the parent process; otherwise it is pickled
+    once per worker (a memory-mapped automaton is pickled by name).
+
+    Arguments:
+    - `trie`:
+    - `boundaries`:
+    - `slow`:
+    - `encoding`:
+    - `longest`:
+    - `count_hits`: whether to count the replacements made with each
+      pattern, and send the counts back with the output
+    '''
+    if not slow:
+        # hits are counted per batch or range (see count_block_hits)
+        trie.hit_counts = None
+    _WORKER_STATE.update(trie=trie, boundaries=boundaries, slow=slow,
+                         encoding=encoding, longest=longest,
+                         count_hits=count_hits)
+
+def count_block_hits(trie, function, *args):
+    '''
+    Calls ``function(*args)``, counting the replacements ``trie``
+    makes in a ``collections.Counter`` of its own instead of in its
+    ``hit_counts``.  Returns a tuple ``(result, hits)``.
+
+    Arguments:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    - `function`:
+    '''
+    hit_counts, trie.hit_counts = trie.hit_counts, Counter()
+    try:
+        result = function(*args)
+    finally:
+        hit_counts, trie.hit_counts = trie.hit_counts, hit_counts
+    return result, hit_counts
+
+def add_hit_counts(hit_counts, hits):
+    '''
+    Adds the replacement counts ``hits`` (as returned by
+    ``count_block_hits``) to ``hit_counts``.
+
+    Arguments:
+    - `hit_counts`: the ``hit_counts`` of a ``CompiledAhoCorasickTrie``
+    - `hits`: a dict mapping pattern indices to counts, or None
+    '''
+    for idx, num_hits in (hits or {}).items():
+        hit_counts[idx] += num_hits
+
+def _rewrite_line_batch(lines):
+    '''
+    Rewrites a batch of encoded input lines in a --jobs worker
+    process.  Returns a tuple ``(output, num_lines, hits)``, where
+    ``output`` is the encoded output for the batch, and ``hits`` the
+    replacement counts for the batch, if they are counted.
+
+    Arguments:
+    - `lines`: a list of byte strings
+    '''
+    state = _WORKER_STATE
+    def rewrite():
+        '''Rewrites the batch.'''
+        return b''.join(rewrite_encoded_line(line, state['trie'], state['boundaries'],
+                                             state['slow'], state['encoding'],
+                                             state['longest'])
+                        for line in lines)
+    if state['count_hits']:
+        output, hits = count_block_hits(state['trie'], rewrite)
+    else:
+        output, hits = rewrite(), None
+    return output, len(lines), hits
+
+def make_worker_pool(jobs, trie, boundaries, slow, encoding, longest=False):
+    '''
+    Starts a pool of ``jobs`` worker processes for
+    ``rewrite_lines_parallel``.  If ``trie`` is counting hits (see
+    ``CompiledAhoCorasickTrie.enable_hit_counts``), so do the
+    workers.
+
+    Arguments:
+    - `jobs`:
+    - `trie`:
+    - `boundaries`:
+    - `slow`:
+    - `encoding`:
+    - `longest`:
+    '''
+    count_hits = getattr(trie, 'hit_counts', None) is not None
+    return multiprocessing.Pool(jobs, _init_worker,
+                                (trie, boundaries, slow, encoding, longest,
+                                 count_hits))
+
+def iter_line_batches(input_file, batch_size):
+    '''
+    Generator.  Reads lines from ``input_file`` and yields them in
+    lists of (at most) ``batch_size`` lines.
+
+    Arguments:
+    - `input_file`:
+    - `batch_size`:
+    '''
+    batch = []
+    for line in input_file:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def rewrite_lines_parallel(input_file, pool, jobs, batch_size=LINE_BATCH_SIZE,
+                           hit_counts=None):
+    '''
+    Generator.  Rewrites the lines of ``input_file`` (which may be a
+    stream) in batches on the worker processes in ``pool``, and
+    yields tuples ``(output, num_lines)`` for the batches in input
+    order.  The output is byte-identical to calling
+    ``rewrite_encoded_line`` on every line.  At most ``2 * jobs``
+    batches are in flight at any time, so memory use is bounded.
+
+    Arguments:
+    - `input_file`: a binary file object
+    - `pool`: a pool created with ``make_worker_pool``
+    - `jobs`: the number of processes in ``pool``
+    - `batch_size`:
+    - `hit_counts`: if the workers count hits, their counts are
+      added to this (usually the ``hit_counts`` of the parent's
+      automaton)
+    '''
+    pending = deque()
+    def result():
+        '''Waits for the oldest batch.'''
+        output, num_lines, hits = pending.popleft().get()
+        if hit_counts is not None:
+            add_hit_counts(hit_counts, hits)
+        return output, num_lines
+    for batch in iter_line_batches(input_file, batch_size):
+        pending.append(pool.apply_async(_rewrite_line_batch, (batch,)))
+        if len(pending) >= 2 * jobs:
+            yield result()
+    while pending:
+        yield result()
+
+def rewrite_blocks_with_trie(blocks, trie, boundaries = False, longest = False):
+    '''
+    Generator.  Rewrites a stream of text using the given compiled
+    trie object, treating the input as one long string rather than
+    as a sequence of lines.  Yields the rewritten text as a sequence
+    of strings.
+
+    Arguments:
+    - `blocks`: an iterable of strings
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    - `boundaries`:
+    - `longest`: match leftmost-longest instead of greedily
+    '''
+    if boundaries and not longest:
+        # word boundaries are matched inside the automaton
+        for block in trie.greedy_replace_words_stream(blocks):
+            if block:
+                yield block
+        return
+    if boundaries:
+        blocks = fsed.ahocorasick.boundary_transform_blocks(blocks)
+    if longest:
+        blocks = trie.longest_replace_stream(blocks)
+    else:
+        blocks = trie.greedy_replace_stream(blocks)
+    for block in blocks:
+        if boundaries:
+            block = block.replace('\x00', '')
+        if block:
+            yield block
+
+def can_split_input(input_filename, encoding):
+    '''
+    Returns True if the given input file can be split into byte
+    ranges for parallel rewriting: it must be a regular,
+    uncompressed file in one of the SPLITTABLE_ENCODINGS.
+
+    Arguments:
+    - `input_filename`:
+    - `encoding`:
+    '''
+    return (os.path.isfile(input_filename) and
+            not input_filename.lower().endswith(('.gz', '.xz')) and
+            codecs.lookup(encoding).name in SPLITTABLE_ENCODINGS)
+
+def char_start(input_file, offset, encoding):
+    '''
+    Returns the offset of the first character boundary at or after
+    byte ``offset`` in ``input_file``.
+
+    Arguments:
+    - `input_file`: a seekable binary file object
+    - `offset`:
+    - `encoding`: one of the SPLITTABLE_ENCODINGS
+    '''
+    if offset == 0 or codecs.lookup(encoding).name != 'utf-8':
+        return offset
+    input_file.seek(offset)
+    lead = bytearray(input_file.read(MAX_CHAR_BYTES))
+    skip = 0
+    # skip UTF-8 continuation bytes
+    while skip < len(lead) and 0x80 <= lead[skip] < 0xc0:
+        skip += 1
+    return offset + skip
+
+def read_byte_range(input_filename, start, end, encoding, context_length,
+                    boundaries):
+    '''
+    Reads the characters in the byte range ``[start, end)`` of the
+    given file; both ends of the range are moved forward to the next
+    character boundary.  Returns a tuple ``(context, text)``, where
+    ``text`` holds the characters in the range and ``context`` holds
+    (at least) the ``context_length`` characters before it.
+
+    With ``boundaries``, the context is extended backwards until it
+    contains a character other than \\x00, so that the word boundary
+    transform is in the same state at the start of ``text`` as it
+    would be when reading the whole file.
+
+    Arguments:
+    - `input_filename`:
+    - `start`:
+    - `end`:
+    - `encoding`: one of the SPLITTABLE_ENCODINGS
+    - `context_length`:
+    - `boundaries`:
+    '''
+    with open(input_filename, 'rb') as input_file:
+        start = char_start(input_file, start, encoding)
+        end = char_start(input_file, end, encoding)
+        input_file.seek(start)
+        text = input_file.read(end - start).decode(encoding)
+        num_bytes = max(1, context_length) * MAX_CHAR_BYTES
+        while True:
+            context_start = char_start(input_file, max(0, start - num_bytes), encoding)
+            input_file.seek(context_start)
+            context = input_file.read(start - context_start).decode(encoding)
+            if context_start == 0 or (context_length <= len(context) and
+                                      (not boundaries or context.strip('\x00'))):
+                return context, text
+            num_bytes *= 2
+
+def transform_text_range(context, text, boundaries, is_first, is_last,
+                         block_size=BLOCK_SIZE):
+    '''
+    Splits a range of text read by ``read_byte_range`` into blocks
+    for the automaton, applying the word boundary transform if
+    ``boundaries`` is set.  Returns a tuple ``(context, blocks)``.
+    The blocks are exactly what ``rewrite_blocks_with_trie`` would
+    feed to the automaton for this part of the file.  For the first
+    range of a file, the context is empty.
+
+    Arguments:
+    - `context`:
+    - `text`:
+    - `boundaries`:
+    - `is_first`: True if the range starts at the start of the file
+    - `is_last`: True if the range ends at the end of the file
+    - `block_size`:
+    '''
+    blocks = [text[idx:idx + block_size] for idx in range(0, len(text), block_size)]
+    if is_first:
+        context = ''
+    if boundaries:
+        num_blocks = len(blocks)
+        blocks = list(fsed.ahocorasick.boundary_transform_blocks([context] + blocks,
+                                                                 is_first))
+        if is_first:
+            # keep the opening edge, but not the closing one
+            blocks = [blocks[0] + blocks[1]] + blocks[2:num_blocks + 2]
+        context = blocks.pop(0) if not is_first else ''
+        if is_last:
+            last = next((block for block in reversed(blocks) if block), '')
+            if not last.endswith('\x00'):
+                blocks.append('\x00')
+    return context, blocks
+
+def rewrite_range_blocks(blocks, trie, boundaries, encoding, longest, state, pending,
+                         count_hits=False):
+    '''
+    Generator.  Rewrites blocks produced by ``transform_text_range``,
+    starting in the given automaton state.  Yields a tuple ``(state,
+    pending, output, hits)`` for each block, where ``output`` is the
+    encoded output for the block, and ``hits`` the replacement
+    counts for the block if ``count_hits`` is set (and None
+    otherwise).
+
+    Arguments:
+    - `blocks`:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    - `boundaries`:
+    - `encoding`:
+    - `longest`:
+    - `state`:
+    - `pending`:
+    - `count_hits`:
+    '''
+    replace_block = trie.longest_replace_block if longest else trie.greedy_replace_block
+    hits = None
+    for block in blocks:
+        if count_hits:
+            (output, state, pending), hits = count_block_hits(trie, replace_block,
+                                                              block, state, pending)
+        else:
+            output, state, pending = replace_block(block, state, pending)
+        if boundaries:
+            output = output.replace('\x00', '')
+        yield state, pending, output.encode(encoding), hits
+
+def rewrite_byte_range(input_filename, start, end, is_last, context_length,
+                       trie, boundaries, encoding, longest, block_size=BLOCK_SIZE,
+                       count_hits=False):
+    '''
+    Rewrites the byte range ``[start, end)`` of the given file
+    without knowing the state of the automaton at ``start``: the
+    automaton is started at the root ``context_length`` characters
+    before ``start``, which brings it into the same state as a
+    serial run in all but a few pathological cases.
+
+    Returns a tuple ``(state, checkpoints)``, where ``state`` is the
+    automaton state at ``start`` and ``checkpoints`` is the list
+    produced by ``rewrite_range_blocks``.  The output of the range
+    is correct if ``state`` equals the state of a serial run at
+    ``start``; otherwise see ``repair_byte_range``.
+
+    Arguments:
+    - `input_filename`:
+    - `start`:
+    - `end`:
+    - `is_last`:
+    - `context_length`: the length of the longest pattern
+    - `trie`:
+    - `boundaries`:
+    - `encoding`:
+    - `longest`:
+    - `block_size`:
+    - `count_hits`: whether to count the replacements in each block;
+      replacements in the context before ``start`` are not counted
+    '''
+    context, text = read_byte_range(input_filename, start, end, encoding,
+                                    context_length, boundaries)
+    context, blocks = transform_text_range(context, text, boundaries, start == 0,
+                                           is_last, block_size)
+    if longest:
+        _output, state, pending = trie.longest_replace_block(context)
+    else:
+        _output, state, pending = trie.greedy_replace_block(context)
+    return state, list(rewrite_range_blocks(blocks, trie, boundaries, encoding,
+                                            longest, state, pending, count_hits))
+
+def repair_byte_range(input_filename, start, end, is_last, context_length,
+                      trie, boundaries, encoding, longest, state, pending,
+                      checkpoints, block_size=BLOCK_SIZE, count_hits=False):
+    '''
+    Rewrites the byte range ``[start, end)`` again, starting from the
+    automaton state ``state`` (and held-back input ``pending``) of
+    the serial run, until the automaton reaches the same state as
+    in ``checkpoints`` at the end of a block.  From there on, the
+    output in ``checkpoints`` is correct.  Returns the repaired list
+    of checkpoints.
+
+    Arguments:
+    - `input_filename`:
+    - `start`:
+    - `end`:
+    - `is_last`:
+    - `context_length`:
+    - `trie`:
+    - `boundaries`:
+    - `encoding`:
+    - `longest`:
+    - `state`:
+    - `pending`:
+    - `checkpoints`: the checkpoints returned by ``rewrite_byte_range``
+    - `block_size`:
+    - `count_hits`:
+    '''
+    context, text = read_byte_range(input_filename, start, end, encoding,
+                                    context_length, boundaries)
+    _context, blocks = transform_text_range(context, text, boundaries, False,
+                                            is_last, block_size)
+    repaired = []
+    for idx, checkpoint in enumerate(rewrite_range_blocks(blocks, trie, boundaries,
+                                                          encoding, longest,
+                                                          state, pending,
+                                                          count_hits)):
+        repaired.append(checkpoint)
+        if checkpoint[0] == checkpoints[idx][0]:
+            return repaired + checkpoints[idx + 1:]
+    return repaired
+
+def _rewrite_byte_range(input_filename, start, end, is_last, context_length,
+                        block_size):
+    '''
+    Calls ``rewrite_byte_range`` in a --jobs worker process.
+    '''
+    state = _WORKER_STATE
+    return rewrite_byte_range(input_filename, start, end, is_last, context_length,
+                              state['trie'], state['boundaries'], state['encoding'],
+                              state['longest'], block_size, state['count_hits'])
+
+def rewrite_byte_ranges(input_filename, trie, boundaries, encoding, pool, jobs,
+                        longest=False, range_size=BYTE_RANGE_SIZE,
+                        block_size=BLOCK_SIZE):
+    '''
+    Generator.  Rewrites the given file (see ``can_split_input``) in
+    --across-lines mode by splitting it into byte ranges which are
+    rewritten concurrently on the worker processes in ``pool``.
+    Yields the encoded output in input order; the output is
+    byte-identical to that of ``rewrite_blocks_with_trie``.
+
+    The worker for each range starts its automaton at the root a
+    little before the range (overlapping the previous range by the
+    length of the longest pattern).  At each seam, the state it
+    reached is compared with the state in which the previous range
+    ended; if they differ, the range is rewritten again serially
+    from the correct state until the two runs synchronize.  At most
+    ``2 * jobs`` ranges are in flight at any time.  If ``trie`` is
+    counting hits, the counts of the blocks which make up the output
+    are added to it.
+
+    Arguments:
+    - `input_filename`:
+    - `trie`: a ``CompiledAhoCorasickTrie``
+    - `boundaries`:
+    - `encoding`: one of the SPLITTABLE_ENCODINGS
+    - `pool`: a pool created with ``make_worker_pool``
+    - `jobs`: the number of processes in ``pool``
+    - `longest`: match leftmost-longest instead of greedily; this
+      must agree with the setting ``pool`` was created with
+    - `range_size`:
+    - `block_size`:
+    '''
+    size = os.path.getsize(input_filename)
+    context_length = trie.max_depth
+    count_hits = trie.hit_counts is not None
+    offsets = list(range(0, size, range_size)) + [size]
+    if len(offsets) == 1:
+        offsets.append(size)
+    ranges = [(start, end, end == size) for start, end in zip(offsets, offsets[1:])]
+    def submit(start, end, is_last):
+        '''Sends a range to the worker processes.'''
+        return pool.apply_async(_rewrite_byte_range,
+                                (input_filename, start, end, is_last,
+                                 context_length, block_size))
+    results = deque()
+    next_range = 0
+    # the state of the serial run at the start of the next range
+    state, pending = 0, ''
+    for start, end, is_last in ranges:
+        while next_range < len(ranges) and len(results) < 2 * jobs:
+            results.append(submit(*ranges[next_range]))
+            next_range += 1
+        start_state, checkpoints = results.popleft().get()
+        if start and start_state != state:
+            LOGGER.debug('repairing the seam at byte {}'.format(start))
+            checkpoints = repair_byte_range(input_filename, start, end, is_last,
+                                            context_length, trie, boundaries,
+                                            encoding, longest, state, pending,
+                                            checkpoints, block_size, count_hits)
+        for state, pending, output, hits in checkpoints:
+            if count_hits:
+                add_hit_counts(trie.hit_counts, hits)
+            yield output
+    if longest:
+        output = trie.longest_replace_finish(state, pending)
+    else:
+        output = trie.greedy_replace_finish(state, pending)
+    if boundaries:
+        output = output.replace('\x00', '')
+    yield output.encode(encoding)
+
 @click.command()
 @click.argument('pattern_filename', type=click.Path(exists=True),
                 metavar='PATTERN_FILE')
@@ -204,21 +887,53 @@ def rewrite_str_with_trie(sval, trie, boundaries = False, slow = False):
               help='Try very hard to '
               'find the longest matches on the input; this is very slow, '
               'and forces --by-line.')
+@click.option('--longest', is_flag=True,
+              help='Replace the longest pattern starting at each '
+              'position (leftmost-longest matching) instead of the first '
+              'pattern to be completed.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1, show_default=True,
+              help='Rewrite with this many worker processes.')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              envvar='FSED_CACHE_DIR',
+              help='Cache the compiled pattern automaton in this '
+              'directory, and reuse it while PATTERN_FILE is unchanged.')
+@click.option('--engine', type=click.Choice(['auto', fsed.compiled.AHO_CORASICK,
+                                            fsed.compiled.WU_MANBER]),
+              default='auto', show_default=True,
+              help='How to find the parts of the input which can contain '
+              'matches: the Wu-Manber shift table skips ahead when all '
+              'patterns are long; "auto" chooses from the patterns.')
+@click.option('--hit-counts', 'hit_counts_filename', type=click.Path(dir_okay=False),
+              help='Count the replacements made with each pattern, and '
+              'write the counts to this file as tab-separated pattern, '
+              'replacement and count.')
+@click.option('--stats', 'show_stats', is_flag=True,
+              help='Write timings, throughput and automaton size '
+              'statistics to standard error as JSON.')
+@click.option('--stats-file', type=click.Path(dir_okay=False),
+              help='Write the --stats statistics to this file instead '
+              '(implies --stats).')
 @click.option('-v', '--verbose', default=0, count=True,
               help='Turns on debugging output.')
 @click.option('-q', '--quiet', is_flag=True,
               help='Quiet operation, do not emit warnings.')
 def main(pattern_filename, input_filenames, pattern_format,
          output_filename,
-         encoding, words, by_line, slow, verbose, quiet):
+         encoding, words, by_line, slow, longest, jobs, cache_dir,
+         engine, hit_counts_filename, show_stats, stats_file, verbose, quiet):
     '''
     Search and replace on INPUT_FILE(s) (or standard input), with
     matching on fixed strings.
     '''
     set_log_level(verbose, quiet)
+    if slow and longest:
+        raise click.UsageError('--slow and --longest cannot be used together')
+    if slow and hit_counts_filename:
+        raise click.UsageError('--slow and --hit-counts cannot be used together')
+    if slow and engine != 'auto':
+        raise click.UsageError('--slow and --engine cannot be used together')
     if slow:
         by_line = True
-    by_line = True # TODO: implement non-line-based rewriting
     # load the patterns
     LOGGER.info('fsed {} input {} output {}'.format(pattern_filename,
                                                     input_filenames,
@@ -227,26 +942,171 @@ def main(pattern_filename, input_filenames, pattern_format,
         input_filenames = ('-',)
     if not output_filename:
         output_filename = '-'
+    stats = Stats() if show_stats or stats_file else None
     # build trie machine for matching
-    trie, boundaries = build_trie(pattern_filename, pattern_format, encoding, words)
-    if not slow:
-        warn_prefix_values(trie)
+    if slow:
+        trie, boundaries = build_trie(pattern_filename, pattern_format, encoding,
+                                      words, stats)
+        if stats is not None:
+            # otherwise, suffix links are set on the first replacement
+            with stats.phase('suffix_links'):
+                trie._set_suffix_links()
+    else:
+        trie, boundaries = load_compiled_trie(pattern_filename, pattern_format,
+                                              encoding, words, cache_dir, longest,
+                                              stats, None if engine == 'auto' else engine)
+    if stats is not None:
+        stats.automaton = automaton_stats(trie)
+    if hit_counts_filename:
+        trie.enable_hit_counts()
+    pool = None
+    if 1 < jobs:
+        pool = make_worker_pool(jobs, trie, boundaries, slow, encoding, longest)
     LOGGER.info('writing to {}'.format(output_filename))
-    with open_file(output_filename, 'wb') as output_file:
-        for input_filename in input_filenames:
-            # search and replace
-            with open_file(input_filename) as input_file:
-                LOGGER.info('reading {}'.format(input_filename))
-                if by_line:
-                    num_lines = 0
-                    for line in input_file:
-                        line = line.decode(encoding).rstrip('\n')
-                        line = rewrite_str_with_trie(line, trie, boundaries, slow)
-                        output_file.write((line + '\n').encode(encoding))
-                        num_lines += 1
-                    LOGGER.info('{} lines written'.format(num_lines))
-                else:
-                    raise NotImplementedError
+    try:
+        with open_file(output_filename, 'wb') as output_file:
+            for input_filename in input_filenames:
+                # search and replace
+                if pool is not None and not by_line:
+                    if can_split_input(input_filename, encoding):
+                        LOGGER.info('reading {} in byte ranges'.format(input_filename))
+                        writer = output_file
+                        if stats is not None:
+                            # the ranges are read by the worker processes
+                            count_input_file(input_filename, stats)
+                            writer = CountingWriter(output_file, stats)
+                        with phase(stats, 'rewrite'):
+                            for output in rewrite_byte_ranges(input_filename, trie,
+                                                              boundaries, encoding,
+                                                              pool, jobs, longest):
+                                writer.write(output)
+                        continue
+                    LOGGER.warning('cannot split {} into byte ranges; '
+                                   'rewriting it in a single process'.format(
+                                       input_filename))
+                with open_file(input_filename) as input_file:
+                    LOGGER.info('reading {}'.format(input_filename))
+                    rewrite_file(input_file, output_file, trie, boundaries, slow,
+                                 by_line, encoding, pool, jobs, longest, stats)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if hit_counts_filename:
+        write_hit_counts(hit_counts_filename, trie, boundaries, encoding)
+    if stats is not None:
+        if stats_file:
+            with io.open(stats_file, 'w', encoding='utf-8') as output_file:
+                stats.write(output_file)
+        else:
+            stats.write()
+
+def write_hit_counts(hit_counts_filename, trie, boundaries, encoding):
+    '''
+    Writes the replacement counts of ``trie`` as a tab-separated
+    file, with one line per pattern: the pattern, its replacement
+    and the number of times it was replaced, most frequent first.
+    Patterns and replacements are escaped like in a pattern file,
+    with word boundaries written as \\b.
+
+    Arguments:
+    - `hit_counts_filename`:
+    - `trie`: a ``CompiledAhoCorasickTrie`` which counts hits
+    - `boundaries`: whether ``trie`` matches on word boundaries
+    - `encoding`:
+    '''
+    patterns = trie.patterns()
+    if boundaries:
+        # the boundaries around whitespace are implied
+        patterns = [BOUNDARY_WHITESPACE_RE.sub(r'\1', pattern) for pattern in patterns]
+    order = sorted(range(len(patterns)), key=lambda idx: (-trie.hit_counts[idx],
+                                                          patterns[idx]))
+    with open_file(hit_counts_filename, 'wb') as output_file:
+        for idx in order:
+            output_file.write('{}\t{}\t{}\n'.format(
+                escape_pattern(patterns[idx]), escape_pattern(trie.values[idx]),
+                trie.hit_counts[idx]).encode(encoding))
+
+def count_input_file(input_filename, stats):
+    '''
+    Counts the bytes and lines in the given input file into
+    ``stats``, for input which is not read by ``rewrite_file``.
+
+    Arguments:
+    - `input_filename`:
+    - `stats`: a ``fsed.stats.Stats`` object
+    '''
+    stats.count('input_files')
+    with open(input_filename, 'rb') as input_file:
+        input_file = CountingReader(input_file, stats)
+        for _block in iter(lambda: input_file.read(BLOCK_SIZE), b''):
+            pass
+
+def rewrite_file(input_file, output_file, trie, boundaries, slow, by_line,
+                 encoding, pool=None, jobs=1, longest=False, stats=None):
+    '''
+    Rewrites one input file to ``output_file``.
+
+    Arguments:
+    - `input_file`: a binary file object
+    - `output_file`: a binary file object
+    - `trie`:
+    - `boundaries`:
+    - `slow`:
+    - `by_line`:
+    - `encoding`:
+    - `pool`: an optional worker pool for --by-line rewriting, created
+      by ``make_worker_pool``; it is not used with --across-lines
+    - `jobs`: the number of processes in ``pool``
+    - `longest`: match leftmost-longest instead of greedily
+    - `stats`: an optional ``fsed.stats.Stats`` object, which records
+      the time spent rewriting (``rewrite``) and the amount of input
+      and output
+    '''
+    if stats is None:
+        _rewrite_file(input_file, output_file, trie, boundaries, slow, by_line,
+                      encoding, pool, jobs, longest)
+        return
+    stats.count('input_files')
+    with stats.phase('rewrite'):
+        _rewrite_file(CountingReader(input_file, stats),
+                      CountingWriter(output_file, stats), trie, boundaries, slow,
+                      by_line, encoding, pool, jobs, longest)
+
+def _rewrite_file(input_file, output_file, trie, boundaries, slow, by_line,
+                  encoding, pool, jobs, longest):
+    '''
+    Rewrites one input file to ``output_file``; see ``rewrite_file``.
+    '''
+    if by_line:
+        num_lines = 0
+        if pool is not None:
+            for output, batch_lines in rewrite_lines_parallel(
+                    input_file, pool, jobs, hit_counts=getattr(trie, 'hit_counts', None)):
+                output_file.write(output)
+                num_lines += batch_lines
+        else:
+            for line in input_file:
+                output_file.write(rewrite_encoded_line(line, trie, boundaries,
+                                                       slow, encoding, longest))
+                num_lines += 1
+        LOGGER.info('{} lines written'.format(num_lines))
+    elif use_byte_engine(encoding, boundaries, slow, longest, trie):
+        num_bytes = 0
+        for block in trie.greedy_replace_bytes_stream(iter(
+                lambda: input_file.read(BLOCK_SIZE), b'')):
+            output_file.write(block)
+            num_bytes += len(block)
+        LOGGER.info('{} bytes written'.format(num_bytes))
+    else:
+        num_chars = 0
+        encoder = codecs.getincrementalencoder(encoding)()
+        for block in rewrite_blocks_with_trie(read_blocks(input_file, encoding),
+                                              trie, boundaries, longest):
+            output_file.write(encoder.encode(block))
+            num_chars += len(block)
+        output_file.write(encoder.encode('', True))
+        LOGGER.info('{} characters written'.format(num_chars))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+reloader.py
+(c) Will Roberts  18 October, 2026
+
+Hot reloading of pattern files in long-running processes.
+
+A ``PatternReloader`` holds the automaton built from a pattern file,
+and watches the file from a background thread.  When the file
+changes, a new automaton is built in that thread with
+``fsed.fsed.load_compiled_trie``, and replaces the old one with a
+single assignment.  Rewriting never waits for a rebuild, and each
+document is rewritten from start to end with one automaton.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+import fsed.fsed
+import logging
+import os
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+# how often the pattern file is checked for changes, in seconds
+DEFAULT_INTERVAL = 1.0
+
+def file_signature(filename):
+    '''
+    Returns a value which changes whenever the given file is
+    modified or replaced, or None if the file does not exist.
+
+    Arguments:
+    - `filename`:
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class PatternReloader(object):
+    '''
+    Rewrites text with the patterns in a pattern file, and rebuilds
+    the automaton in a background thread whenever the file changes.
+
+    The automaton and its word boundary flag are kept together in
+    the ``automaton`` attribute, which is only ever replaced, never
+    changed in place.  ``rewrite`` reads it once per document; to
+    rewrite a stream with one automaton, take ``automaton`` once and
+    pass it on, e.g., to ``fsed.fsed.rewrite_blocks_with_trie``.
+    '''
+
+    def __init__(self, pattern_filename, pattern_format='auto', encoding='utf-8',
+                 on_word_boundaries=False, cache_dir=None,
+                 interval=DEFAULT_INTERVAL, start=True):
+        '''
+        Constructor.  Builds the first automaton in the calling thread,
+        so that errors in the pattern file are raised here.
+
+        Arguments:
+        - `pattern_filename`:
+        - `pattern_format`:
+        - `encoding`:
+        - `on_word_boundaries`:
+        - `cache_dir`: an optional cache directory for compiled
+          automata (see ``fsed.cache``)
+        - `interval`: how often to check the pattern file for changes,
+          in seconds
+        - `start`: whether to start the watching thread; without it,
+          call ``check`` to reload
+        '''
+        self.pattern_filename = pattern_filename
+        self.pattern_format = pattern_format
+        self.encoding = encoding
+        self.on_word_boundaries = on_word_boundaries
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.signature = file_signature(pattern_filename)
+        self.automaton = self.build()
+        # the number of automata built after the first one
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def build(self):
+        '''
+        Builds an automaton from the pattern file.  Returns a tuple
+        ``(trie, boundaries)``.
+        '''
+        return fsed.fsed.load_compiled_trie(self.pattern_filename,
+                                            self.pattern_format, self.encoding,
+                                            self.on_word_boundaries, self.cache_dir)
+
+    def check(self):
+        '''
+        Rebuilds the automaton if the pattern file has changed since
+        it was last built.  If the new pattern file cannot be read,
+        the error is logged and the old automaton is kept.  Returns
+        True if the automaton was replaced.
+        '''
+        signature = file_signature(self.pattern_filename)
+        if signature is None or signature == self.signature:
+            return False
+        try:
+            automaton = self.build()
+        except Exception as exc:
+            LOGGER.warning('keeping the old patterns; cannot load {}: {}'.format(
+                self.pattern_filename, exc))
+            # do not retry until the file changes again
+            self.signature = signature
+            return False
+        # if the file changed again while it was being read, it is
+        # rebuilt on the next check
+        self.signature = signature
+        self.automaton = automaton
+        self.reloads += 1
+        LOGGER.info('reloaded patterns from {}'.format(self.pattern_filename))
+        return True
+
+    def rewrite(self, text):
+        '''
+        Rewrites one string with the current automaton.
+
+        Arguments:
+        - `text`:
+        '''
+        trie, boundaries = self.automaton
+        return fsed.fsed.rewrite_str_with_trie(text, trie, boundaries)
+
+    def rewrite_many(self, texts):
+        '''
+        Rewrites a batch of strings with the current automaton (see
+        ``fsed.fsed.rewrite_many``).  Returns the list of rewritten
+        strings.
+
+        Arguments:
+        - `texts`: an iterable of strings
+        '''
+        trie, boundaries = self.automaton
+        return fsed.fsed.rewrite_many(texts, trie, boundaries)
+
+    def start(self):
+        '''
+        Starts the thread which watches the pattern file.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch,
+                                        name='fsed-reloader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        '''
+        Stops the thread which watches the pattern file.  The current
+        automaton can still be used.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _watch(self):
+        '''
+        Body of the watching thread.
+        '''
+        while not self._stop.wait(self.interval):
+            self.check()
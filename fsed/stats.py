@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+stats.py
+(c) Will Roberts  18 October, 2026
+
+Run time statistics for ``fsed``.
+
+A ``Stats`` object collects the time spent in each phase of a run
+(loading patterns, building the trie, computing suffix links,
+compiling and rewriting), the amount of input and output, and the
+size of the automaton, and writes them out as JSON.  Functions which
+accept a ``stats`` argument record into it; when it is None, nothing
+is recorded.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+class Stats(object):
+    '''
+    Collects statistics about one run of ``fsed``.
+    '''
+
+    def __init__(self):
+        '''Constructor.'''
+        # seconds spent in each phase
+        self.timings = {}
+        # input and output sizes
+        self.counts = {'input_bytes': 0, 'input_lines': 0, 'output_bytes': 0,
+                       'input_files': 0}
+        # the size of the automaton, see ``automaton_stats``
+        self.automaton = {}
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Context manager which adds the time spent inside it to the
+        phase ``name``.
+
+        Arguments:
+        - `name`:
+        '''
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.time() - started
+
+    def count(self, name, amount=1):
+        '''
+        Adds ``amount`` to the count ``name``.
+
+        Arguments:
+        - `name`:
+        - `amount`:
+        '''
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def as_dict(self):
+        '''
+        Returns the statistics as a dict which can be serialized to
+        JSON.
+        '''
+        throughput = {}
+        seconds = self.timings.get('rewrite')
+        if seconds:
+            throughput = {
+                'bytes_per_second': self.counts['input_bytes'] / seconds,
+                'lines_per_second': self.counts['input_lines'] / seconds,
+            }
+        return {'timings': dict(self.timings), 'counts': dict(self.counts),
+                'throughput': throughput, 'automaton': dict(self.automaton)}
+
+    def write(self, output_file=None):
+        '''
+        Writes the statistics as a line of JSON.
+
+        Arguments:
+        - `output_file`: a text file object; the default is standard
+          error
+        '''
+        output_file = output_file or sys.stderr
+        output_file.write(json.dumps(self.as_dict(), sort_keys=True) + '\n')
+        output_file.flush()
+
+@contextmanager
+def _no_phase():
+    '''
+    Context manager which does nothing.
+    '''
+    yield
+
+def phase(stats, name):
+    '''
+    Returns a context manager which times the phase ``name`` into
+    ``stats``, or does nothing if ``stats`` is None.
+
+    Arguments:
+    - `stats`: a ``Stats`` object, or None
+    - `name`:
+    '''
+    if stats is None:
+        return _no_phase()
+    return stats.phase(name)
+
+class CountingReader(object):
+    '''
+    Wraps a binary file object, and counts the bytes and lines read
+    from it into a ``Stats`` object.
+    '''
+
+    def __init__(self, input_file, stats):
+        '''
+        Constructor.
+
+        Arguments:
+        - `input_file`: a binary file object
+        - `stats`: a ``Stats`` object
+        '''
+        self.input_file = input_file
+        self.stats = stats
+
+    def _counted(self, data):
+        '''
+        Counts and returns ``data``.
+        '''
+        self.stats.counts['input_bytes'] += len(data)
+        self.stats.counts['input_lines'] += data.count(b'\n')
+        return data
+
+    def read(self, size=-1):
+        return self._counted(self.input_file.read(size))
+
+    def readline(self):
+        return self._counted(self.input_file.readline())
+
+    def __iter__(self):
+        for line in self.input_file:
+            yield self._counted(line)
+
+class CountingWriter(object):
+    '''
+    Wraps a binary file object, and counts the bytes written to it
+    into a ``Stats`` object.
+    '''
+
+    def __init__(self, output_file, stats):
+        '''
+        Constructor.
+
+        Arguments:
+        - `output_file`: a binary file object
+        - `stats`: a ``Stats`` object
+        '''
+        self.output_file = output_file
+        self.stats = stats
+
+    def write(self, data):
+        self.stats.counts['output_bytes'] += len(data)
+        return self.output_file.write(data)
+
+    def flush(self):
+        self.output_file.flush()
+
+def _num_bytes(table):
+    '''
+    Returns the size in bytes of an array, memoryview or list of
+    integers.
+    '''
+    if table is None:
+        return 0
+    itemsize = getattr(table, 'itemsize', None)
+    if itemsize is None:
+        return sys.getsizeof(table)
+    return len(table) * itemsize
+
+def automaton_stats(trie):
+    '''
+    Describes the size of an automaton.  Returns a dict with the
+    number of states (nodes), transitions (edges) and patterns, and
+    an estimate of the memory used by the automaton in bytes.
+
+    Arguments:
+    - `trie`: an ``AhoCorasickTrie`` or a ``CompiledAhoCorasickTrie``
+    '''
+    if hasattr(trie, 'num_states'):
+        # compiled automaton: the memory used is that of its arrays
+        memory = sum(_num_bytes(table) for table in (
+            trie.base, trie.check, trie.target, trie.fail, trie.dict_fail,
+            trie.depth, trie.value, trie.greedy_table))
+        if isinstance(trie.values, list):
+            memory += sum(sys.getsizeof(value) for value in trie.values)
+        else:
+            memory += _num_bytes(trie.values.data) + _num_bytes(trie.values.offsets)
+        return {'states': trie.num_states,
+                'edges': trie.num_states - 1,
+                'patterns': len(trie.values),
+                'symbol_classes': trie.num_classes,
+                'dfa': trie.dfa,
+                'engine': trie.engine,
+                'memory_bytes': memory}
+    nodes = patterns = memory = 0
+    for node, _parent in trie.dfs():
+        nodes += 1
+        patterns += node.has_value
+        memory += (sys.getsizeof(node) + sys.getsizeof(node.__dict__) +
+                   sys.getsizeof(node.prefix))
+    return {'states': nodes, 'edges': nodes - 1, 'patterns': patterns,
+            'memory_bytes': memory}
@@ -10,8 +10,33 @@ Unit tests for the ``ahocorasick`` module.
 
 from __future__ import absolute_import, print_function, unicode_literals
 from .. import ahocorasick
+import random
+import time
 import unittest
 
+def chart_replace(trie, seq):
+    '''
+    The O(n**2) chart parser formerly used by
+    ``AhoCorasickTrie.replace``, kept as a reference implementation.
+    '''
+    seq = list(seq)
+    chart = [[None for _i in range(len(seq))] for _i in range(len(seq))]
+    chart[0] = [(0, char) for char in seq]
+    for (begin, length, value) in trie.find_all(seq):
+        chart[length-1][begin] = (length, value)
+    for row in range(1, len(chart)):
+        for col in range(len(seq) - row):
+            if chart[row][col] is not None:
+                continue
+            best_score = -1
+            for partition_point in range(row):
+                s1, v1 = chart[partition_point][col]
+                s2, v2 = chart[row - partition_point - 1][col + partition_point + 1]
+                if best_score < s1 + s2:
+                    best_score = s1 + s2
+                    chart[row][col] = (best_score, v1 + v2)
+    return chart[len(seq)-1][0][1]
+
 class TestAhocorasick(unittest.TestCase):
     '''
     Unit tests for the `ahocorasick` module.
@@ -49,6 +74,41 @@ class TestAhocorasick(unittest.TestCase):
         self.assertEqual(''.join(ahocorasick.boundary_transform('\x00abc def\x00', False)),
                          '\x00abc\x00 \x00def\x00')
 
+    def test_boundary_transform_blocks(self):
+        '''
+        Test the boundary_transform on streams of blocks.
+        '''
+        test_strings = ['', 'abc', 'abc def', '  abc def  ', '\x00abc def\x00',
+                        'abc\x00 \x00def', ' a\n\nb c\t']
+        for force_edges in [False, True]:
+            for test_string in test_strings:
+                expected = ''.join(ahocorasick.boundary_transform(test_string,
+                                                                  force_edges))
+                for split in range(len(test_string) + 1):
+                    blocks = [test_string[:split], test_string[split:]]
+                    self.assertEqual(''.join(ahocorasick.boundary_transform_blocks(
+                        blocks, force_edges)), expected)
+                self.assertEqual(''.join(ahocorasick.boundary_transform_blocks(
+                    iter(test_string), force_edges)), expected)
+
+    def test_boundary_transform_str(self):
+        '''
+        Test that transforming whole strings gives the same output as
+        transforming iterables of characters.
+        '''
+        rnd = random.Random(1313)
+        for _ in range(2000):
+            test_string = ''.join(rnd.choice('ab \n\t\x00')
+                                  for _ in range(rnd.randint(0, 12)))
+            for force_edges in [False, True]:
+                transformed = ahocorasick.boundary_transform(test_string, force_edges)
+                self.assertEqual(transformed,
+                                 ''.join(ahocorasick.boundary_transform(
+                                     iter(test_string), force_edges)))
+                self.assertEqual(ahocorasick.boundary_untransform(transformed),
+                                 ''.join(ahocorasick.boundary_untransform(
+                                     iter(transformed))))
+
     def test_transform_roundtrip(self):
         '''
         Test boundary_transform round trip.
@@ -333,6 +393,135 @@ class TestAhocorasick(unittest.TestCase):
             trie.greedy_replace(ahocorasick.boundary_transform('my dog is a ca catty cat cat')))),
                          'my (dog) is a (ca) catty (cat) (cat)')
 
+    def test_greedy_replace_spans(self):
+        '''
+        greedy_replace copies the text between matches unchanged, for
+        string and iterator input.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['ab'] = '(ab)'
+        trie['xbc'] = '(xbc)'
+        trie['b'] = '(b)'
+        text = 'ab' + 'z' * 1000 + 'xbd' + 'z' * 1000 + 'xb'
+        expected = '(ab)' + 'z' * 1000 + 'x(b)d' + 'z' * 1000 + 'x(b)'
+        self.assertEqual(trie.greedy_replace(text), expected)
+        self.assertEqual(trie.greedy_replace(iter(text)), expected)
+        self.assertEqual(trie.greedy_replace(''), '')
+
+    def test_replace(self):
+        '''
+        Compares replace against the chart parser on random patterns
+        and input.
+        '''
+        rnd = random.Random(4321)
+        for _ in range(500):
+            trie = ahocorasick.AhoCorasickTrie()
+            for idx in range(rnd.randint(1, 8)):
+                pattern = ''.join(rnd.choice('abc') for _ in range(rnd.randint(1, 4)))
+                trie[pattern] = '({})'.format(idx)
+            for _ in range(5):
+                seq = ''.join(rnd.choice('abcd') for _ in range(rnd.randint(1, 20)))
+                self.assertEqual(trie.replace(seq), chart_replace(trie, seq))
+        self.assertEqual(trie.replace(''), '')
+
+    def test_longest_replace(self):
+        '''
+        Leftmost-longest matching finds superstrings of shorter
+        patterns.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['cat'] = '(cat)'
+        trie['cats'] = '(cats)'
+        trie['scat'] = '(scat)'
+        self.assertEqual(trie.greedy_replace('cats scats'), '(cat)s (scat)s')
+        self.assertEqual(trie.longest_replace('cats scats'), '(cats) (scat)s')
+        self.assertEqual(trie.longest_replace(iter('catscat')), '(cats)(cat)')
+        self.assertEqual(trie.longest_replace(''), '')
+
+    def test_replace_long(self):
+        '''
+        replace runs in linear time on long input.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['ab'] = '(ab)'
+        trie['bab'] = '(bab)'
+        trie['b'] = '(b)'
+        started = time.time()
+        output = trie.replace('ab' * 50000 + 'c')
+        self.assertTrue(time.time() - started < 10)
+        self.assertEqual(output, '(ab)' * 50000 + 'c')
+
+    def test_insert_after_search(self):
+        '''
+        Inserting into a trie which has been searched keeps its links
+        identical to those of a freshly built trie.
+        '''
+        rnd = random.Random(1414)
+        for _ in range(300):
+            trie = ahocorasick.AhoCorasickTrie()
+            patterns = {}
+            for idx in range(rnd.randint(1, 10)):
+                pattern = ''.join(rnd.choice('abc') for _ in range(rnd.randint(1, 5)))
+                trie[pattern] = patterns[pattern] = '({})'.format(idx)
+                fresh = ahocorasick.AhoCorasickTrie()
+                fresh.update(patterns)
+                self.assertEqual(list(trie.find_all('abcabcaabbcc')),
+                                 list(fresh.find_all('abcabcaabbcc')))
+                self.assertEqual(trie.pretty_print_str(), fresh.pretty_print_str())
+                self.assertEqual([(node.prefix, node.longest_prefix and node.longest_prefix.prefix)
+                                  for node, _parent in trie.bfs()],
+                                 [(node.prefix, node.longest_prefix and node.longest_prefix.prefix)
+                                  for node, _parent in fresh.bfs()])
+
+    def test_delete(self):
+        '''
+        Deleting from a trie which has been searched prunes it and keeps
+        its links identical to those of a freshly built trie.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie.update({'a': '(a)', 'ab': '(ab)', 'bab': '(bab)', 'b': '(b)'})
+        self.assertEqual(trie.greedy_replace('abab'), '(a)(b)(a)(b)')
+        del trie['a']
+        del trie['b']
+        self.assertEqual(trie.greedy_replace('abab'), '(ab)(ab)')
+        # changing a value does not touch the links
+        trie['ab'] = '[ab]'
+        self.assertEqual(trie.greedy_replace('abab'), '[ab][ab]')
+        del trie['ab']
+        self.assertEqual(trie.greedy_replace('abab'), 'a(bab)')
+        self.assertFalse('ab' in trie)
+        self.assertEqual(sorted(trie.root), ['b'])
+        self.assertRaises(KeyError, trie.__delitem__, 'ab')
+        self.assertRaises(KeyError, trie.__delitem__, 'ba')
+        rnd = random.Random(1515)
+        for _ in range(300):
+            trie = ahocorasick.AhoCorasickTrie()
+            trie._set_suffix_links()
+            patterns = {}
+            for idx in range(rnd.randint(1, 20)):
+                if patterns and rnd.random() < 0.4:
+                    pattern = rnd.choice(sorted(patterns))
+                    del trie[pattern]
+                    del patterns[pattern]
+                else:
+                    pattern = ''.join(rnd.choice('abc') for _ in range(rnd.randint(1, 5)))
+                    trie[pattern] = patterns[pattern] = '({})'.format(idx)
+                fresh = ahocorasick.AhoCorasickTrie()
+                fresh.update(patterns)
+                fresh._set_suffix_links()
+                self.assertEqual(trie.pretty_print_str(), fresh.pretty_print_str())
+
+    def test_update(self):
+        '''
+        Test bulk insertion.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie.update({'a': '(a)', 'bc': '(bc)'})
+        self.assertEqual(trie.greedy_replace('abcd'), '(a)(bc)d')
+        trie.update([('cd', '(cd)'), ('b', '(b)')])
+        self.assertEqual(trie.greedy_replace('abcd'), '(a)(b)(cd)')
+        self.assertEqual(trie['bc'], '(bc)')
+
 
 if __name__ == '__main__':
     unittest.main()
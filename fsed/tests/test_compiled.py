@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+test_compiled.py
+(c) Will Roberts  18 October, 2026
+
+Unit tests for the ``compiled`` module.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from .. import ahocorasick
+from .. import compiled
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+def wikipedia_trie():
+    '''
+    Builds the Aho-Corasick test case from Wikipedia.
+
+    https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
+    '''
+    trie = ahocorasick.AhoCorasickTrie()
+    trie['a'] = '(a)'
+    trie['ab'] = '(ab)'
+    trie['bab'] = '(bab)'
+    trie['bc'] = '(bc)'
+    trie['bca'] = '(bca)'
+    trie['c'] = '(c)'
+    trie['caa'] = '(caa)'
+    return trie
+
+def random_trie(rnd, alphabet='abc', max_patterns=8, max_length=4):
+    '''
+    Builds a small AhoCorasickTrie with random patterns.
+    '''
+    trie = ahocorasick.AhoCorasickTrie()
+    for idx in range(rnd.randint(1, max_patterns)):
+        pattern = ''.join(rnd.choice(alphabet)
+                          for _ in range(rnd.randint(1, max_length)))
+        trie[pattern] = '({})'.format(idx)
+    return trie
+
+def random_strings(rnd, alphabet='abcd', count=5, max_length=15):
+    '''
+    Generates random test input strings.
+    '''
+    return [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, max_length)))
+            for _ in range(count)]
+
+class TestCompiled(unittest.TestCase):
+    '''
+    Unit tests for the `compiled` module.
+    '''
+
+    def test_structure(self):
+        '''
+        Checks the arrays of a compiled automaton.
+        '''
+        compiled_trie = wikipedia_trie().compile()
+        self.assertTrue(isinstance(compiled_trie, compiled.CompiledAhoCorasickTrie))
+        # root, a, b, c, ab, ba, bc, ca, bab, bca, caa
+        self.assertEqual(compiled_trie.num_states, 11)
+        self.assertEqual(compiled_trie.num_classes, 4)
+        self.assertEqual(list(compiled_trie.depth),
+                         [0, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3])
+        # the failure link of "bca" is "ca", its dictionary link is "a"
+        self.assertEqual(compiled_trie.fail[9], 7)
+        self.assertEqual(compiled_trie.dict_fail[9], 1)
+        self.assertEqual(compiled_trie.values[compiled_trie.value[9]], '(bca)')
+        for state in range(compiled_trie.num_states):
+            for cls in range(compiled_trie.num_classes):
+                slot = compiled_trie.base[state] + cls
+                self.assertTrue(slot < len(compiled_trie.check))
+
+    def test_wikipedia(self):
+        '''
+        Compares find_all and greedy_replace against the trie.
+        '''
+        trie = wikipedia_trie()
+        compiled_trie = trie.compile()
+        self.assertEqual(list(compiled_trie.find_all('abccab')),
+                         [(0, 1, '(a)'), (0, 2, '(ab)'), (1, 2, '(bc)'),
+                          (2, 1, '(c)'), (3, 1, '(c)'), (4, 1, '(a)'),
+                          (4, 2, '(ab)')])
+        self.assertEqual(compiled_trie.greedy_replace('abccab'),
+                         '(a)(bc)(c)(a)b')
+        self.assertEqual(compiled_trie.greedy_replace(iter('abccab')),
+                         '(a)(bc)(c)(a)b')
+        self.assertEqual(compiled_trie.greedy_replace('ba'), 'b(a)')
+        self.assertEqual(compiled_trie.greedy_replace('bab'), '(bab)')
+        self.assertEqual(compiled_trie.greedy_replace(''), '')
+
+    def test_compiled_trie_unchanged(self):
+        '''
+        Changing the trie after compilation does not change the
+        compiled automaton.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['cart'] = '(cart)'
+        compiled_trie = trie.compile()
+        trie['cat'] = '(cat)'
+        self.assertEqual(compiled_trie.greedy_replace('cat cart'), 'cat (cart)')
+        self.assertEqual(trie.greedy_replace('cat cart'), '(cat) (cart)')
+
+    def test_random(self):
+        '''
+        Compares the compiled automaton against the trie on random
+        patterns and input.
+        '''
+        rnd = random.Random(1234)
+        for _ in range(300):
+            trie = random_trie(rnd)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                for seq in random_strings(rnd):
+                    self.assertEqual(compiled_trie.greedy_replace(seq),
+                                     trie.greedy_replace(seq))
+                    self.assertEqual(list(compiled_trie.find_all(seq)),
+                                     list(trie.find_all(seq)))
+
+    def test_find_spans(self):
+        '''
+        find_spans and count_all find the same matches as find_all
+        and greedy_replace.
+        '''
+        rnd = random.Random(2468)
+        for _ in range(200):
+            trie = random_trie(rnd)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                values = list(compiled_trie.values)
+                for seq in random_strings(rnd):
+                    spans = compiled_trie.find_spans(seq)
+                    matches = [(spans[idx], spans[idx + 1], values[spans[idx + 2]])
+                               for idx in range(0, len(spans), 3)]
+                    self.assertEqual(matches, list(trie.find_all(seq)))
+                    counts = compiled_trie.count_all(seq)
+                    self.assertEqual(list(counts), [spans[2::3].count(idx)
+                                                    for idx in range(len(values))])
+                    # the matches which greedy_replace replaces
+                    spans = compiled_trie.find_spans(seq, overlapping=False)
+                    output = []
+                    mark = 0
+                    for idx in range(0, len(spans), 3):
+                        output.append(seq[mark:spans[idx]])
+                        output.append(values[spans[idx + 2]])
+                        mark = spans[idx] + spans[idx + 1]
+                    output.append(seq[mark:])
+                    self.assertEqual(''.join(output), compiled_trie.greedy_replace(seq))
+                    self.assertEqual(list(compiled_trie.count_all(seq, False)),
+                                     [spans[2::3].count(idx) for idx in range(len(values))])
+        # buffers can be reused
+        compiled_trie = wikipedia_trie().compile()
+        counts = compiled_trie.count_all('abccab')
+        spans = compiled_trie.find_spans('abccab')
+        compiled_trie.count_all('abccab', counts=counts)
+        compiled_trie.find_spans('abccab', spans=spans)
+        self.assertEqual(sum(counts), len(spans) // 3)
+        self.assertEqual(spans[:len(spans) // 2], spans[len(spans) // 2:])
+
+    def test_many(self):
+        '''
+        The *_many methods give the same results as rewriting or
+        searching each string on its own, including when a string or
+        a value contains the separator.
+        '''
+        rnd = random.Random(1357)
+        batch_chars = compiled.MANY_BATCH_CHARS
+        try:
+            for idx in range(200):
+                compiled.MANY_BATCH_CHARS = rnd.choice([1, 10, 1000])
+                trie = random_trie(rnd, 'ab c')
+                if idx % 10 == 0:
+                    trie['c'] = compiled.SEPARATOR_CANDIDATES[0]
+                words_trie = ahocorasick.AhoCorasickTrie()
+                for node, _parent in trie.dfs():
+                    if node.has_value:
+                        words_trie[ahocorasick.boundary_transform(node.prefix)] = node.value
+                alphabet = 'abc d' + compiled.SEPARATOR_CANDIDATES[:idx % 3]
+                strings = random_strings(rnd, alphabet, count=12, max_length=8)
+                for dfa in [False, True]:
+                    compiled_trie = trie.compile(dfa)
+                    self.assertEqual(compiled_trie.greedy_replace_many(strings),
+                                     [compiled_trie.greedy_replace(seq) for seq in strings])
+                    self.assertEqual(compiled_trie.longest_replace_many(iter(strings)),
+                                     [compiled_trie.longest_replace(seq) for seq in strings])
+                    self.assertEqual(compiled_trie.find_all_many(strings),
+                                     [list(compiled_trie.find_all(seq)) for seq in strings])
+                    compiled_trie = words_trie.compile(dfa)
+                    self.assertEqual(compiled_trie.greedy_replace_words_many(strings),
+                                     [compiled_trie.greedy_replace_words(seq)
+                                      for seq in strings])
+        finally:
+            compiled.MANY_BATCH_CHARS = batch_chars
+
+    def test_count_all_many(self):
+        '''
+        count_all_many and find_all_many give the same results with and
+        without NumPy, as counting or searching each string on its own.
+        '''
+        rnd = random.Random(2468)
+        saved_numpy = compiled.numpy
+        batch_chars = compiled.LOCKSTEP_BATCH_CHARS
+        try:
+            for idx in range(200):
+                compiled.numpy = saved_numpy if idx % 2 else None
+                compiled.LOCKSTEP_BATCH_CHARS = rnd.choice([1, 10, 1000])
+                trie = random_trie(rnd, 'ab c\xe9')
+                strings = random_strings(rnd, 'abc d\xe9', count=12, max_length=12)
+                for dfa in [False, True]:
+                    compiled_trie = trie.compile(dfa)
+                    counts = compiled_trie.count_all('')
+                    for seq in strings:
+                        compiled_trie.count_all(seq, counts=counts)
+                    self.assertEqual(compiled_trie.count_all_many(iter(strings)), counts)
+                    self.assertEqual(compiled_trie.find_all_many(strings),
+                                     [list(compiled_trie.find_all(seq)) for seq in strings])
+        finally:
+            compiled.numpy = saved_numpy
+            compiled.LOCKSTEP_BATCH_CHARS = batch_chars
+
+    def test_root_skip(self):
+        '''
+        Skipping the input which cannot begin a match does not change
+        the results.
+        '''
+        rnd = random.Random(97531)
+        for _ in range(200):
+            trie = ahocorasick.AhoCorasickTrie()
+            for idx in range(rnd.randint(1, 6)):
+                pattern = rnd.choice('xy') + ''.join(rnd.choice('ab cx') for _ in
+                                                     range(rnd.randint(0, 5)))
+                trie[pattern] = '({})'.format(idx)
+            seq = ''.join(rnd.choice('ab c' * 20 + 'xy') for _ in range(rnd.randint(0, 300)))
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                self.assertEqual(compiled_trie.greedy_replace(seq), trie.greedy_replace(seq))
+                self.assertEqual(list(compiled_trie.find_all(seq)), list(trie.find_all(seq)))
+                cut = rnd.randint(0, len(seq))
+                self.assertEqual(''.join(compiled_trie.greedy_replace_stream(
+                    [seq[:cut], seq[cut:]])), trie.greedy_replace(seq))
+        # long stretches of input are left out
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['xyz'] = 'X'
+        compiled_trie = trie.compile()
+        seq = 'a' * 100 + 'xyz' + 'a' * 100
+        self.assertEqual([offset for offset, _piece in compiled_trie._scan_pieces(seq)],
+                         [0, 100, 203])
+        self.assertEqual(compiled_trie.greedy_replace(seq), 'a' * 100 + 'X' + 'a' * 100)
+
+    def test_wu_manber(self):
+        '''
+        The Wu-Manber engine gives the same results as the
+        Aho-Corasick engine, and is chosen for long patterns.
+        '''
+        rnd = random.Random(86420)
+        for _ in range(200):
+            trie = random_trie(rnd, 'abcd', max_length=7)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa, engine=compiled.WU_MANBER)
+                self.assertEqual(compiled_trie.engine, compiled.WU_MANBER)
+                for seq in random_strings(rnd, 'abcdxyz', max_length=100):
+                    self.assertEqual(compiled_trie.greedy_replace(seq),
+                                     trie.greedy_replace(seq))
+                    self.assertEqual(list(compiled_trie.find_all(seq)),
+                                     list(trie.find_all(seq)))
+                    cut = rnd.randint(0, len(seq))
+                    self.assertEqual(''.join(compiled_trie.greedy_replace_stream(
+                        [seq[:cut], seq[cut:]])), trie.greedy_replace(seq))
+        with self.assertRaises(ValueError):
+            trie.compile(engine='boyer-moore')
+        # the engine is chosen from the patterns, and saved with them
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['needle'] = 'pin'
+        self.assertEqual(trie.compile().engine, compiled.AHO_CORASICK)
+        trie['haystack needle'] = 'pin'
+        self.assertEqual(trie.compile().engine, compiled.AHO_CORASICK)
+        del trie['needle']
+        compiled_trie = trie.compile()
+        self.assertEqual(compiled_trie.engine, compiled.WU_MANBER)
+        seq = 'hay' * 100 + 'haystack needle' + 'stack' * 100
+        self.assertEqual(compiled_trie.greedy_replace(seq), 'hay' * 100 + 'pin' + 'stack' * 100)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'trie.fsed')
+            trie.compile(engine=compiled.AHO_CORASICK).save(filename)
+            loaded = compiled.load(filename)
+            self.assertEqual(loaded.engine, compiled.AHO_CORASICK)
+            loaded.engine = compiled.WU_MANBER
+            self.assertEqual(pickle.loads(pickle.dumps(loaded)).engine, compiled.WU_MANBER)
+            self.assertEqual(loaded.greedy_replace(seq), 'hay' * 100 + 'pin' + 'stack' * 100)
+            del loaded
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_greedy_replace_stream(self):
+        '''
+        Rewriting a stream of blocks gives the same output as rewriting
+        their concatenation, wherever the blocks are split.
+        '''
+        rnd = random.Random(5678)
+        for _ in range(200):
+            trie = random_trie(rnd, 'ab\n', max_length=5)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                for seq in random_strings(rnd, 'ab\nc', max_length=30):
+                    cuts = sorted(rnd.randint(0, len(seq)) for _ in range(3))
+                    blocks = [seq[begin:end] for begin, end in
+                              zip([0] + cuts, cuts + [len(seq)])]
+                    self.assertEqual(''.join(compiled_trie.greedy_replace_stream(blocks)),
+                                     trie.greedy_replace(seq))
+        compiled_trie = wikipedia_trie().compile()
+        self.assertEqual(list(compiled_trie.greedy_replace_stream(['xb', 'a', 'b', 'c'])),
+                         ['x', '', '(bab)', '(c)', ''])
+        self.assertEqual(list(compiled_trie.greedy_replace_stream([])), [''])
+
+    def test_longest_replace(self):
+        '''
+        Compares leftmost-longest rewriting against the trie, in one
+        piece and as a stream of blocks.
+        '''
+        compiled_trie = wikipedia_trie().compile()
+        self.assertEqual(compiled_trie.longest_replace('abccab'), '(ab)(c)(c)(ab)')
+        self.assertEqual(compiled_trie.longest_replace('bcaa'), '(bca)(a)')
+        rnd = random.Random(2468)
+        for _ in range(200):
+            trie = random_trie(rnd, 'ab\n', max_length=5)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                for seq in random_strings(rnd, 'ab\nc', max_length=30):
+                    expected = trie.longest_replace(seq)
+                    self.assertEqual(compiled_trie.longest_replace(seq), expected)
+                    cuts = sorted(rnd.randint(0, len(seq)) for _ in range(3))
+                    blocks = [seq[begin:end] for begin, end in
+                              zip([0] + cuts, cuts + [len(seq)])]
+                    self.assertEqual(''.join(compiled_trie.longest_replace_stream(blocks)),
+                                     expected)
+
+    def test_greedy_replace_bytes(self):
+        '''
+        Rewriting UTF-8 bytes gives the encoded output of rewriting
+        the decoded text, in one piece and as a stream of blocks which
+        split multi-byte characters.
+        '''
+        compiled_trie = wikipedia_trie().compile()
+        self.assertEqual(compiled_trie.greedy_replace_bytes(b'abccab'),
+                         b'(a)(bc)(c)(a)b')
+        rnd = random.Random(1357)
+        alphabet = 'ab\u00e9\u4e2d\U0001f600'
+        for _ in range(200):
+            trie = random_trie(rnd, alphabet, max_length=3)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                for seq in random_strings(rnd, alphabet + 'c\u00ea', max_length=20):
+                    expected = compiled_trie.greedy_replace(seq).encode('utf-8')
+                    data = seq.encode('utf-8')
+                    self.assertEqual(compiled_trie.greedy_replace_bytes(data), expected)
+                    cuts = sorted(rnd.randint(0, len(data)) for _ in range(3))
+                    blocks = [data[begin:end] for begin, end in
+                              zip([0] + cuts, cuts + [len(data)])]
+                    self.assertEqual(b''.join(compiled_trie.greedy_replace_bytes_stream(blocks)),
+                                     expected)
+
+    def test_greedy_replace_words(self):
+        '''
+        Matching on word boundaries inside the automaton gives the same
+        output as rewriting the boundary-transformed input, including
+        input containing \\x00, in one piece and as a stream of blocks.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['\x00ab\x00'] = '(ab)'
+        trie['\x00b\x00 \x00'] = '(b )'
+        compiled_trie = trie.compile()
+        self.assertEqual(compiled_trie.greedy_replace_words('ab cab ab'), '(ab) cab (ab)')
+        # the boundary token before "ab" is consumed by the match of "b "
+        self.assertEqual(compiled_trie.greedy_replace_words('b ab'), '(b )ab')
+        rnd = random.Random(3579)
+        for _ in range(200):
+            trie = ahocorasick.AhoCorasickTrie()
+            for idx in range(rnd.randint(1, 8)):
+                pattern = ''.join(rnd.choice('ab \n') for _ in range(rnd.randint(1, 3)))
+                trie[''.join(ahocorasick.boundary_transform(pattern))] = '({})'.format(idx)
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                for seq in random_strings(rnd, 'ab \nc\x00', max_length=20):
+                    expected = ''.join(ahocorasick.boundary_untransform(
+                        compiled_trie.greedy_replace(ahocorasick.boundary_transform(seq))))
+                    self.assertEqual(compiled_trie.greedy_replace_words(seq), expected)
+                    cuts = sorted(rnd.randint(0, len(seq)) for _ in range(3))
+                    blocks = [seq[begin:end] for begin, end in
+                              zip([0] + cuts, cuts + [len(seq)])]
+                    self.assertEqual(''.join(compiled_trie.greedy_replace_words_stream(blocks)),
+                                     expected)
+
+    def test_hit_counts(self):
+        '''
+        Every rewriting engine counts the replacements made with each
+        pattern in the same way.
+        '''
+        compiled_trie = wikipedia_trie().compile()
+        patterns = compiled_trie.patterns()
+        self.assertEqual(sorted(patterns), ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa'])
+        self.assertTrue(compiled_trie.hit_counts is None)
+        seq = 'abccab bca caab'
+        engines = [
+            lambda: compiled_trie.greedy_replace(seq),
+            lambda: ''.join(compiled_trie.greedy_replace_stream([seq[:4], seq[4:]])),
+            lambda: compiled_trie.greedy_replace_bytes(seq.encode('utf-8')).decode('utf-8'),
+            lambda: b''.join(compiled_trie.greedy_replace_bytes_stream(
+                [seq[:5].encode('utf-8'), seq[5:].encode('utf-8')])).decode('utf-8'),
+        ]
+        for engine in engines:
+            hit_counts = compiled_trie.enable_hit_counts()
+            self.assertEqual(engine(), '(a)(bc)(c)(a)b (bc)(a) (c)(a)(a)b')
+            self.assertEqual(dict((pattern, hit_counts[idx])
+                                  for idx, pattern in enumerate(patterns)
+                                  if hit_counts[idx]),
+                             {'a': 5, 'bc': 2, 'c': 2})
+        hit_counts = compiled_trie.enable_hit_counts()
+        compiled_trie.longest_replace(seq)
+        self.assertEqual(hit_counts[patterns.index('caa')], 1)
+        # find_all does not count
+        hit_counts = compiled_trie.enable_hit_counts()
+        list(compiled_trie.find_all(seq))
+        self.assertEqual(sum(hit_counts), 0)
+        compiled_trie.hit_counts = None
+        self.assertEqual(compiled_trie.greedy_replace(seq), '(a)(bc)(c)(a)b (bc)(a) (c)(a)(a)b')
+        # on word boundaries
+        trie = ahocorasick.AhoCorasickTrie()
+        trie['\x00ab\x00'] = '(ab)'
+        trie['\x00b\x00 \x00'] = '(b )'
+        compiled_trie = trie.compile()
+        hit_counts = compiled_trie.enable_hit_counts()
+        self.assertEqual(compiled_trie.greedy_replace_words('ab b ab b'), '(ab) (b )ab b')
+        self.assertEqual(sorted(zip(compiled_trie.patterns(), hit_counts)),
+                         [('\x00ab\x00', 1), ('\x00b\x00 \x00', 1)])
+
+    def test_dfa(self):
+        '''
+        Checks the DFA transition tables.
+        '''
+        trie = wikipedia_trie()
+        self.assertTrue(trie.compile().dfa)
+        self.assertFalse(trie.compile(False).dfa)
+        max_entries = compiled.DFA_MAX_ENTRIES
+        try:
+            compiled.DFA_MAX_ENTRIES = 10
+            self.assertFalse(trie.compile().dfa)
+        finally:
+            compiled.DFA_MAX_ENTRIES = max_entries
+        compiled_trie = trie.compile(True)
+        num_classes = compiled_trie.num_classes
+        # one row per state, one column per symbol class
+        self.assertEqual(len(compiled_trie.greedy_table),
+                         compiled_trie.num_states * num_classes)
+        # "b" followed by "c" reaches "bc", which is rewritten
+        row = compiled_trie.greedy_table[compiled_trie.alphabet['b']]
+        self.assertEqual(row, 2 * num_classes)
+        entry = compiled_trie.greedy_table[row + compiled_trie.alphabet['c']]
+        next_row, emits = compiled_trie.greedy_actions[~entry]
+        self.assertEqual(next_row, 0)
+        self.assertEqual([(end, width, compiled_trie.values[val])
+                          for end, width, val in emits], [(1, 2, '(bc)')])
+        # characters outside the patterns all share symbol class 0
+        self.assertEqual(compiled_trie.greedy_replace('xbcabyc'), 'x(bc)(a)by(c)')
+        self.assertEqual(list(compiled_trie.find_all('xcy')), [(1, 1, '(c)')])
+
+    def test_save_load(self):
+        '''
+        Round-trips compiled automata through the binary file format.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'wikipedia.fsa')
+            trie = wikipedia_trie()
+            trie['\u201cb\u201d'] = '(\u201cb\u201d)'
+            seqs = ['abccab', 'xbcabyc', 'bca', '\u201cb\u201d \u201cbc']
+            for dfa in [False, True]:
+                compiled_trie = trie.compile(dfa)
+                compiled_trie.save(filename, {'boundaries': True})
+                for use_mmap in [True, False]:
+                    loaded = compiled.load(filename, use_mmap)
+                    self.assertEqual(loaded.dfa, dfa)
+                    self.assertEqual(loaded.metadata, {'boundaries': True})
+                    self.assertEqual(loaded.alphabet, compiled_trie.alphabet)
+                    self.assertEqual(list(loaded.depth), list(compiled_trie.depth))
+                    self.assertEqual(list(loaded.values), compiled_trie.values)
+                    for seq in seqs:
+                        self.assertEqual(loaded.greedy_replace(seq),
+                                         compiled_trie.greedy_replace(seq))
+                        self.assertEqual(loaded.greedy_replace_bytes(seq.encode('utf-8')),
+                                         compiled_trie.greedy_replace(seq).encode('utf-8'))
+                        self.assertEqual(list(loaded.find_all(seq)),
+                                         list(compiled_trie.find_all(seq)))
+                    # memory-mapped automata are pickled by file name
+                    pickled = pickle.dumps(loaded)
+                    self.assertEqual(filename.encode('utf-8') in pickled, use_mmap)
+                    unpickled = pickle.loads(pickled)
+                    self.assertEqual(unpickled.greedy_replace(seqs[-1]),
+                                     compiled_trie.greedy_replace(seqs[-1]))
+                    del loaded, unpickled
+            with open(filename, 'wb') as output_file:
+                output_file.write(b'not an automaton')
+            self.assertRaises(ValueError, compiled.load, filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
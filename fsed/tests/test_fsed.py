@@ -19,7 +19,10 @@ try:
 except ImportError:
     from io import BytesIO as StringIO
 import gzip
+import io
+import json
 import os
+import shutil
 import tempfile
 import unittest
 
@@ -126,6 +129,27 @@ class TestFsed(unittest.TestCase):
         self.assertEqual(fsed.rewrite_str_with_trie(INPUT_TEXT, trie, boundaries),
                          WITH_WORDS_OUTPUT)
 
+    def test_rewrite_many(self):
+        '''
+        Tests the fsed.rewrite_many function.
+        '''
+        lines = INPUT_TEXT.split('\n') + ['', ' ', 'Marco Polo\x00and uncle']
+        for words in [False, True]:
+            trie, boundaries = fsed.build_trie(CMStringIO(PATTERN_TSV), 'tsv', 'utf-8',
+                                               words)
+            for options in [{}, {'slow': True}, {'longest': True}]:
+                expected = [fsed.rewrite_str_with_trie(line, trie, boundaries, **options)
+                            for line in lines]
+                self.assertEqual(fsed.rewrite_many(lines, trie, boundaries, **options),
+                                 expected)
+                if 'slow' not in options:
+                    self.assertEqual(fsed.rewrite_many(iter(lines), trie.compile(),
+                                                       boundaries, **options),
+                                     expected)
+        self.assertEqual('\n'.join(fsed.rewrite_many(INPUT_TEXT.split('\n'), trie,
+                                                     boundaries)),
+                         WITH_WORDS_OUTPUT)
+
     def test_rewriting_sed(self):
         '''
         Tests the fsed.rewrite_str_with_trie function.
@@ -159,6 +183,106 @@ class TestFsed(unittest.TestCase):
         self.assertEqual(fsed.rewrite_str_with_trie('abccab', trie, slow=True),
                          '(a)(bc)(c)(ab)')
 
+    def test_cache(self):
+        '''
+        Tests the fsed.load_compiled_trie function with a cache
+        directory.
+        '''
+        cache_dir = tempfile.mkdtemp()
+        try:
+            pattern_file = CMStringIO(PATTERN_TSV)
+            trie, boundaries = fsed.load_compiled_trie(pattern_file, 'tsv', 'utf-8',
+                                                       False, cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached_trie, cached_boundaries = fsed.load_compiled_trie(
+                pattern_file, 'tsv', 'utf-8', False, cache_dir)
+            self.assertFalse(cached_trie is trie)
+            self.assertTrue(cached_boundaries)
+            self.assertEqual(list(cached_trie.depth), list(trie.depth))
+            self.assertEqual(fsed.rewrite_str_with_trie(INPUT_TEXT, cached_trie,
+                                                        cached_boundaries),
+                             WITHOUT_WORDS_OUTPUT)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            # changing the options or the pattern file invalidates the cache
+            trie, boundaries = fsed.load_compiled_trie(pattern_file, 'tsv', 'utf-8',
+                                                       True, cache_dir)
+            self.assertEqual(fsed.rewrite_str_with_trie(INPUT_TEXT, trie, boundaries),
+                             WITH_WORDS_OUTPUT)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            pattern_file = CMStringIO(PATTERN_TSV + b'\nsand\tSAND')
+            trie, boundaries = fsed.load_compiled_trie(pattern_file, 'tsv', 'utf-8',
+                                                       False, cache_dir)
+            self.assertEqual(fsed.rewrite_str_with_trie('sand uncle', trie, boundaries),
+                             'SAND uncle')
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_across_lines(self):
+        '''
+        Tests the fsed.rewrite_blocks_with_trie function.
+        '''
+        pattern_file = CMStringIO(PATTERN_TSV + b'\nbKublai Khan\\nMarco\tX')
+        trie, boundaries = fsed.build_trie(pattern_file, 'tsv', 'utf-8', True)
+        trie = trie.compile()
+        text = INPUT_TEXT + '\n'
+        for block_size in [1, 3, len(text)]:
+            blocks = [text[idx:idx + block_size]
+                      for idx in range(0, len(text), block_size)]
+            self.assertEqual(''.join(fsed.rewrite_blocks_with_trie(blocks, trie,
+                                                                   boundaries)),
+                             WITH_WORDS_OUTPUT.replace('bKublai Khan\nMarco_Polo',
+                                                       'X Polo') + '\n')
+
+    def test_longest(self):
+        '''
+        Tests --longest in both --by-line and --across-lines mode.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            pattern_filename = path.join(tmpdir, 'patterns.tsv')
+            input_filename = path.join(tmpdir, 'input.txt')
+            with open(pattern_filename, 'wb') as output_file:
+                output_file.write(b'cat\t(cat)\ncats\t(cats)\ncats\\nin\t(cats in)\n')
+            with open(input_filename, 'wb') as output_file:
+                output_file.write(b'cats\nin cat cats\n')
+            for args, expected in [([], '(cats in) (cat) (cats)\n'),
+                                   (['--by-line'], '(cats)\nin (cat) (cats)\n'),
+                                   (['--jobs', '2'], '(cats in) (cat) (cats)\n')]:
+                exit_code, output, result = click_command_runner(
+                    fsed.main, ['--longest', '-o', '%t'] + args +
+                    [pattern_filename, input_filename])
+                self.assertEqual(exit_code, 0)
+                self.assertEqual(result, expected)
+            exit_code, output, result = click_command_runner(
+                fsed.main, ['--longest', '--slow', pattern_filename, input_filename])
+            self.assertNotEqual(exit_code, 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_byte_engine(self):
+        '''
+        UTF-8 input is rewritten as bytes unless word boundaries,
+        --slow or --longest are used, with the same output.
+        '''
+        self.assertTrue(fsed.use_byte_engine('UTF8', False, False, False))
+        self.assertFalse(fsed.use_byte_engine('latin-1', False, False, False))
+        self.assertFalse(fsed.use_byte_engine('utf-8', True, False, False))
+        self.assertFalse(fsed.use_byte_engine('utf-8', False, False, True))
+        trie, boundaries = fsed.build_trie(CMStringIO(PATTERN_TSV), 'tsv', 'utf-8', False)
+        trie = trie.compile()
+        text = INPUT_TEXT + '\n\u00e9 Marco Polo\n'
+        expected = ''.join(fsed.rewrite_str_with_trie(line, trie) + '\n'
+                           for line in text.split('\n')[:-1])
+        output = io.BytesIO()
+        fsed.rewrite_file(io.BytesIO(text.encode('utf-8')), output, trie, False,
+                          False, True, 'utf-8')
+        self.assertEqual(output.getvalue().decode('utf-8'), expected)
+        output = io.BytesIO()
+        fsed.rewrite_file(io.BytesIO(text.encode('utf-8')), output, trie, False,
+                          False, False, 'utf-8')
+        self.assertEqual(output.getvalue().decode('utf-8'), expected)
+
     def test_end2end(self):
         with gzip.open(path.join(HERE, 'sed-output.utf8.txt.gz')) as input_file:
             sed_output = input_file.read().decode('utf-8')
@@ -181,6 +305,194 @@ class TestFsed(unittest.TestCase):
         #self.assertEqual(output, '')
         self.assertEqual(result, sed_output)
         self.assertEqual(result, perl_output)
+        exit_code, output, result = click_command_runner(
+            fsed.main, ['--by-line', '-o', '%t',
+                        path.join(HERE, 'fsed-testpats.wb.sed'),
+                        path.join(HERE, 'fsed-testinput.utf8.txt.gz')])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(result, sed_output)
+        # both engines give the same output
+        results = []
+        for args in [['-w'], []]:
+            for engine in ['aho-corasick', 'wu-manber']:
+                exit_code, output, result = click_command_runner(
+                    fsed.main, args + ['--engine', engine, '-o', '%t',
+                                       path.join(HERE, 'fsed-testpats.tsv'),
+                                       path.join(HERE, 'fsed-testinput.utf8.txt.gz')])
+                self.assertEqual(exit_code, 0)
+                results.append(result)
+        self.assertEqual(results[:2], [sed_output, sed_output])
+        self.assertEqual(results[2], results[3])
+        exit_code, output, result = click_command_runner(
+            fsed.main, ['--slow', '--engine', 'wu-manber',
+                        path.join(HERE, 'fsed-testpats.tsv'),
+                        path.join(HERE, 'fsed-testinput.utf8.txt.gz')])
+        self.assertEqual(exit_code, 2)
+
+    def test_jobs(self):
+        '''
+        Rewriting with several worker processes gives the same output,
+        in the same order, as rewriting in one process.
+        '''
+        with gzip.open(path.join(HERE, 'sed-output.utf8.txt.gz')) as input_file:
+            sed_output = input_file.read().decode('utf-8')
+        exit_code, output, result = click_command_runner(
+            fsed.main, ['--by-line', '--jobs', '3', '-o', '%t',
+                        path.join(HERE, 'fsed-testpats.wb.sed'),
+                        path.join(HERE, 'fsed-testinput.utf8.txt.gz')])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(result, sed_output)
+        # small batches, so that many are in flight at once
+        trie, boundaries = fsed.build_trie(CMStringIO(PATTERN_TSV), 'tsv', 'utf-8', True)
+        trie = trie.compile()
+        input_lines = [line + b'\n' for line in INPUT_TEXT.encode('utf-8').split(b'\n')]
+        pool = fsed.make_worker_pool(2, trie, boundaries, False, 'utf-8')
+        try:
+            batches = list(fsed.rewrite_lines_parallel(input_lines, pool, 2, batch_size=2))
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(sum(num_lines for _output, num_lines in batches),
+                         len(input_lines))
+        self.assertEqual(b''.join(output for output, _num_lines in batches),
+                         b''.join(fsed.rewrite_encoded_line(line, trie, boundaries,
+                                                            False, 'utf-8')
+                                  for line in input_lines))
+
+    def test_stats(self):
+        '''
+        Tests the --stats-file option.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            stats_filename = path.join(tmpdir, 'stats.json')
+            input_filename = path.join(tmpdir, 'input.txt')
+            with open(input_filename, 'wb') as output_file:
+                output_file.write(INPUT_TEXT.encode('utf-8'))
+            exit_code, output, result = click_command_runner(
+                fsed.main, ['--stats-file', stats_filename, '-o', '%t',
+                            path.join(HERE, 'fsed-testpats.wb.sed'), input_filename])
+            self.assertEqual(exit_code, 0)
+            with io.open(stats_filename, encoding='utf-8') as input_file:
+                stats = json.load(input_file)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(set(stats['timings']), set(['load_patterns', 'build_trie',
+                                                     'suffix_links', 'compile',
+                                                     'rewrite']))
+        self.assertEqual(stats['counts']['input_files'], 1)
+        self.assertEqual(stats['counts']['input_bytes'], len(INPUT_TEXT))
+        self.assertEqual(stats['counts']['input_lines'], INPUT_TEXT.count('\n'))
+        self.assertEqual(stats['counts']['output_bytes'], len(result.encode('utf-8')))
+        self.assertTrue(stats['throughput']['bytes_per_second'] > 0)
+        self.assertTrue(stats['automaton']['states'] > stats['automaton']['patterns'])
+
+    def test_hit_counts(self):
+        '''
+        Replacement counts are the same with and without worker
+        processes, and are written as TSV by --hit-counts.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            input_filename = path.join(tmpdir, 'input.txt')
+            text = (INPUT_TEXT + '\naaaaa caaa\n') * 3
+            with open(input_filename, 'wb') as output_file:
+                output_file.write(text.encode('utf-8'))
+            trie, boundaries = fsed.build_trie(
+                CMStringIO(b'and uncle\tand_uncle\nKublai Khan\tKublai_Khan\naa\tA'),
+                'tsv', 'utf-8', False)
+            trie = trie.compile()
+            self.assertEqual(trie.patterns(), ['aa', 'and uncle', 'Kublai Khan'])
+            trie.enable_hit_counts()
+            ''.join(fsed.rewrite_blocks_with_trie([text], trie, boundaries))
+            self.assertEqual(list(trie.hit_counts), [9, 9, 6])
+            pool = fsed.make_worker_pool(2, trie, boundaries, False, 'utf-8')
+            try:
+                for range_size in [7, 100]:
+                    trie.enable_hit_counts()
+                    b''.join(fsed.rewrite_byte_ranges(input_filename, trie, boundaries,
+                                                      'utf-8', pool, 2,
+                                                      range_size=range_size,
+                                                      block_size=5))
+                    self.assertEqual(list(trie.hit_counts), [9, 9, 6])
+                trie.enable_hit_counts()
+                lines = text.encode('utf-8').splitlines(True)
+                list(fsed.rewrite_lines_parallel(lines, pool, 2, batch_size=2,
+                                                 hit_counts=trie.hit_counts))
+                self.assertEqual(list(trie.hit_counts), [9, 9, 6])
+            finally:
+                pool.terminate()
+                pool.join()
+            # counts are summed over the input files
+            pattern_filename = path.join(tmpdir, 'patterns.sed')
+            with open(pattern_filename, 'wb') as output_file:
+                output_file.write(PATTERN_SED)
+            hit_counts_filename = path.join(tmpdir, 'hits.tsv')
+            for args in [[], ['--by-line', '-j', '2'], ['-j', '2']]:
+                exit_code, output, result = click_command_runner(
+                    fsed.main, args + ['-o', '%t', '--hit-counts', hit_counts_filename,
+                                       pattern_filename, input_filename, input_filename])
+                self.assertEqual(exit_code, 0)
+                with io.open(hit_counts_filename, encoding='utf-8') as input_file:
+                    hits = [line.rstrip('\n').split('\t') for line in input_file]
+                self.assertEqual(hits, [['and uncle', 'and_uncle', '18'],
+                                        ['Kublai Khan', 'Kublai_Khan', '12'],
+                                        ['\\bMarco Polo', 'Marco_Polo', '6'],
+                                        ['Christopher Columbus', 'Christopher_Columbus',
+                                         '0']])
+            exit_code, output, result = click_command_runner(
+                fsed.main, ['--slow', '--hit-counts', hit_counts_filename,
+                            pattern_filename, input_filename])
+            self.assertEqual(exit_code, 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_byte_ranges(self):
+        '''
+        Rewriting a file in byte ranges gives the same output as
+        rewriting it as one stream, including when the worker for a
+        range starts out of step with the serial run.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            input_filename = path.join(tmpdir, 'input.txt')
+            text = (INPUT_TEXT + '\naaaaa caaa \u00e9\u00e9\u00e9\n') * 3
+            with open(input_filename, 'wb') as output_file:
+                output_file.write(text.encode('utf-8'))
+            self.assertTrue(fsed.can_split_input(input_filename, 'utf-8'))
+            self.assertFalse(fsed.can_split_input(input_filename, 'utf-16'))
+            self.assertFalse(fsed.can_split_input(
+                path.join(HERE, 'fsed-testinput.utf8.txt.gz'), 'utf-8'))
+            # the seams fall in the middle of multi-byte characters
+            # and of matches; "aa" keeps the workers out of step
+            trie, boundaries = fsed.build_trie(CMStringIO(PATTERN_TSV + b'\naa\tA'),
+                                               'tsv', 'utf-8', True)
+            trie = trie.compile()
+            for words in [True, False]:
+                expected = ''.join(fsed.rewrite_blocks_with_trie([text], trie, words))
+                pool = fsed.make_worker_pool(2, trie, words, False, 'utf-8')
+                try:
+                    for range_size in [7, 100, len(text)]:
+                        output = b''.join(fsed.rewrite_byte_ranges(
+                            input_filename, trie, words, 'utf-8', pool, 2,
+                            range_size=range_size, block_size=5))
+                        self.assertEqual(output.decode('utf-8'), expected)
+                finally:
+                    pool.terminate()
+                    pool.join()
+            # --jobs with --across-lines on a regular file
+            with gzip.open(path.join(HERE, 'fsed-testinput.utf8.txt.gz')) as input_file:
+                with open(input_filename, 'wb') as output_file:
+                    output_file.write(input_file.read())
+            with gzip.open(path.join(HERE, 'sed-output.utf8.txt.gz')) as input_file:
+                sed_output = input_file.read().decode('utf-8')
+            exit_code, output, result = click_command_runner(
+                fsed.main, ['--jobs', '2', '-o', '%t',
+                            path.join(HERE, 'fsed-testpats.wb.sed'), input_filename])
+            self.assertEqual(exit_code, 0)
+            self.assertEqual(result, sed_output)
+        finally:
+            shutil.rmtree(tmpdir)
 
 if __name__ == '__main__':
     unittest.main()
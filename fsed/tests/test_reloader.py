@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+test_reloader.py
+(c) Will Roberts  18 October, 2026
+
+Unit tests for the ``reloader`` module.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from .. import reloader
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class TestReloader(unittest.TestCase):
+    '''
+    Unit tests for the `reloader` module.
+    '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pattern_filename = os.path.join(self.tmpdir, 'patterns.tsv')
+        self.write_patterns(b'cat\tdog\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_patterns(self, contents):
+        '''
+        Replaces the pattern file.
+        '''
+        tmp_filename = self.pattern_filename + '.tmp'
+        with open(tmp_filename, 'wb') as output_file:
+            output_file.write(contents)
+        os.rename(tmp_filename, self.pattern_filename)
+
+    def test_check(self):
+        '''
+        Tests reloading the pattern file by hand.
+        '''
+        patterns = reloader.PatternReloader(self.pattern_filename, 'tsv', start=False)
+        self.assertEqual(patterns.rewrite('a cat'), 'a dog')
+        self.assertFalse(patterns.check())
+        automaton = patterns.automaton
+        self.write_patterns(b'cat\tmouse\na\tthe\n')
+        self.assertTrue(patterns.check())
+        self.assertEqual(patterns.reloads, 1)
+        self.assertEqual(patterns.rewrite('a cat'), 'the mouse')
+        self.assertEqual(patterns.rewrite_many(['a cat', 'cat']), ['the mouse', 'mouse'])
+        # the old automaton is not changed
+        trie, _boundaries = automaton
+        self.assertEqual(trie.greedy_replace('a cat'), 'a dog')
+        # unreadable pattern files are ignored
+        self.write_patterns(b'cat\tm\xf6use\n')
+        self.assertFalse(patterns.check())
+        self.assertEqual(patterns.rewrite('a cat'), 'the mouse')
+        os.remove(self.pattern_filename)
+        self.assertFalse(patterns.check())
+        self.assertEqual(patterns.reloads, 1)
+
+    def test_thread(self):
+        '''
+        Tests reloading the pattern file in the background.
+        '''
+        with reloader.PatternReloader(self.pattern_filename, 'tsv',
+                                      interval=0.01) as patterns:
+            self.assertEqual(patterns.rewrite('a cat'), 'a dog')
+            self.write_patterns(b'cat\tmouse\n')
+            deadline = time.time() + 10
+            while patterns.reloads < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(patterns.rewrite('a cat'), 'a mouse')
+        self.assertTrue(patterns._thread is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+test_stats.py
+(c) Will Roberts  18 October, 2026
+
+Unit tests for the ``stats`` module.
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+from .. import ahocorasick
+from .. import stats
+from io import BytesIO, StringIO
+import json
+import unittest
+
+class TestStats(unittest.TestCase):
+    '''
+    Unit tests for the `stats` module.
+    '''
+
+    def test_phases(self):
+        '''
+        Tests timing phases and counting input and output.
+        '''
+        run = stats.Stats()
+        with run.phase('rewrite'):
+            reader = stats.CountingReader(BytesIO(b'one\ntwo\nthree'), run)
+            writer = stats.CountingWriter(BytesIO(), run)
+            for line in reader:
+                writer.write(line.upper())
+        with stats.phase(run, 'rewrite'):
+            pass
+        with stats.phase(None, 'rewrite'):
+            pass
+        run.count('patterns', 3)
+        self.assertEqual(run.counts['input_bytes'], 13)
+        self.assertEqual(run.counts['input_lines'], 2)
+        self.assertEqual(run.counts['output_bytes'], 13)
+        self.assertEqual(run.counts['patterns'], 3)
+        self.assertEqual(list(run.timings), ['rewrite'])
+        output = StringIO()
+        run.write(output)
+        result = json.loads(output.getvalue())
+        self.assertEqual(result['counts'], run.counts)
+        self.assertEqual(set(result['throughput']),
+                         set(['bytes_per_second', 'lines_per_second']))
+
+    def test_automaton_stats(self):
+        '''
+        Tests describing the size of an automaton.
+        '''
+        trie = ahocorasick.AhoCorasickTrie()
+        trie.update({'he': 'HE', 'she': 'SHE', 'hers': 'HERS'})
+        result = stats.automaton_stats(trie)
+        self.assertEqual(result['states'], 8)
+        self.assertEqual(result['edges'], 7)
+        self.assertEqual(result['patterns'], 3)
+        self.assertTrue(result['memory_bytes'] > 0)
+        run = stats.Stats()
+        compiled = trie.compile(stats=run)
+        self.assertEqual(set(run.timings), set(['compile', 'suffix_links']))
+        result = stats.automaton_stats(compiled)
+        self.assertEqual(result['states'], 8)
+        self.assertEqual(result['edges'], 7)
+        self.assertEqual(result['patterns'], 3)
+        self.assertTrue(result['memory_bytes'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,12 @@ Utility functions.
 
 from __future__ import absolute_import
 from fsed.compat import PY3, string_type
+import codecs
 import sys
 
+# number of bytes read at a time by read_blocks
+BLOCK_SIZE = 1 << 16
+
 def open_file(filename, mode='rb'):
     """
     Opens a file for access with the given mode.  This function
@@ -53,3 +57,22 @@ def open_file(filename, mode='rb'):
             return open(filename, mode)
     else:
         raise Exception('Unknown type for argument filename')
+
+def read_blocks(input_file, encoding, block_size=BLOCK_SIZE):
+    """
+    Generator.  Reads the binary file object ``input_file`` in blocks
+    of ``block_size`` bytes and yields them as decoded strings.
+    Multi-byte characters which straddle a block boundary are
+    decoded correctly.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        block = input_file.read(block_size)
+        if not block:
+            break
+        block = decoder.decode(block)
+        if block:
+            yield block
+    block = decoder.decode(b'', True)
+    if block:
+        yield block